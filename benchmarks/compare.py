@@ -0,0 +1,209 @@
+import argparse
+import glob
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from benchmarks.generators import generators
+
+default_corpus = os.path.join(root, 'benchmarks', 'corpus')
+
+
+class Run(object):
+    def __init__(self, stdout: bytes, status: int, wall_time: float, cpu_time: float, max_rss: int) -> None:
+        self.stdout = stdout
+        self.status = status
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        # KiB
+        self.max_rss = max_rss
+
+
+def max_rss_kib(ru_maxrss: int) -> int:
+    # Linux reports KiB, macOS reports bytes.
+    return ru_maxrss // 1024 if sys.platform == 'darwin' else ru_maxrss
+
+
+def spawn(command: Sequence[str], cwd: str, env: Dict[str, str], stdout: int) -> int:
+    # A plain fork rather than subprocess, which uses vfork. The peak memory of a process includes what it had before
+    # exec, after vfork that is the peak of this whole harness, after fork only what the harness has at the time.
+    pid = os.fork()
+    if pid == 0:
+        try:
+            devnull = os.open(os.devnull, os.O_RDWR)
+            os.dup2(devnull, 0)
+            os.dup2(stdout, 1)
+            os.dup2(devnull, 2)
+            os.chdir(cwd)
+            os.execve(command[0], list(command), env)
+        finally:
+            os._exit(127)
+    return pid
+
+
+def run_once(command: Sequence[str], env: Dict[str, str]) -> Run:
+    # Every run starts in an empty directory, scripts may create files. Output goes to a file, so the child never
+    # blocks on a full pipe while we wait for it.
+    with tempfile.TemporaryDirectory() as cwd, tempfile.TemporaryFile() as stdout:
+        start = time.perf_counter()
+        pid = spawn(command, cwd, env, stdout.fileno())
+        pid, wait_status, rusage = os.wait4(pid, 0)
+        wall_time = time.perf_counter() - start
+        status = -os.WTERMSIG(wait_status) if os.WIFSIGNALED(wait_status) else os.WEXITSTATUS(wait_status)
+        stdout.seek(0)
+        return Run(stdout.read(), status, wall_time, rusage.ru_utime + rusage.ru_stime, max_rss_kib(rusage.ru_maxrss))
+
+
+def measure(command: Sequence[str], env: Dict[str, str], repeat: int, floor: int) -> Tuple[Run, Dict[str, Any]]:
+    # The fastest run is the one least disturbed by the rest of the machine.
+    runs = [run_once(command, env) for i in range(repeat)]
+    max_rss = max(run.max_rss for run in runs)
+    return runs[0], {
+        'wall_time': min(run.wall_time for run in runs),
+        'cpu_time': min(run.cpu_time for run in runs),
+        # None when it is no more than what the process inherited from us, its real peak is somewhere below.
+        'max_rss': max_rss if max_rss > floor else None,
+    }
+
+
+def measure_floor(env: Dict[str, str]) -> int:
+    # The peak memory reported for a process that uses next to none.
+    true = shutil.which('true') or '/bin/true'
+    return max(run_once([true], env).max_rss for i in range(3)) * 11 // 10
+
+
+def ratio(pysh: Optional[float], shell: Optional[float]) -> Optional[float]:
+    if pysh is None or shell is None or shell <= 0:
+        return None
+    return pysh / shell
+
+
+def compare_script(name: str, path: str, shell: str, pysh: Sequence[str], env: Dict[str, str],
+                   repeat: int, floor: int) -> Dict[str, Any]:
+    shell_run, shell_stats = measure([shell, path], env, repeat, floor)
+    pysh_run, pysh_stats = measure(list(pysh) + [path], env, repeat, floor)
+
+    mismatches = []
+    if shell_run.status != pysh_run.status:
+        mismatches.append('status {0} vs {1}'.format(shell_run.status, pysh_run.status))
+    if shell_run.stdout != pysh_run.stdout:
+        mismatches.append('stdout differs')
+    return {
+        'script': name,
+        'match': len(mismatches) == 0,
+        'mismatches': mismatches,
+        'shell': shell_stats,
+        'pysh': pysh_stats,
+        'ratios': {key: ratio(pysh_stats[key], shell_stats[key]) for key in ('wall_time', 'cpu_time', 'max_rss')},
+    }
+
+
+def collect_scripts(paths: List[str], generated_size: int, scratch: str) -> List[Tuple[str, str]]:
+    scripts: List[Tuple[str, str]] = []
+    for path in paths:
+        if os.path.isdir(path):
+            scripts += [(os.path.basename(script), script) for script in sorted(glob.glob(os.path.join(path, '*.sh')))]
+        else:
+            scripts.append((os.path.basename(path), path))
+    # The synthetic scripts of run.py only call true and false, which every shell has.
+    if generated_size > 0:
+        for scenario in sorted(generators):
+            path = os.path.join(scratch, '{0}-{1}.sh'.format(scenario, generated_size))
+            with open(path, 'w') as f:
+                f.write(generators[scenario](generated_size))
+            scripts.append((os.path.basename(path), path))
+    return scripts
+
+
+def geometric_mean(values: List[Optional[float]]) -> Optional[float]:
+    known = [value for value in values if value is not None and value > 0]
+    if len(known) == 0:
+        return None
+    return math.exp(sum(math.log(value) for value in known) / len(known))
+
+
+def format_ratio(value: Optional[float]) -> str:
+    return '{0:.1f}x'.format(value) if value is not None else 'n/a'
+
+
+def format_rss(value: Optional[int], floor: int) -> str:
+    return '{0:,}'.format(value) if value is not None else '<{0:,}'.format(floor)
+
+
+def print_results(results: List[Dict[str, Any]], shell: str, floor: int) -> None:
+    print('{0:<24} {1:<6} {2:>10} {3:>10} {4:>7}  {5:>9} {6:>9} {7:>7}  {8:>9} {9:>9} {10:>7}'.format(
+        'script', 'match', 'sh ms', 'pysh ms', 'ratio', 'sh cpu', 'pysh cpu', 'ratio', 'sh KiB', 'pysh KiB', 'ratio'))
+    for result in results:
+        shell_stats = result['shell']
+        pysh_stats = result['pysh']
+        ratios = result['ratios']
+        print('{0:<24} {1:<6} {2:>10.2f} {3:>10.2f} {4:>7}  {5:>9.2f} {6:>9.2f} {7:>7}  {8:>9} {9:>9} {10:>7}'.format(
+            result['script'], 'ok' if result['match'] else 'DIFF',
+            shell_stats['wall_time'] * 1000, pysh_stats['wall_time'] * 1000, format_ratio(ratios['wall_time']),
+            shell_stats['cpu_time'] * 1000, pysh_stats['cpu_time'] * 1000, format_ratio(ratios['cpu_time']),
+            format_rss(shell_stats['max_rss'], floor), format_rss(pysh_stats['max_rss'], floor),
+            format_ratio(ratios['max_rss'])))
+
+    print()
+    print('{0} scripts, {1} mismatched, compared against {2}'.format(
+        len(results), sum(1 for result in results if not result['match']), shell))
+    for key, label in (('wall_time', 'wall time'), ('cpu_time', 'CPU time')):
+        shell_total = sum(result['shell'][key] for result in results)
+        pysh_total = sum(result['pysh'][key] for result in results)
+        print('{0:<12} total {1}, geometric mean {2}'.format(
+            label, format_ratio(ratio(pysh_total, shell_total)),
+            format_ratio(geometric_mean([result['ratios'][key] for result in results]))))
+    print('{0:<12} geometric mean {1}, peaks of {2:,} KiB and less are hidden by the harness itself'.format(
+        'peak memory', format_ratio(geometric_mean([result['ratios']['max_rss'] for result in results])), floor))
+    for result in results:
+        if not result['match']:
+            sys.stderr.write('{0}: {1}\n'.format(result['script'], ', '.join(result['mismatches'])))
+
+
+def make_argparser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description='Run scripts through pysh and the system shell, check that they agree and compare their cost.')
+    parser.add_argument('scripts', nargs='*', help='scripts or directories of *.sh scripts (default: the corpus)')
+    parser.add_argument('--shell', default='/bin/sh', help='shell to compare against (default: %(default)s)')
+    parser.add_argument('--generated-size', type=int, default=1000,
+                        help='also run the synthetic scripts of run.py at this size, 0 to leave them out')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per script and shell, the fastest is kept')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    return parser
+
+
+def main() -> int:
+    args = make_argparser().parse_args()
+    shell = shutil.which(args.shell)
+    if shell is None:
+        sys.stderr.write('{0}: shell not found\n'.format(args.shell))
+        return 2
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = root + os.pathsep + env.get('PYTHONPATH', '')
+    pysh = [sys.executable, '-W', 'ignore', '-m', 'pysh']
+
+    floor = measure_floor(env)
+    with tempfile.TemporaryDirectory() as scratch:
+        scripts = collect_scripts(args.scripts or [default_corpus], args.generated_size, scratch)
+        results = [compare_script(name, os.path.abspath(path), shell, pysh, env, max(1, args.repeat), floor)
+                   for name, path in scripts]
+
+    print_results(results, shell, floor)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'shell': shell, 'python': sys.version.split()[0], 'max_rss_floor': floor, 'results': results},
+                      f, indent=2)
+    return 0 if all(result['match'] for result in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
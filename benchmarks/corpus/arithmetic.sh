@@ -0,0 +1,17 @@
+I=5
+J=12
+echo $((I + J)) $((J - I)) $((I * J)) $((J / I)) $((J % I))
+echo $((I * I + J * J))
+echo $(( (I + 1) * (J - 2) ))
+echo $((I < J)) $((I > J)) $((I == 5)) $((I != 5))
+echo $((I << 3)) $((J >> 1)) $((I & J)) $((I | J)) $((I ^ J))
+echo $((-I)) $((~I)) $((!I))
+echo $((I > 3 ? 100 : 200))
+K=$((I * 1000 + J))
+echo $K
+echo $((K % 97))
+echo $((1 + 2 * 3 - 4 / 2))
+A=$((I + 1))
+B=$((A + 1))
+C=$((B + 1))
+echo $A $B $C $((A + B + C))
@@ -0,0 +1,19 @@
+echo one > first.txt
+echo two >> first.txt
+echo three > second.txt
+cat first.txt second.txt
+cat < second.txt
+echo *.txt
+wc -l first.txt
+cat missing-file 2> /dev/null
+echo missing $?
+(echo in subshell; exit 4)
+echo subshell $?
+(X=inner; echo $X)
+echo error >&2
+test -f first.txt && echo file exists
+test -d first.txt || echo not a directory
+printf "%s\n" printed
+env > /dev/null && echo env ran
+sh -c "exit 3"
+echo child $?
@@ -0,0 +1,34 @@
+X=3
+Y=7
+if test $X -lt $Y
+then
+    echo less
+else
+    echo not less
+fi
+if [ "$X" = 3 ]; then echo three; fi
+if [ -z "$UNSET_VARIABLE" ]; then echo empty; else echo set; fi
+if [ -n "$X" ] && [ $Y -gt 5 ]; then echo both; fi
+true && echo and-true
+false && echo and-false
+false || echo or-false
+true || echo or-true
+false || false || echo last
+true && false || echo recovered
+! false && echo negated
+if ! [ $X -eq $Y ]; then echo differ; fi
+if false
+then
+    echo no
+else
+    if true
+    then
+        echo nested
+    fi
+fi
+false
+echo status $?
+true
+echo status $?
+if [ $X -ge 3 -a $Y -le 7 ]; then echo range; fi
+if [ $X -ne 3 -o $Y -eq 7 ]; then echo either; fi
@@ -0,0 +1 @@
+echo hello
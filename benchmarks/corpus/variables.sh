@@ -0,0 +1,30 @@
+NAME=pysh
+GREETING="hello   world"
+EMPTY=
+LIST="alpha beta gamma delta"
+echo $NAME
+echo "$NAME"
+echo ${NAME}lang
+echo $GREETING
+echo "$GREETING"
+echo before $EMPTY after
+echo "before $EMPTY after"
+echo $LIST
+echo "$LIST"
+COPY=$LIST
+echo $COPY
+PREFIX=/usr/local
+BIN=${PREFIX}/bin
+LIB=$PREFIX/lib
+echo $BIN $LIB
+echo $PREFIX/bin "$PREFIX/share" $PREFIX/lib/
+X=5
+echo $X-1 $X.txt $NAME:$X "$NAME:$X" $X,$X $X+1 $X@host
+A=1 B=2 C=3
+echo $A$B$C
+echo "$A $B $C"
+NAME=changed
+echo $NAME ${NAME}
+FIRST=one; SECOND=two; THIRD=three
+echo $FIRST $SECOND $THIRD
+echo "$FIRST" "$SECOND" "$THIRD"
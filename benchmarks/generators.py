@@ -0,0 +1,47 @@
+from typing import Callable, Dict, List
+
+
+# Every generated script only calls builtins that produce no output, so executing it measures the interpreter rather
+# than process creation or terminal writes.
+
+
+def flat_script(size: int) -> str:
+    lines: List[str] = []
+    for i in range(size):
+        lines.append('true arg{0} "quoted {0}" other\n'.format(i))
+    return ''.join(lines)
+
+
+def nested_script(size: int) -> str:
+    lines: List[str] = []
+    for i in range(size):
+        condition = 'true' if i % 2 == 0 else 'false'
+        lines.append('if {0} {1}\nthen\n'.format(condition, i))
+    lines.append('true innermost\n')
+    for i in range(size):
+        lines.append('else\ntrue branch{0}\nfi\n'.format(i))
+    return ''.join(lines)
+
+
+def expansion_script(size: int) -> str:
+    lines: List[str] = []
+    for i in range(size):
+        lines.append('VAR{0}=value{0}\n'.format(i))
+        lines.append('true $VAR{0} ${{VAR{0}}}suffix "$VAR{0}" prefix$VAR{0}\n'.format(i))
+    return ''.join(lines)
+
+
+def constant_script(size: int) -> str:
+    argument = 'x' * 4096
+    lines: List[str] = []
+    for i in range(size):
+        lines.append('true {0} "{0}"\n'.format(argument))
+    return ''.join(lines)
+
+
+generators: Dict[str, Callable[[int], str]] = {
+    'flat': flat_script,
+    'nested': nested_script,
+    'expansion': expansion_script,
+    'constant': constant_script,
+}
@@ -0,0 +1,158 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.generators import generators
+from pysh.codegen import CodeGenerator
+from pysh.interpreter import Interpreter, install_builtins
+from pysh.lexer import Lexer
+from pysh.parser import Parser
+from pysh.profiler import Profiler, ProfilingInterpreter
+from pysh.slots import SlotTable
+
+
+default_sizes: Dict[str, List[int]] = {
+    'flat': [100, 1000, 3000],
+    'nested': [10, 50, 200],
+    'expansion': [100, 1000, 3000],
+    'constant': [10, 50, 200],
+}
+
+
+def best_of(repeat: int, func: Callable[[], Any]) -> Tuple[float, Any]:
+    best = float('inf')
+    result = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def execute(code: List[Any], slot_table: SlotTable) -> None:
+    interpreter = Interpreter()
+    install_builtins(interpreter)
+    interpreter.slot_table = slot_table
+    interpreter.execute(code)
+
+
+def count_executed(code: List[Any], slot_table: SlotTable) -> int:
+    # Branches skip code, so count what actually runs in a separate, untimed pass.
+    profiler = Profiler()
+    interpreter = ProfilingInterpreter(profiler)
+    install_builtins(interpreter)
+    interpreter.slot_table = slot_table
+    interpreter.execute(code)
+    return sum(profiler.opcode_counts.values())
+
+
+def measure(scenario: str, size: int, repeat: int, fold_builtins: bool) -> List[Dict[str, Any]]:
+    source = generators[scenario](size)
+
+    lex_time, tokens = best_of(repeat, lambda: Lexer().lex_all(source))
+    parse_time, nodes = best_of(repeat, lambda: Parser().parse(list(tokens)))
+    slot_table = SlotTable()
+    codegen_time, code = best_of(repeat, lambda: CodeGenerator(slot_table, fold_builtins).generate(nodes))
+    execute_time, _ = best_of(repeat, lambda: execute(code, slot_table))
+
+    def result(stage: str, elapsed: float, units: int, unit_name: str) -> Dict[str, Any]:
+        return {
+            'scenario': scenario,
+            'size': size,
+            'stage': stage,
+            'time': elapsed,
+            'units': units,
+            'unit': unit_name,
+            'throughput': units / elapsed if elapsed > 0 else 0.0,
+        }
+
+    return [
+        result('lex', lex_time, len(tokens), 'tokens'),
+        result('parse', parse_time, len(tokens), 'tokens'),
+        result('codegen', codegen_time, len(code), 'instructions'),
+        result('execute', execute_time, count_executed(code, slot_table), 'instructions'),
+    ]
+
+
+def get_revision() -> Optional[str]:
+    try:
+        output = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    revision = output.stdout.decode().strip()
+    return revision if output.returncode == 0 and revision else None
+
+
+def result_key(result: Dict[str, Any]) -> Tuple[str, int, str]:
+    return result['scenario'], result['size'], result['stage']
+
+
+def print_results(results: List[Dict[str, Any]], baseline: Optional[Dict[Tuple[str, int, str], Any]]) -> None:
+    header = '{0:<10} {1:>6} {2:<8} {3:>12} {4:>16}'.format('scenario', 'size', 'stage', 'time (ms)', 'throughput/s')
+    if baseline is not None:
+        header += ' {0:>9}'.format('vs base')
+    print(header)
+    for result in results:
+        line = '{0:<10} {1:>6} {2:<8} {3:>12.3f} {4:>16,.0f} {5}'.format(
+            result['scenario'], result['size'], result['stage'], result['time'] * 1000, result['throughput'],
+            result['unit'])
+        if baseline is not None:
+            base = baseline.get(result_key(result))
+            if base is not None and result['time'] > 0:
+                line += ' {0:>8.2f}x'.format(base['time'] / result['time'])
+        print(line)
+
+
+def make_argparser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Measure throughput of every pysh pipeline stage.')
+    parser.add_argument('--scenario', action='append', choices=sorted(generators),
+                        help='scenario to run, may be given more than once (default: all)')
+    parser.add_argument('--size', action='append', type=int, help='input size, overrides the per-scenario defaults')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per measurement, the fastest is kept')
+    parser.add_argument('--fold', action='store_true',
+                        help='evaluate calls of pure builtins with constant arguments ahead of time, as pysh does')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against (>1x is faster)')
+    return parser
+
+
+def main() -> int:
+    args = make_argparser().parse_args()
+    scenarios = args.scenario or sorted(generators)
+
+    baseline: Optional[Dict[Tuple[str, int, str], Any]] = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {result_key(result): result for result in json.load(f)['results']}
+
+    results: List[Dict[str, Any]] = []
+    for scenario in scenarios:
+        for size in args.size or default_sizes[scenario]:
+            results.extend(measure(scenario, size, args.repeat, args.fold))
+
+    print_results(results, baseline)
+
+    if args.output:
+        document = {
+            'revision': get_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.time(),
+            'repeat': args.repeat,
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that only debug modes, profiling or external commands need. None of them may be imported to run
+# `pysh -c true`.
+forbidden_modules = (
+    'argparse',
+    'subprocess',
+    'json',
+    'tracemalloc',
+    'pysh.il',
+    'pysh.syntaxnoderepr',
+    'pysh.profiler',
+    'pysh.timings',
+    'pysh.builtins.test',
+)
+
+run_pysh = 'import sys; sys.argv = ["pysh"] + sys.argv[1:]; import pysh; pysh.main()'
+
+
+def measure_imports(args: List[str]) -> Dict[str, Tuple[int, int]]:
+    env = dict(os.environ)
+    env['PYTHONPATH'] = root + os.pathsep + env.get('PYTHONPATH', '')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-W', 'ignore', '-c', run_pysh] + args,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env, cwd=root)
+    imports: Dict[str, Tuple[int, int]] = {}
+    for line in result.stderr.decode().splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        imports[fields[2].strip()] = (int(fields[0]), int(fields[1]))
+    return imports
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Check which modules `pysh -c true` imports and how long it takes.')
+    parser.add_argument('--budget-ms', type=float, default=None,
+                        help='fail if importing pysh takes longer than this (cumulative, best of --repeat)')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    best = None
+    imports: Dict[str, Tuple[int, int]] = {}
+    for i in range(args.repeat):
+        imports = measure_imports(['-c', 'true'])
+        if 'pysh' not in imports:
+            sys.stderr.write('pysh was not imported, is the interpreter broken?\n')
+            return 2
+        cumulative = imports['pysh'][1] + imports.get('pysh.interactive', (0, 0))[1]
+        best = cumulative if best is None else min(best, cumulative)
+
+    failed = False
+    for module in forbidden_modules:
+        if module in imports:
+            sys.stderr.write('{0} is imported on the execution path\n'.format(module))
+            failed = True
+
+    pysh_modules = sorted((name for name in imports if name == 'pysh' or name.startswith('pysh.')),
+                          key=lambda name: imports[name][0], reverse=True)
+    for name in pysh_modules:
+        print('{0:>8.2f} ms  {1}'.format(imports[name][0] / 1000, name))
+    print('{0:>8.2f} ms  total (best of {1})'.format(best / 1000, args.repeat))
+
+    if args.budget_ms is not None and best / 1000 > args.budget_ms:
+        sys.stderr.write('import time {0:.2f} ms exceeds the budget of {1:.2f} ms\n'.format(best / 1000, args.budget_ms))
+        failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,20 @@
 import sys
+import time
+from typing import Any
 
-from pysh.interactive import Interactive
+# Taken before any other pysh module is imported, so --timings can report import cost.
+start_time = time.perf_counter()
 
 
 def main() -> None:
-    instance = Interactive()
+    from pysh.interactive import Interactive
+    instance = Interactive(start_time)
     sys.exit(instance.main())
+
+
+def __getattr__(name: str) -> Any:
+    # pysh.compile and pysh.Program load the compiler on first use, so `import pysh` stays cheap for the client.
+    if name == 'compile' or name == 'Program':
+        from pysh import program
+        return getattr(program, name)
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
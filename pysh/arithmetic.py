@@ -0,0 +1,387 @@
+import re
+from typing import Any, Callable, Dict, List, Optional, Pattern, Tuple
+
+# Arithmetic of $(( ... )). Like other shells it works on signed 64 bit integers, division truncates towards zero and
+# comparisons and logical operators yield 1 or 0. Parts of the expression that only involve numbers are folded while
+# parsing, so they cost nothing at run time.
+
+Evaluator = Callable[[List[int]], int]
+
+
+class ArithmeticSyntaxError(Exception):
+    pass
+
+
+def wrap(value: int) -> int:
+    if -0x8000000000000000 <= value <= 0x7fffffffffffffff:
+        return value
+    return ((value + 0x8000000000000000) & 0xffffffffffffffff) - 0x8000000000000000
+
+
+# Compiled on first use, most scripts never get past the fast path of to_integer or have any arithmetic at all.
+number_pattern: Optional[Pattern[str]] = None
+token_pattern: Optional[Pattern[str]] = None
+
+
+def to_integer(text: str) -> int:
+    # Variables hold text, an empty or unset one counts as 0.
+    if text.isdigit() and (text[0] != '0' or len(text) == 1):
+        return wrap(int(text))
+    text = text.strip()
+    if len(text) == 0:
+        return 0
+    global number_pattern
+    if number_pattern is None:
+        number_pattern = re.compile(r'([-+]?)(0[xX][0-9a-fA-F]+|0[0-7]*|[1-9][0-9]*)')
+    match = number_pattern.fullmatch(text)
+    if match is None:
+        raise ValueError('{0}: not a number'.format(text))
+    sign, digits = match.groups()
+    if digits.startswith(('0x', '0X')):
+        value = int(digits[2:], 16)
+    elif len(digits) > 1:
+        value = int(digits, 8)
+    else:
+        value = int(digits)
+    return wrap(-value if sign == '-' else value)
+
+
+def divide(left: int, right: int) -> int:
+    if right == 0:
+        raise ZeroDivisionError('division by 0')
+    quotient = abs(left) // abs(right)
+    return wrap(quotient if (left < 0) == (right < 0) else -quotient)
+
+
+def remainder(left: int, right: int) -> int:
+    if right == 0:
+        raise ZeroDivisionError('division by 0')
+    return left - right * divide(left, right)
+
+
+def power(left: int, right: int) -> int:
+    if right < 0:
+        raise ValueError('exponent less than 0')
+    return wrap(pow(left, right, 0x10000000000000000))
+
+
+unary_operators: Dict[str, Callable[[int], int]] = {
+    '-': lambda value: wrap(-value),
+    '+': lambda value: value,
+    '!': lambda value: 1 if value == 0 else 0,
+    '~': lambda value: ~value,
+}
+
+binary_operators: Dict[str, Callable[[int, int], int]] = {
+    '**': power,
+    '*': lambda left, right: wrap(left * right),
+    '/': divide,
+    '%': remainder,
+    '+': lambda left, right: wrap(left + right),
+    '-': lambda left, right: wrap(left - right),
+    # The shift count is taken modulo 64, as the machine instructions do.
+    '<<': lambda left, right: wrap(left << (right & 63)),
+    '>>': lambda left, right: left >> (right & 63),
+    '<': lambda left, right: 1 if left < right else 0,
+    '<=': lambda left, right: 1 if left <= right else 0,
+    '>': lambda left, right: 1 if left > right else 0,
+    '>=': lambda left, right: 1 if left >= right else 0,
+    '==': lambda left, right: 1 if left == right else 0,
+    '!=': lambda left, right: 1 if left != right else 0,
+    '&': lambda left, right: left & right,
+    '^': lambda left, right: left ^ right,
+    '|': lambda left, right: left | right,
+    '&&': lambda left, right: 1 if left != 0 and right != 0 else 0,
+    '||': lambda left, right: 1 if left != 0 or right != 0 else 0,
+}
+
+binary_precedence: Dict[str, int] = {
+    '||': 1,
+    '&&': 2,
+    '|': 3,
+    '^': 4,
+    '&': 5,
+    '==': 6, '!=': 6,
+    '<': 7, '<=': 7, '>': 7, '>=': 7,
+    '<<': 8, '>>': 8,
+    '+': 9, '-': 9,
+    '*': 10, '/': 10, '%': 10,
+    '**': 11,
+}
+
+
+class ArithmeticNode(object):
+    def accept(self, visitor: 'ArithmeticNodeVisitor') -> Any:
+        pass
+
+
+class NumberNode(ArithmeticNode):
+    def __init__(self, value: int) -> None:
+        self.value = value
+
+    def accept(self, visitor: 'ArithmeticNodeVisitor') -> Any:
+        return visitor.visit_number(self)
+
+
+class VariableNode(ArithmeticNode):
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def accept(self, visitor: 'ArithmeticNodeVisitor') -> Any:
+        return visitor.visit_variable(self)
+
+
+class UnaryNode(ArithmeticNode):
+    def __init__(self, operator: str, operand: ArithmeticNode) -> None:
+        self.operator = operator
+        self.operand = operand
+
+    def accept(self, visitor: 'ArithmeticNodeVisitor') -> Any:
+        return visitor.visit_unary(self)
+
+
+class BinaryNode(ArithmeticNode):
+    def __init__(self, operator: str, left: ArithmeticNode, right: ArithmeticNode) -> None:
+        self.operator = operator
+        self.left = left
+        self.right = right
+
+    def accept(self, visitor: 'ArithmeticNodeVisitor') -> Any:
+        return visitor.visit_binary(self)
+
+
+class TernaryNode(ArithmeticNode):
+    def __init__(self, condition: ArithmeticNode, if_true: ArithmeticNode, if_false: ArithmeticNode) -> None:
+        self.condition = condition
+        self.if_true = if_true
+        self.if_false = if_false
+
+    def accept(self, visitor: 'ArithmeticNodeVisitor') -> Any:
+        return visitor.visit_ternary(self)
+
+
+class ArithmeticNodeVisitor(object):
+    def visit_number(self, node: NumberNode) -> Any:
+        raise NotImplementedError()
+
+    def visit_variable(self, node: VariableNode) -> Any:
+        raise NotImplementedError()
+
+    def visit_unary(self, node: UnaryNode) -> Any:
+        raise NotImplementedError()
+
+    def visit_binary(self, node: BinaryNode) -> Any:
+        raise NotImplementedError()
+
+    def visit_ternary(self, node: TernaryNode) -> Any:
+        raise NotImplementedError()
+
+
+def make_unary(operator: str, operand: ArithmeticNode) -> ArithmeticNode:
+    if isinstance(operand, NumberNode):
+        return NumberNode(unary_operators[operator](operand.value))
+    return UnaryNode(operator, operand)
+
+
+def make_binary(operator: str, left: ArithmeticNode, right: ArithmeticNode) -> ArithmeticNode:
+    if isinstance(left, NumberNode):
+        if isinstance(right, NumberNode):
+            try:
+                return NumberNode(binary_operators[operator](left.value, right.value))
+            except (ValueError, ZeroDivisionError):
+                # Left to run time, where it is only an error if the code is actually reached.
+                pass
+        elif operator == '&&' and left.value == 0:
+            return NumberNode(0)
+        elif operator == '||' and left.value != 0:
+            return NumberNode(1)
+    return BinaryNode(operator, left, right)
+
+
+def make_ternary(condition: ArithmeticNode, if_true: ArithmeticNode, if_false: ArithmeticNode) -> ArithmeticNode:
+    if isinstance(condition, NumberNode):
+        return if_true if condition.value != 0 else if_false
+    return TernaryNode(condition, if_true, if_false)
+
+
+# Kinds of tokens, a token is a (kind, value) tuple.
+NUMBER = 0
+VARIABLE = 1
+OPERATOR = 2
+
+
+def tokenize(source: str) -> List[Tuple[int, Any]]:
+    global token_pattern
+    if token_pattern is None:
+        token_pattern = re.compile(r'\s*(?:(\d\w*)|\$\{(\?|#|\w+)\}|\$(\?|#|\d|[A-Za-z_]\w*)|([A-Za-z_]\w*)|'
+                                   r'(\*\*|<<|>>|<=|>=|==|!=|&&|\|\||[-+*/%<>&|^!~?:()]))')
+    tokens: List[Tuple[int, Any]] = []
+    pos = 0
+    end = len(source.rstrip())
+    while pos < end:
+        match = token_pattern.match(source, pos)
+        if match is None:
+            raise ArithmeticSyntaxError('{0}: syntax error near "{1}"'.format(source.strip(), source[pos:].strip()))
+        number, braced, dollar, name, operator = match.groups()
+        if number is not None:
+            try:
+                tokens.append((NUMBER, to_integer(number)))
+            except ValueError as e:
+                raise ArithmeticSyntaxError(str(e)) from e
+        elif operator is not None:
+            tokens.append((OPERATOR, operator))
+        else:
+            tokens.append((VARIABLE, braced or dollar or name))
+        pos = match.end()
+    return tokens
+
+
+class ArithmeticParser(object):
+    def __init__(self, source: str) -> None:
+        self.source = source
+        self.tokens = tokenize(source)
+        self.pos = 0
+
+    def parse(self) -> ArithmeticNode:
+        if len(self.tokens) == 0:
+            return NumberNode(0)
+        node = self.parse_ternary()
+        if self.pos < len(self.tokens):
+            self.fail()
+        return node
+
+    def fail(self) -> None:
+        if self.pos < len(self.tokens):
+            near = str(self.tokens[self.pos][1])
+        else:
+            near = 'end of expression'
+        raise ArithmeticSyntaxError('{0}: syntax error near {1}'.format(self.source.strip(), near))
+
+    def peek_operator(self) -> Optional[str]:
+        if self.pos < len(self.tokens) and self.tokens[self.pos][0] == OPERATOR:
+            return self.tokens[self.pos][1]
+        return None
+
+    def expect(self, operator: str) -> None:
+        if self.peek_operator() != operator:
+            self.fail()
+        self.pos += 1
+
+    def parse_ternary(self) -> ArithmeticNode:
+        condition = self.parse_binary(1)
+        if self.peek_operator() != '?':
+            return condition
+        self.pos += 1
+        if_true = self.parse_ternary()
+        self.expect(':')
+        if_false = self.parse_ternary()
+        return make_ternary(condition, if_true, if_false)
+
+    def parse_binary(self, min_precedence: int) -> ArithmeticNode:
+        left = self.parse_unary()
+        while True:
+            operator = self.peek_operator()
+            precedence = binary_precedence.get(operator) if operator is not None else None
+            if precedence is None or precedence < min_precedence:
+                return left
+            self.pos += 1
+            # ** groups to the right, everything else to the left.
+            right = self.parse_binary(precedence if operator == '**' else precedence + 1)
+            left = make_binary(operator, left, right)
+
+    def parse_unary(self) -> ArithmeticNode:
+        if self.pos >= len(self.tokens):
+            self.fail()
+        kind, value = self.tokens[self.pos]
+        self.pos += 1
+        if kind == NUMBER:
+            return NumberNode(value)
+        if kind == VARIABLE:
+            return VariableNode(value)
+        if value in unary_operators:
+            return make_unary(value, self.parse_unary())
+        if value == '(':
+            node = self.parse_ternary()
+            self.expect(')')
+            return node
+        self.pos -= 1
+        self.fail()
+
+
+def parse_arithmetic(source: str) -> ArithmeticNode:
+    return ArithmeticParser(source).parse()
+
+
+class ArithmeticCompiler(ArithmeticNodeVisitor):
+    # Turns an expression into nested closures. They are called with the values of the variables, in the order of
+    # names.
+    def __init__(self) -> None:
+        self.names: List[str] = []
+        self.indices: Dict[str, int] = {}
+
+    def visit_number(self, node: NumberNode) -> Evaluator:
+        value = node.value
+        return lambda operands: value
+
+    def visit_variable(self, node: VariableNode) -> Evaluator:
+        index = self.indices.get(node.name)
+        if index is None:
+            index = len(self.names)
+            self.names.append(node.name)
+            self.indices[node.name] = index
+        return lambda operands: operands[index]
+
+    def visit_unary(self, node: UnaryNode) -> Evaluator:
+        function = unary_operators[node.operator]
+        operand = node.operand.accept(self)
+        return lambda operands: function(operand(operands))
+
+    def visit_binary(self, node: BinaryNode) -> Evaluator:
+        left = node.left.accept(self)
+        right = node.right.accept(self)
+        if node.operator == '&&':
+            return lambda operands: 1 if left(operands) != 0 and right(operands) != 0 else 0
+        if node.operator == '||':
+            return lambda operands: 1 if left(operands) != 0 or right(operands) != 0 else 0
+        function = binary_operators[node.operator]
+        return lambda operands: function(left(operands), right(operands))
+
+    def visit_ternary(self, node: TernaryNode) -> Evaluator:
+        condition = node.condition.accept(self)
+        if_true = node.if_true.accept(self)
+        if_false = node.if_false.accept(self)
+        return lambda operands: if_true(operands) if condition(operands) != 0 else if_false(operands)
+
+
+def compile_arithmetic(node: ArithmeticNode) -> Tuple[List[str], Evaluator]:
+    compiler = ArithmeticCompiler()
+    evaluate = node.accept(compiler)
+    return compiler.names, evaluate
+
+
+class ArithmeticFormatter(ArithmeticNodeVisitor):
+    def format_operand(self, node: ArithmeticNode) -> str:
+        text = node.accept(self)
+        if isinstance(node, BinaryNode) or isinstance(node, TernaryNode):
+            return '(' + text + ')'
+        return text
+
+    def visit_number(self, node: NumberNode) -> str:
+        return str(node.value)
+
+    def visit_variable(self, node: VariableNode) -> str:
+        return node.name
+
+    def visit_unary(self, node: UnaryNode) -> str:
+        return node.operator + self.format_operand(node.operand)
+
+    def visit_binary(self, node: BinaryNode) -> str:
+        return '{0} {1} {2}'.format(self.format_operand(node.left), node.operator, self.format_operand(node.right))
+
+    def visit_ternary(self, node: TernaryNode) -> str:
+        return '{0} ? {1} : {2}'.format(self.format_operand(node.condition), self.format_operand(node.if_true),
+                                        self.format_operand(node.if_false))
+
+
+def format_arithmetic(node: ArithmeticNode) -> str:
+    return node.accept(ArithmeticFormatter())
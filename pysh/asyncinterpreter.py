@@ -0,0 +1,134 @@
+import asyncio
+import time
+from typing import Iterable, Optional, Sequence, TextIO
+
+from pysh.builtins import InvokeInfo
+from pysh.instructions import Instruction, CallInstruction
+from pysh.interpreter import Interpreter, ExecutionError
+from pysh.output import make_output_decoder
+
+
+class AsyncInterpreter(Interpreter):
+    # Runs on an event loop, external commands are awaited instead of blocking the thread. Builtins are still called
+    # synchronously, they are expected to be quick.
+
+    # Number of instructions to run before giving other tasks a turn. Yielding after every instruction would cost more
+    # than the instructions themselves.
+    yield_interval = 64
+
+    async def execute(self, code: Iterable[Instruction], verified: bool = False) -> bool:
+        if not isinstance(self.code, list):
+            self.code = list(self.code)
+        self.code.extend(code)
+        self.verified = verified
+        self.load_slots()
+        start = self.pc
+        try:
+            return await self.resume()
+        finally:
+            self.count_instructions(start)
+            self.flush_slots()
+            self.flush_output()
+
+    async def run(self, code: Sequence[Instruction], verified: bool = False) -> int:
+        self.code = code
+        self.pc = 0
+        self.verified = verified
+        self.load_slots()
+        try:
+            await self.resume()
+        finally:
+            self.count_instructions(0)
+            self.flush_slots()
+            self.flush_output()
+            self.code = []
+            self.pc = 0
+        return self.rv
+
+    async def resume(self) -> bool:
+        code_len = len(self.code)
+        budget = self.yield_interval
+        try:
+            while self.pc < code_len:
+                instruction = self.code[self.pc]
+                if type(instruction) is CallInstruction:
+                    await self.call()
+                    budget = self.yield_interval
+                else:
+                    instruction.accept(self)
+                    budget -= 1
+                    if budget == 0:
+                        budget = self.yield_interval
+                        await asyncio.sleep(0)
+                self.pc += 1
+        except ExecutionError as e:
+            self.abort(e)
+            return False
+        return True
+
+    async def call(self) -> None:
+        try:
+            call = self.prepare_call()
+            if call is None:
+                return
+            target, invoke_info = call
+
+            try:
+                if target is None:
+                    self.rv = await self.invoke_subprocess_async(invoke_info)
+                else:
+                    if self.usage is not None:
+                        target = self.usage.timed(target, self.code[self.pc].line)
+                    self.rv = target(invoke_info)
+                    await asyncio.sleep(0)
+            except SystemExit as e:
+                if len(self.context_stack) == 0:
+                    raise
+                self.exit_subshell(e)
+        finally:
+            if len(self.redirections) > 0:
+                self.finish_redirections()
+
+    async def invoke_subprocess_async(self, info: InvokeInfo) -> int:
+        self.stat_cache.invalidate()
+        stdin_fd, stdout_fd, stderr_fd, relay = self.child_stdio(info)
+
+        line = self.code[self.pc].line
+        start = time.perf_counter()
+        status = await self.run_child(info, stdin_fd, stdout_fd, stderr_fd, relay)
+        if self.usage is not None:
+            # The event loop reaps the child, only wall time is known here.
+            self.usage.record_external(info, line, status, time.perf_counter() - start, None)
+        return status
+
+    async def run_child(self, info: InvokeInfo, stdin_fd: Optional[int], stdout_fd: Optional[int],
+                        stderr_fd: Optional[int], relay: Optional[TextIO]) -> int:
+        start = time.perf_counter()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *info.arguments, cwd=info.pwd, env=dict(info.env), stdin=stdin_fd,
+                stdout=stdout_fd if relay is None else asyncio.subprocess.PIPE, stderr=stderr_fd)
+        except OSError:
+            self.print_error('failed to execute ' + info.arguments[0])
+            return 127
+        self.record_spawn(start)
+
+        try:
+            if relay is not None:
+                # Not backed by a file descriptor, the child's output has to be relayed.
+                decoder = make_output_decoder()
+                while True:
+                    chunk = await process.stdout.read(65536)
+                    if len(chunk) == 0:
+                        break
+                    relay.write(decoder.decode(chunk))
+                relay.write(decoder.decode(b'', True))
+            return await process.wait()
+        except BaseException:
+            # Cancelled most likely, the child must not outlive us or be left unreaped.
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+            raise
@@ -0,0 +1,182 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from contextlib import redirect_stderr
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from pysh.interpreter import Context
+from pysh.output import CaptureBuffer
+from pysh.parser import ParseError
+from pysh.program import CompileCache, Program
+
+# A manifest has one JSON object per line:
+#   {"id": "tenant-1", "script": "path/to/script.pysh", "env": {"NAME": "value"}, "cwd": "/some/dir"}
+# "command" may be given instead of "script" to pass the source inline. Without "env" a script inherits the environment
+# of pysh-batch, with it the script sees exactly the given variables.
+#
+# Output past the spill threshold is not put in the results, it is written to <output>.d/<number>.stdout (or .stderr),
+# the job's number being its position among the jobs. The result then has "stdout": null and "stdout_file": the path.
+
+
+class Job(object):
+    def __init__(self, id: str, number: int, program_index: int, env: Optional[Dict[str, str]],
+                 cwd: Optional[str]) -> None:
+        self.id = id
+        self.number = number
+        self.program_index = program_index
+        self.env = env
+        self.cwd = cwd
+
+
+class ManifestError(Exception):
+    pass
+
+
+def read_manifest(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError as e:
+                raise ManifestError('{0}:{1}: {2}'.format(path, line_number, e)) from e
+            if not isinstance(entry, dict) or ('script' not in entry and 'command' not in entry):
+                raise ManifestError('{0}:{1}: expected an object with "script" or "command"'.format(path, line_number))
+            entry.setdefault('id', str(line_number))
+            yield entry
+
+
+def compile_jobs(entries: Iterator[Dict[str, Any]]) -> Tuple[List[Program], List[Job], List[Dict[str, Any]]]:
+    # Every distinct source is compiled once here, the workers only ever receive the index of its program.
+    cache = CompileCache(capacity=sys.maxsize)
+    program_indices: Dict[int, int] = {}
+    programs: List[Program] = []
+    jobs: List[Job] = []
+    failures: List[Dict[str, Any]] = []
+
+    for entry in entries:
+        job_id = str(entry['id'])
+        try:
+            if 'command' in entry:
+                source = entry['command']
+            else:
+                with open(entry['script']) as f:
+                    source = f.read()
+            program = cache.compile(source)
+        except (OSError, ParseError) as e:
+            failures.append({'id': job_id, 'status': 2, 'time': 0.0, 'stdout': '', 'stderr': 'pysh: {0}\n'.format(e)})
+            continue
+
+        index = program_indices.get(id(program))
+        if index is None:
+            index = len(programs)
+            program_indices[id(program)] = index
+            programs.append(program)
+
+        env = entry.get('env')
+        if env is not None:
+            env = {str(name): str(value) for name, value in env.items()}
+        jobs.append(Job(job_id, len(jobs), index, env, entry.get('cwd')))
+
+    return programs, jobs, failures
+
+
+worker_programs: Sequence[Program] = ()
+worker_context: Optional[Context] = None
+worker_spill_directory = ''
+
+
+def init_worker(programs: Sequence[Program], spill_directory: str) -> None:
+    global worker_programs, worker_context, worker_spill_directory
+    # With the fork start method the programs are inherited from the parent, not pickled.
+    worker_programs = programs
+    worker_spill_directory = spill_directory
+
+    # Warm up everything a script may need, so the first job of every worker is not slower than the rest.
+    import subprocess
+    import pysh.builtins.test
+
+    worker_context = Context()
+    for name, value in os.environ.items():
+        worker_context.set(name, value)
+        worker_context.export(name)
+
+
+def output_fields(stream: str, buffer: CaptureBuffer, job: Job) -> Dict[str, Any]:
+    if not buffer.large:
+        return {stream: buffer.getvalue()}
+    # Copied from the temporary file a chunk at a time, neither the worker nor the parent ever holds all of it.
+    os.makedirs(worker_spill_directory, exist_ok=True)
+    path = os.path.join(worker_spill_directory, '{0}.{1}'.format(job.number, stream))
+    with open(path, 'wb') as f:
+        buffer.copy_to(f)
+    return {stream: None, stream + '_file': path}
+
+
+def run_job(job: Job) -> Dict[str, Any]:
+    program = worker_programs[job.program_index]
+    stdout = CaptureBuffer()
+    stderr = CaptureBuffer()
+    start = time.perf_counter()
+    # External commands get the fd of stderr, whatever else writes to sys.stderr is caught by the redirect.
+    with redirect_stderr(stderr):
+        try:
+            if job.env is not None:
+                status = program.run(env=job.env, cwd=job.cwd, stdout=stdout, stderr=stderr)
+            else:
+                status = program.run(cwd=job.cwd, stdout=stdout, context=worker_context, stderr=stderr)
+        except Exception as e:
+            stderr.write('pysh: {0}\n'.format(e))
+            status = 1
+    elapsed = time.perf_counter() - start
+    with stdout, stderr:
+        result = {'id': job.id, 'status': status, 'time': elapsed}
+        result.update(output_fields('stdout', stdout, job))
+        result.update(output_fields('stderr', stderr, job))
+        return result
+
+
+def run_batch(manifest: str, output: str, jobs_count: int) -> int:
+    start = time.perf_counter()
+    programs, jobs, failures = compile_jobs(read_manifest(manifest))
+    compile_time = time.perf_counter() - start
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context('fork')
+    else:
+        mp_context = multiprocessing.get_context()
+
+    # Large chunks keep the parent from becoming the bottleneck, a few chunks per worker still balance the load.
+    chunksize = max(1, len(jobs) // (jobs_count * 4))
+    failed = len(failures)
+    with open(output, 'w') as out:
+        for result in failures:
+            out.write(json.dumps(result) + '\n')
+        with mp_context.Pool(jobs_count, initializer=init_worker, initargs=(programs, output + '.d')) as pool:
+            for result in pool.imap(run_job, jobs, chunksize):
+                if result['status'] != 0:
+                    failed += 1
+                out.write(json.dumps(result) + '\n')
+
+    sys.stderr.write('pysh-batch: {0} jobs, {1} programs, {2} failed, compile {3:.3f}s, total {4:.3f}s\n'.format(
+        len(jobs) + len(failures), len(programs), failed, compile_time, time.perf_counter() - start))
+    return 0 if failed == 0 else 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='pysh-batch', description='Run many pysh scripts over a process pool.')
+    parser.add_argument('manifest', help='JSON lines file describing the scripts to run')
+    parser.add_argument('-o', '--output', default='results.jsonl', help='JSON lines file to write the results to')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='number of worker processes')
+    args = parser.parse_args()
+
+    try:
+        sys.exit(run_batch(args.manifest, args.output, max(1, args.jobs)))
+    except (OSError, ManifestError) as e:
+        sys.stderr.write('pysh-batch: {0}\n'.format(e))
+        sys.exit(2)
@@ -1,19 +1,28 @@
 import os
 import sys
-from typing import List, Tuple
+from typing import Callable, Dict, List, Tuple, Optional, Sequence, TextIO
+
+from pysh.statcache import StatCache
 
 
 class InvokeInfo(object):
-    def __init__(self, arguments: List[str], env: List[Tuple[str, str]], stdin: str, pwd: str) -> None:
+    def __init__(self, arguments: List[str], env: List[Tuple[str, str]], stdin: str, pwd: str,
+                 stat_cache: Optional[StatCache] = None, stdout: Optional[TextIO] = None,
+                 stderr: Optional[TextIO] = None, fds: Optional[Dict[int, int]] = None) -> None:
         self.arguments = arguments
         self.env = env
         self.stdin = stdin
         self.pwd = pwd
+        self.stat_cache = stat_cache if stat_cache is not None else StatCache()
+        self.stdout = stdout
+        self.stderr = stderr
+        # Redirected standard streams, by the number they will have in a child process.
+        self.fds = fds
 
 
 def ls(info: InvokeInfo) -> int:
     entries = os.listdir(info.pwd)
-    print('\n'.join(entries))
+    print('\n'.join(entries), file=info.stdout)
     return 0
 
 
@@ -30,7 +39,7 @@ def exit(info: InvokeInfo) -> int:
 
 
 def echo(info: InvokeInfo) -> int:
-    print(' '.join(info.arguments[1:]))
+    print(' '.join(info.arguments[1:]), file=info.stdout)
     return 0
 
 
@@ -40,3 +49,20 @@ def true(info: InvokeInfo) -> int:
 
 def false(info: InvokeInfo) -> int:
     return 1
+
+
+def constant_test(arguments: Sequence[str]) -> Optional[int]:
+    # Imported only when a script has a constant test, like the builtin itself.
+    from pysh.builtins.test import constant_status
+    return constant_status(arguments)
+
+
+# Builtins whose status depends on nothing but their arguments and that do nothing besides returning it, by name. Any
+# builtin not in here is impure. A call with only constant arguments is evaluated while compiling, by a function that
+# gets the whole argument vector and returns the status, or None when the call has to happen at run time after all.
+pure_builtins: Dict[str, Callable[[Sequence[str]], Optional[int]]] = {
+    'true': lambda arguments: 0,
+    'false': lambda arguments: 1,
+    'test': constant_test,
+    '[': constant_test,
+}
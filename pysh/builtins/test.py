@@ -1,13 +1,13 @@
+import os
+import stat
 import sys
 import enum
-from typing import Iterable, List, Tuple, Dict, Union
+from typing import Tuple, Dict, Callable, Optional, Sequence
 
 from pysh.builtins import InvokeInfo
 
 
 class TokenType(enum.Enum):
-    Unknown = -2
-    EOL = -1
     Value = 0
     LeftParen = 1
     RightParen = 2
@@ -22,12 +22,102 @@ class TokenType(enum.Enum):
     GreaterThan = 11
     LessThanOrEqual = 12
     GreaterThanOrEqual = 13
+    StrEmpty = 14
+    StrNotEmpty = 15
+    Exists = 16
+    IsRegularFile = 17
+    IsDirectory = 18
+    IsNotEmptyFile = 19
+    IsExecutable = 20
+    IsReadable = 21
+    IsWritable = 22
+    IsSymbolicLink = 23
+    NewerThan = 24
+    OlderThan = 25
+
+
+token_types: Dict[str, TokenType] = {
+    '(': TokenType.LeftParen,
+    ')': TokenType.RightParen,
+    '!': TokenType.Not,
+    '-a': TokenType.And,
+    '-o': TokenType.Or,
+    '=': TokenType.StrEqual,
+    '==': TokenType.StrEqual,
+    '!=': TokenType.StrNotEqual,
+    '-eq': TokenType.IntEqual,
+    '-ne': TokenType.IntNotEqual,
+    '-lt': TokenType.LessThan,
+    '-gt': TokenType.GreaterThan,
+    '-le': TokenType.LessThanOrEqual,
+    '-ge': TokenType.GreaterThanOrEqual,
+    '-z': TokenType.StrEmpty,
+    '-n': TokenType.StrNotEmpty,
+    '-e': TokenType.Exists,
+    '-f': TokenType.IsRegularFile,
+    '-d': TokenType.IsDirectory,
+    '-s': TokenType.IsNotEmptyFile,
+    '-x': TokenType.IsExecutable,
+    '-r': TokenType.IsReadable,
+    '-w': TokenType.IsWritable,
+    '-L': TokenType.IsSymbolicLink,
+    '-h': TokenType.IsSymbolicLink,
+    '-nt': TokenType.NewerThan,
+    '-ot': TokenType.OlderThan,
+}
 
+binary_operators = frozenset((
+    TokenType.StrEqual,
+    TokenType.StrNotEqual,
+    TokenType.IntEqual,
+    TokenType.IntNotEqual,
+    TokenType.LessThan,
+    TokenType.GreaterThan,
+    TokenType.LessThanOrEqual,
+    TokenType.GreaterThanOrEqual,
+    TokenType.NewerThan,
+    TokenType.OlderThan,
+))
+
+unary_operators = frozenset((
+    TokenType.StrEmpty,
+    TokenType.StrNotEmpty,
+    TokenType.Exists,
+    TokenType.IsRegularFile,
+    TokenType.IsDirectory,
+    TokenType.IsNotEmptyFile,
+    TokenType.IsExecutable,
+    TokenType.IsReadable,
+    TokenType.IsWritable,
+    TokenType.IsSymbolicLink,
+))
+
+# Operators that look at the file system, a test using any of them can't be evaluated ahead of time.
+file_operators = frozenset((
+    TokenType.Exists,
+    TokenType.IsRegularFile,
+    TokenType.IsDirectory,
+    TokenType.IsNotEmptyFile,
+    TokenType.IsExecutable,
+    TokenType.IsReadable,
+    TokenType.IsWritable,
+    TokenType.IsSymbolicLink,
+    TokenType.NewerThan,
+    TokenType.OlderThan,
+))
+
+
+# An evaluator receives the full operand vector and the invocation it runs under. Operands are referenced by index, so
+# one compiled evaluator serves every argument vector that has the same operator shape.
+Evaluator = Callable[[Sequence[str], InvokeInfo], bool]
+Shape = Tuple[TokenType, ...]
+
+# Stands in for a missing file so size and mode checks need no separate branch.
+EMPTY_STAT = os.stat_result((0,) * 10)
 
-class Token(object):
-    def __init__(self, raw: str, type: TokenType) -> None:
-        self.raw = raw
-        self.type = type
+
+class EvaluationError(Exception):
+    pass
 
 
 class Node(object):
@@ -36,15 +126,32 @@ class Node(object):
 
 
 class ValueNode(Node):
-    def __init__(self, value: str) -> None:
-        self.value = value
+    def __init__(self, index: int) -> None:
+        self.index = index
 
     def accept(self, visitor: 'NodeVisitor') -> None:
         visitor.visit_value(self)
 
 
+class NotNode(Node):
+    def __init__(self, operand: Node) -> None:
+        self.operand = operand
+
+    def accept(self, visitor: 'NodeVisitor') -> None:
+        visitor.visit_not(self)
+
+
+class UnaryExpressionNode(Node):
+    def __init__(self, op: TokenType, index: int) -> None:
+        self.op = op
+        self.index = index
+
+    def accept(self, visitor: 'NodeVisitor') -> None:
+        visitor.visit_unary_expression(self)
+
+
 class BinaryExpressionNode(Node):
-    def __init__(self, lhs: Node, rhs: Node, op: TokenType) -> None:
+    def __init__(self, lhs: int, rhs: int, op: TokenType) -> None:
         self.lhs = lhs
         self.rhs = rhs
         self.op = op
@@ -53,189 +160,297 @@ class BinaryExpressionNode(Node):
         visitor.visit_binary_expression(self)
 
 
+class LogicalExpressionNode(Node):
+    def __init__(self, lhs: Node, rhs: Node, op: TokenType) -> None:
+        self.lhs = lhs
+        self.rhs = rhs
+        self.op = op
+
+    def accept(self, visitor: 'NodeVisitor') -> None:
+        visitor.visit_logical_expression(self)
+
+
 class NodeVisitor(object):
     def visit_value(self, node: ValueNode) -> None:
         pass
 
+    def visit_not(self, node: NotNode) -> None:
+        pass
+
+    def visit_unary_expression(self, node: UnaryExpressionNode) -> None:
+        pass
+
     def visit_binary_expression(self, node: BinaryExpressionNode) -> None:
         pass
 
+    def visit_logical_expression(self, node: LogicalExpressionNode) -> None:
+        pass
+
+
+def to_int(val: str) -> int:
+    try:
+        return int(val)
+    except ValueError as e:
+        raise EvaluationError('{0}: integer expression expected'.format(val)) from e
+
+
+def is_newer(lhs: str, rhs: str, info: InvokeInfo) -> bool:
+    lhs_stat = info.stat_cache.stat(lhs, info.pwd)
+    if lhs_stat is None:
+        return False
+    rhs_stat = info.stat_cache.stat(rhs, info.pwd)
+    return rhs_stat is None or lhs_stat.st_mtime > rhs_stat.st_mtime
 
-class EvaluationError(Exception):
-    pass
 
+def is_older(lhs: str, rhs: str, info: InvokeInfo) -> bool:
+    rhs_stat = info.stat_cache.stat(rhs, info.pwd)
+    if rhs_stat is None:
+        return False
+    lhs_stat = info.stat_cache.stat(lhs, info.pwd)
+    return lhs_stat is None or lhs_stat.st_mtime < rhs_stat.st_mtime
 
-class EvaluateVisitor(NodeVisitor):
+
+def has_mode(path: str, info: InvokeInfo, predicate: Callable[[int], bool]) -> bool:
+    result = info.stat_cache.stat(path, info.pwd)
+    return result is not None and predicate(result.st_mode)
+
+
+class CompileVisitor(NodeVisitor):
     def __init__(self) -> None:
-        self.value: Union[str, bool] = ''
-        self.is_boolean = False
+        self.evaluator: Evaluator = lambda args, info: False
+
+    def compile(self, node: Node) -> Evaluator:
+        node.accept(self)
+        return self.evaluator
 
     def visit_value(self, node: ValueNode) -> None:
-        self.value = node.value
-        self.is_boolean = False
+        index = node.index
+        self.evaluator = lambda args, info: len(args[index]) > 0
+
+    def visit_not(self, node: NotNode) -> None:
+        operand = self.compile(node.operand)
+        self.evaluator = lambda args, info: not operand(args, info)
+
+    def visit_unary_expression(self, node: UnaryExpressionNode) -> None:
+        index = node.index
+        op = node.op
+        if op is TokenType.StrEmpty:
+            self.evaluator = lambda args, info: len(args[index]) == 0
+        elif op is TokenType.StrNotEmpty:
+            self.evaluator = lambda args, info: len(args[index]) > 0
+        elif op is TokenType.Exists:
+            self.evaluator = lambda args, info: info.stat_cache.stat(args[index], info.pwd) is not None
+        elif op is TokenType.IsRegularFile:
+            self.evaluator = lambda args, info: has_mode(args[index], info, stat.S_ISREG)
+        elif op is TokenType.IsDirectory:
+            self.evaluator = lambda args, info: has_mode(args[index], info, stat.S_ISDIR)
+        elif op is TokenType.IsNotEmptyFile:
+            self.evaluator = lambda args, info: (info.stat_cache.stat(args[index], info.pwd) or EMPTY_STAT).st_size > 0
+        elif op is TokenType.IsExecutable:
+            self.evaluator = lambda args, info: info.stat_cache.access(args[index], info.pwd, os.X_OK)
+        elif op is TokenType.IsReadable:
+            self.evaluator = lambda args, info: info.stat_cache.access(args[index], info.pwd, os.R_OK)
+        elif op is TokenType.IsWritable:
+            self.evaluator = lambda args, info: info.stat_cache.access(args[index], info.pwd, os.W_OK)
+        elif op is TokenType.IsSymbolicLink:
+            self.evaluator = lambda args, info: \
+                stat.S_ISLNK((info.stat_cache.lstat(args[index], info.pwd) or EMPTY_STAT).st_mode)
+        else:
+            raise EvaluationError('Unknown unary operator ' + str(op))
 
     def visit_binary_expression(self, node: BinaryExpressionNode) -> None:
-        self.is_boolean = True
-        left_visitor = EvaluateVisitor()
-        right_visitor = EvaluateVisitor()
-        node.lhs.accept(left_visitor)
-        node.rhs.accept(right_visitor)
+        lhs = node.lhs
+        rhs = node.rhs
+        op = node.op
+        if op is TokenType.StrEqual:
+            self.evaluator = lambda args, info: args[lhs] == args[rhs]
+        elif op is TokenType.StrNotEqual:
+            self.evaluator = lambda args, info: args[lhs] != args[rhs]
+        elif op is TokenType.IntEqual:
+            self.evaluator = lambda args, info: to_int(args[lhs]) == to_int(args[rhs])
+        elif op is TokenType.IntNotEqual:
+            self.evaluator = lambda args, info: to_int(args[lhs]) != to_int(args[rhs])
+        elif op is TokenType.LessThan:
+            self.evaluator = lambda args, info: to_int(args[lhs]) < to_int(args[rhs])
+        elif op is TokenType.GreaterThan:
+            self.evaluator = lambda args, info: to_int(args[lhs]) > to_int(args[rhs])
+        elif op is TokenType.LessThanOrEqual:
+            self.evaluator = lambda args, info: to_int(args[lhs]) <= to_int(args[rhs])
+        elif op is TokenType.GreaterThanOrEqual:
+            self.evaluator = lambda args, info: to_int(args[lhs]) >= to_int(args[rhs])
+        elif op is TokenType.NewerThan:
+            self.evaluator = lambda args, info: is_newer(args[lhs], args[rhs], info)
+        elif op is TokenType.OlderThan:
+            self.evaluator = lambda args, info: is_older(args[lhs], args[rhs], info)
+        else:
+            raise EvaluationError('Unknown binary operator ' + str(op))
+
+    def visit_logical_expression(self, node: LogicalExpressionNode) -> None:
+        lhs = self.compile(node.lhs)
+        rhs = self.compile(node.rhs)
+        if node.op is TokenType.And:
+            self.evaluator = lambda args, info: lhs(args, info) and rhs(args, info)
+        elif node.op is TokenType.Or:
+            self.evaluator = lambda args, info: lhs(args, info) or rhs(args, info)
+        else:
+            raise EvaluationError('Unknown logical operator ' + str(node.op))
 
-        if left_visitor.is_boolean is not right_visitor.is_boolean:
-            raise EvaluationError('Type mismatch')
 
-        if left_visitor.is_boolean:
-            raise EvaluationError('Unknown boolean operator ' + node.op.raw)
-        else:
-            left_value: str = left_visitor.value
-            right_value: str = right_visitor.value
-            if node.op is TokenType.StrEqual:
-                self.value = left_visitor.value == right_visitor.value
-            elif node.op is TokenType.StrNotEqual:
-                self.value = node.lhs != node.rhs
-            elif node.op is TokenType.IntEqual:
-                self.value = self.to_int(left_value) == self.to_int(right_value)
-            elif node.op is TokenType.IntNotEqual:
-                self.value = self.to_int(left_value) != self.to_int(right_value)
-            elif node.op is TokenType.LessThan:
-                self.value = self.to_int(left_value) < self.to_int(right_value)
-            elif node.op is TokenType.GreaterThan:
-                self.value = self.to_int(left_value) > self.to_int(right_value)
-            elif node.op is TokenType.LessThanOrEqual:
-                self.value = self.to_int(left_value) <= self.to_int(right_value)
-            elif node.op is TokenType.GreaterThanOrEqual:
-                self.value = self.to_int(left_value) >= self.to_int(right_value)
-            else:
-                raise EvaluationError('Unknown value operator ' + node.op.raw)
-
-    def to_int(self, val: str) -> int:
-        try:
-            return int(val)
-        except ValueError as e:
-            # TODO: This should be a specialized exception
-            raise EvaluationError('{0}: integer expression expected') from e
-
-
-def lex_arg(arg: str) -> Token:
-    if arg == '(':
-        return Token(arg, TokenType.LeftParen)
-    if arg == ')':
-        return Token(arg, TokenType.RightParen)
-    if arg == '!':
-        return Token(arg, TokenType.Not)
-    if arg == '-a':
-        return Token(arg, TokenType.And)
-    if arg == '-o':
-        return Token(arg, TokenType.Or)
-    if arg == '=' or arg == '==':
-        return Token(arg, TokenType.StrEqual)
-    if arg == '!=':
-        return Token(arg, TokenType.StrNotEqual)
-    if arg == '-eq':
-        return Token(arg, TokenType.IntEqual)
-    if arg == '-ne':
-        return Token(arg, TokenType.IntNotEqual)
-    if arg == '-lt':
-        return Token(arg, TokenType.LessThan)
-    if arg == '-gt':
-        return Token(arg, TokenType.GreaterThan)
-    if arg == '-le':
-        return Token(arg, TokenType.LessThanOrEqual)
-    if arg == '-ge':
-        return Token(arg, TokenType.GreaterThanOrEqual)
-
-    return Token(arg, TokenType.Value)
-
-
-def lex(args: Iterable[str]) -> List[Token]:
-    tokens: List[Token] = []
-    for arg in args:
-        tokens.append(lex_arg(arg))
-    tokens.append(Token('', TokenType.EOL))
-    return tokens
-
-
-token_precedences: Dict[TokenType, int] = {
-    TokenType.Unknown: -3,
-    TokenType.EOL: -2,
-    TokenType.Value: -1,
-    TokenType.LeftParen: 100,
-    TokenType.RightParen: 200,
-    TokenType.Not: 300,
-    TokenType.And: 400,
-    TokenType.Or: 500,
-    TokenType.StrEqual: 600,
-    TokenType.StrNotEqual: 700,
-    TokenType.IntEqual: 800,
-    TokenType.IntNotEqual: 900,
-    TokenType.LessThan: 1000,
-    TokenType.GreaterThan: 1100,
-    TokenType.LessThanOrEqual: 1200,
-    TokenType.GreaterThanOrEqual: 1300
-}
+class FileAccessVisitor(NodeVisitor):
+    def __init__(self) -> None:
+        self.found = False
+
+    def visit_not(self, node: NotNode) -> None:
+        node.operand.accept(self)
 
+    def visit_unary_expression(self, node: UnaryExpressionNode) -> None:
+        if node.op in file_operators:
+            self.found = True
 
-def get_token_precedence(token: Token) -> int:
-    return token_precedences.get(token.type, 0)
+    def visit_binary_expression(self, node: BinaryExpressionNode) -> None:
+        if node.op in file_operators:
+            self.found = True
 
+    def visit_logical_expression(self, node: LogicalExpressionNode) -> None:
+        node.lhs.accept(self)
+        node.rhs.accept(self)
 
-def parse_value(tokens: List[Token]) -> Tuple[Node, int]:
-    return ValueNode(tokens[0].raw), 1
 
+def lex(args: Sequence[str]) -> Shape:
+    return tuple([token_types.get(arg, TokenType.Value) for arg in args])
 
-def parse_primary(tokens: List[Token]) -> Tuple[Node, int]:
-    return parse_value(tokens)
 
+class ShapeParser(object):
+    def __init__(self, shape: Shape) -> None:
+        self.shape = shape
+        self.end = len(shape)
+        self.pos = 0
 
-def parse_bin_op_rhs(tokens: List[Token], precedence: int, lhs: Node) -> Tuple[Node, int]:
-    token_offset = 0
+    def parse(self) -> Node:
+        if self.end == 0:
+            raise EvaluationError('Argument expected')
+        node = self.parse_or()
+        if self.pos != self.end:
+            raise EvaluationError('Too many arguments')
+        return node
 
-    while True:
-        op_token = tokens[token_offset]
-        op_precedence = get_token_precedence(op_token)
+    def is_binary_at(self, pos: int) -> bool:
+        return pos + 2 < self.end and self.shape[pos + 1] in binary_operators
 
-        if op_precedence < precedence:
-            break
+    def parse_or(self) -> Node:
+        lhs = self.parse_and()
+        while self.pos < self.end and self.shape[self.pos] is TokenType.Or:
+            self.pos += 1
+            rhs = self.parse_and()
+            lhs = LogicalExpressionNode(lhs, rhs, TokenType.Or)
+        return lhs
 
-        # Eat op token
-        token_offset += 1
+    def parse_and(self) -> Node:
+        lhs = self.parse_not()
+        while self.pos < self.end and self.shape[self.pos] is TokenType.And:
+            self.pos += 1
+            rhs = self.parse_not()
+            lhs = LogicalExpressionNode(lhs, rhs, TokenType.And)
+        return lhs
 
-        # Parse rhs
-        rhs, consumed = parse_primary(tokens[token_offset:])
-        token_offset += consumed
+    def parse_not(self) -> Node:
+        if self.pos >= self.end:
+            raise EvaluationError('Argument expected')
+        # "! = x" compares the string "!", a binary operator in the middle always wins.
+        if self.shape[self.pos] is TokenType.Not and not self.is_binary_at(self.pos):
+            self.pos += 1
+            return NotNode(self.parse_not())
+        return self.parse_primary()
 
-        next_precedence = get_token_precedence(tokens[token_offset])
-        if op_precedence < next_precedence:
-            rhs, consumed = parse_bin_op_rhs(tokens[token_offset:], op_precedence + 1, lhs)
-            token_offset += consumed
+    def parse_primary(self) -> Node:
+        pos = self.pos
+        if pos >= self.end:
+            raise EvaluationError('Argument expected')
 
-        lhs = BinaryExpressionNode(lhs, rhs, op_token.type)
+        if self.is_binary_at(pos):
+            self.pos = pos + 3
+            return BinaryExpressionNode(pos, pos + 2, self.shape[pos + 1])
 
-    return lhs, token_offset
+        type = self.shape[pos]
 
+        if type is TokenType.LeftParen and pos + 1 < self.end:
+            self.pos = pos + 1
+            node = self.parse_or()
+            if self.pos >= self.end or self.shape[self.pos] is not TokenType.RightParen:
+                raise EvaluationError('Expecting )')
+            self.pos += 1
+            return node
 
-def parse(tokens: List[Token]) -> Node:
-    lhs, token_offset = parse_primary(tokens)
-    node, consumed = parse_bin_op_rhs(tokens[token_offset:], 0, lhs)
-    token_offset += consumed
+        if type in unary_operators and pos + 1 < self.end:
+            self.pos = pos + 2
+            return UnaryExpressionNode(type, pos + 1)
 
-    if tokens[token_offset].type is not TokenType.EOL:
-        raise EvaluationError('Too many arguments')
+        self.pos = pos + 1
+        return ValueNode(pos)
 
-    return node
 
+def parse(shape: Shape) -> Node:
+    return ShapeParser(shape).parse()
 
-def test(info: InvokeInfo) -> int:
-    if len(info.arguments) < 2:
+
+def compile_shape(shape: Shape) -> Evaluator:
+    return CompileVisitor().compile(parse(shape))
+
+
+compiled_shapes: Dict[Shape, Evaluator] = {}
+max_compiled_shapes = 256
+
+
+def get_evaluator(args: Sequence[str]) -> Evaluator:
+    shape = lex(args)
+    evaluator = compiled_shapes.get(shape)
+    if evaluator is None:
+        evaluator = compile_shape(shape)
+        if len(compiled_shapes) >= max_compiled_shapes:
+            compiled_shapes.clear()
+        compiled_shapes[shape] = evaluator
+    return evaluator
+
+
+def evaluate(args: Sequence[str], info: InvokeInfo) -> int:
+    if len(args) == 0:
         return 1
 
     try:
-        tokens = lex(info.arguments[1:])
-        node = parse(tokens)
-        visitor = EvaluateVisitor()
-        node.accept(visitor)
-        return_value = 0 if visitor.value else 1
+        return 0 if get_evaluator(args)(args, info) else 1
     except EvaluationError as e:
-        sys.stderr.write(str(e) + '\n')
+        (info.stderr or sys.stderr).write('{0}: {1}\n'.format(info.arguments[0], e))
+        return 2
+
+
+def test(info: InvokeInfo) -> int:
+    return evaluate(info.arguments[1:], info)
+
+
+def left_bracket(info: InvokeInfo) -> int:
+    arguments = info.arguments
+    if len(arguments) < 2 or arguments[-1] != ']':
+        (info.stderr or sys.stderr).write('[: missing ]\n')
         return 2
-    return return_value
+    return evaluate(arguments[1:-1], info)
+
+
+def constant_status(arguments: Sequence[str]) -> Optional[int]:
+    # The status of test or [ with these arguments, None when it depends on the file system or would print an error.
+    args = arguments[1:]
+    if len(arguments) > 0 and arguments[0] == '[':
+        if len(arguments) < 2 or arguments[-1] != ']':
+            return None
+        args = arguments[1:-1]
+    if len(args) == 0:
+        return 1
+
+    try:
+        node = parse(lex(args))
+        visitor = FileAccessVisitor()
+        node.accept(visitor)
+        if visitor.found:
+            return None
+        return 0 if CompileVisitor().compile(node)(args, InvokeInfo(list(arguments), [], '', '')) else 1
+    except EvaluationError:
+        return None
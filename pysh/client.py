@@ -0,0 +1,93 @@
+import array
+import os
+import socket
+import struct
+import sys
+from typing import List, Optional, Tuple
+
+# Kept free of the compiler and interpreter, so a client costs little more than starting Python.
+
+LENGTH_FORMAT = '!I'
+STATUS_FORMAT = '!i'
+
+
+def default_socket_directory() -> str:
+    # The server makes this directory private to its user, the socket in it can't be reached by anyone else.
+    directory = os.environ.get('XDG_RUNTIME_DIR') or os.environ.get('TMPDIR') or '/tmp'
+    return os.path.join(directory, 'pysh-{0}'.format(os.getuid()))
+
+
+def default_socket_path() -> str:
+    return os.path.join(default_socket_directory(), 'server.sock')
+
+
+def encode_request(cwd: str, source: str, env: List[Tuple[str, str]]) -> bytes:
+    fields = [cwd, source] + ['{0}={1}'.format(name, value) for name, value in env]
+    body = '\0'.join(fields).encode('utf-8', 'surrogateescape')
+    return struct.pack(LENGTH_FORMAT, len(body)) + body
+
+
+def decode_request(body: bytes) -> Tuple[str, str, List[Tuple[str, str]]]:
+    fields = body.decode('utf-8', 'surrogateescape').split('\0')
+    env: List[Tuple[str, str]] = []
+    for field in fields[2:]:
+        name, _, value = field.partition('=')
+        env.append((name, value))
+    return fields[0], fields[1], env
+
+
+def run_remote(path: str, source: str) -> int:
+    request = encode_request(os.getcwd(), source, list(os.environ.items()))
+    fds = array.array('i', [0, 1, 2])
+    # Our descriptors and environment only go to a server run by ourselves.
+    if os.lstat(path).st_uid != os.getuid():
+        raise ConnectionRefusedError('{0} belongs to another user'.format(path))
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sent = sock.sendmsg([request], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds.tobytes())])
+        if sent < len(request):
+            sock.sendall(request[sent:])
+        response = b''
+        while len(response) < struct.calcsize(STATUS_FORMAT):
+            chunk = sock.recv(struct.calcsize(STATUS_FORMAT) - len(response))
+            if len(chunk) == 0:
+                raise ConnectionError('pysh server closed the connection')
+            response += chunk
+    return struct.unpack(STATUS_FORMAT, response)[0]
+
+
+def run_local(source: str) -> int:
+    # Compiled and run the way the server does it, the status is the same with or without one.
+    from pysh.parser import ParseError
+    from pysh.program import compile
+    try:
+        program = compile(source)
+    except ParseError as e:
+        sys.stderr.write('pysh: {0}\n'.format(e))
+        return 2
+    return program.run()
+
+
+def main() -> None:
+    usage = 'usage: pysh-client [--socket PATH] (-c COMMAND | FILE)\n'
+    args = sys.argv[1:]
+    path: Optional[str] = None
+    if len(args) >= 2 and args[0] in ('-s', '--socket'):
+        path = args[1]
+        args = args[2:]
+
+    if len(args) == 2 and args[0] in ('-c', '--command'):
+        source = args[1] + '\n'
+    elif len(args) == 1 and not args[0].startswith('-'):
+        with open(args[0]) as f:
+            source = f.read()
+    else:
+        sys.stderr.write(usage)
+        sys.exit(2)
+
+    try:
+        status = run_remote(path or default_socket_path(), source)
+    except (FileNotFoundError, ConnectionRefusedError):
+        # No server running, do the work ourselves rather than failing the hook.
+        status = run_local(source)
+    sys.exit(status)
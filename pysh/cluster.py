@@ -0,0 +1,450 @@
+import argparse
+import collections
+import hmac
+import io
+import json
+import os
+import pickle
+import secrets
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from contextlib import redirect_stderr
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+from pysh.client import LENGTH_FORMAT
+from pysh.interpreter import Context
+from pysh.metrics import Metrics, MetricsEndpoint
+from pysh.output import CaptureBuffer
+from pysh.parser import ParseError
+from pysh.program import Program, compile
+
+# A coordinator compiles a script once and runs it over a list of items on a set of workers, each item as $1.
+#
+# Every message is a frame: its length (LENGTH_FORMAT) followed by the body. Control messages are JSON objects:
+#   coordinator -> worker: {"type": "hello", "token": ...}, {"type": "program", "name": ...} followed by a frame
+#                          holding the pickled program, {"type": "shard", "id": 3, "items": [...]}, {"type": "done"}
+#   worker -> coordinator: {"type": "ready"}, {"type": "error", "message": ...},
+#                          {"type": "result", "id": 3, "results": [{"status", "time", "stdout", "stderr"}, ...]}
+# Output past the spill threshold is sent as null. It follows the result message, every such output in the order of
+# the results, stdout before stderr, as frames of raw chunks ended by an empty frame. The coordinator writes it to
+# <output>.d/<index>.stdout (or .stderr), the index being the item's position, and refers to it as "stdout_file".
+# Workers run scripts for whoever connects, so they require a shared token and only listen on loopback by default.
+
+TOKEN_VARIABLE = 'PYSH_CLUSTER_TOKEN'
+DEFAULT_LISTEN = '127.0.0.1:0'
+MAX_FRAME_SIZE = 1 << 30
+
+# Everything a compiled program is made of. The program comes in over the network, nothing else may be unpickled.
+PROGRAM_MODULES = ('pysh.instructions', 'pysh.arithmetic')
+PROGRAM_CLASSES = frozenset([('pysh.program', 'Program'), ('pysh.slots', 'SlotTable')])
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class ProgramUnpickler(pickle.Unpickler):
+    def find_class(self, module: str, name: str) -> Any:
+        if (module, name) in PROGRAM_CLASSES or \
+                (module in PROGRAM_MODULES and (name.endswith('Instruction') or name.endswith('Node'))):
+            return super().find_class(module, name)
+        raise pickle.UnpicklingError('{0}.{1} is not part of a program'.format(module, name))
+
+
+def dump_program(program: Program) -> bytes:
+    return pickle.dumps(program, pickle.HIGHEST_PROTOCOL)
+
+
+def load_program(data: bytes) -> Program:
+    program = ProgramUnpickler(io.BytesIO(data)).load()
+    if not isinstance(program, Program):
+        raise ProtocolError('expected a program')
+    return program
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    host, _, port = address.rpartition(':')
+    if len(host) == 0 or not port.isdigit():
+        raise ValueError('{0}: expected HOST:PORT'.format(address))
+    return host.strip('[]'), int(port)
+
+
+def receive_exactly(conn: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = conn.recv(min(size - len(data), 1 << 20))
+        if len(chunk) == 0:
+            raise ConnectionError('connection closed')
+        data += chunk
+    return bytes(data)
+
+
+def send_frame(conn: socket.socket, body: bytes) -> None:
+    conn.sendall(struct.pack(LENGTH_FORMAT, len(body)) + body)
+
+
+def receive_frame(conn: socket.socket) -> bytes:
+    size, = struct.unpack(LENGTH_FORMAT, receive_exactly(conn, struct.calcsize(LENGTH_FORMAT)))
+    if size > MAX_FRAME_SIZE:
+        raise ProtocolError('frame of {0} bytes is too large'.format(size))
+    return receive_exactly(conn, size)
+
+
+def send_message(conn: socket.socket, message: Dict[str, Any]) -> None:
+    send_frame(conn, json.dumps(message).encode('utf-8'))
+
+
+def receive_message(conn: socket.socket) -> Dict[str, Any]:
+    try:
+        message = json.loads(receive_frame(conn).decode('utf-8'))
+    except ValueError as e:
+        raise ProtocolError('malformed message: {0}'.format(e)) from e
+    if not isinstance(message, dict) or 'type' not in message:
+        raise ProtocolError('malformed message')
+    if message['type'] == 'error':
+        raise ProtocolError(message.get('message', 'error'))
+    return message
+
+
+class Worker(object):
+    def __init__(self, address: Tuple[str, int], token: str, metrics_address: Optional[str] = None) -> None:
+        self.address = address
+        self.token = token
+        self.metrics: Optional[Metrics] = None
+        if metrics_address is not None:
+            # Served from a thread of its own, items run one after the other on the main thread.
+            self.metrics = Metrics()
+            endpoint = MetricsEndpoint(metrics_address, self.metrics)
+            threading.Thread(target=endpoint.serve_forever, daemon=True).start()
+        # Like pysh-batch, every item starts from the environment the worker was started with.
+        self.context = Context()
+        for name, value in os.environ.items():
+            self.context.set(name, value)
+            self.context.export(name)
+
+    def serve_forever(self) -> int:
+        family = socket.AF_INET6 if ':' in self.address[0] else socket.AF_INET
+        with socket.socket(family, socket.SOCK_STREAM) as listener:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind(self.address)
+            listener.listen()
+            host, port = listener.getsockname()[:2]
+            # A coordinator starting local workers reads the port from this line.
+            sys.stdout.write('pysh-cluster: worker listening on {0}:{1}\n'.format(host, port))
+            sys.stdout.flush()
+            while True:
+                conn, peer = listener.accept()
+                with conn:
+                    try:
+                        self.serve(conn)
+                    except (OSError, ProtocolError, pickle.UnpicklingError) as e:
+                        sys.stderr.write('pysh-cluster: {0}: {1}\n'.format(peer[0], e))
+
+    def serve(self, conn: socket.socket) -> None:
+        hello = receive_message(conn)
+        if hello['type'] != 'hello' or not hmac.compare_digest(str(hello.get('token', '')), self.token):
+            send_message(conn, {'type': 'error', 'message': 'authentication failed'})
+            return
+        send_message(conn, {'type': 'ready'})
+
+        program: Optional[Program] = None
+        name = 'pysh'
+        while True:
+            message = receive_message(conn)
+            if message['type'] == 'program':
+                name = str(message.get('name', name))
+                program = load_program(receive_frame(conn))
+            elif message['type'] == 'shard' and program is not None:
+                self.run_shard(conn, program, name, message)
+            elif message['type'] == 'done':
+                return
+            else:
+                raise ProtocolError('unexpected {0} message'.format(message['type']))
+
+    def run_shard(self, conn: socket.socket, program: Program, name: str, shard: Dict[str, Any]) -> None:
+        large: List[CaptureBuffer] = []
+        try:
+            results = [self.run_item(program, name, str(item), large) for item in shard['items']]
+            send_message(conn, {'type': 'result', 'id': shard['id'], 'results': results})
+            for buffer in large:
+                for chunk in buffer.chunks():
+                    send_frame(conn, chunk)
+                send_frame(conn, b'')
+        finally:
+            for buffer in large:
+                buffer.close()
+
+    def run_item(self, program: Program, name: str, item: str, large: List[CaptureBuffer]) -> Dict[str, Any]:
+        # Large outputs are left open and added to large, they are sent after the result.
+        stdout = CaptureBuffer()
+        stderr = CaptureBuffer()
+        start = time.perf_counter()
+        # External commands get the fd of stderr, whatever else writes to sys.stderr is caught by the redirect.
+        with redirect_stderr(stderr):
+            try:
+                status = program.run(stdout=stdout, context=self.context, arguments=[name, item],
+                                     metrics=self.metrics, stderr=stderr)
+            except Exception as e:
+                stderr.write('pysh: {0}\n'.format(e))
+                status = 1
+        elapsed = time.perf_counter() - start
+        result = {'status': status, 'time': elapsed}
+        for stream, buffer in (('stdout', stdout), ('stderr', stderr)):
+            if buffer.large:
+                result[stream] = None
+                large.append(buffer)
+            else:
+                with buffer:
+                    result[stream] = buffer.getvalue()
+        return result
+
+
+class Shard(object):
+    def __init__(self, id: int, start: int, items: Sequence[str]) -> None:
+        self.id = id
+        # Index of the first item, results are written in item order.
+        self.start = start
+        self.items = items
+
+
+class Scheduler(object):
+    # Every worker starts with a contiguous run of shards. A worker takes from the front of its own queue, one that
+    # runs out steals from the back of the longest queue, away from where its owner is working.
+    def __init__(self, shards: List[Shard], worker_count: int) -> None:
+        self.lock = threading.Lock()
+        self.queues: List[Deque[Shard]] = [collections.deque() for _ in range(worker_count)]
+        per_worker = -(-len(shards) // worker_count)
+        for index, shard in enumerate(shards):
+            self.queues[index // per_worker].append(shard)
+        self.steals = 0
+
+    def take(self, worker: int) -> Optional[Shard]:
+        with self.lock:
+            if len(self.queues[worker]) > 0:
+                return self.queues[worker].popleft()
+            victim = max(self.queues, key=len)
+            if len(victim) == 0:
+                return None
+            self.steals += 1
+            return victim.pop()
+
+    def give_back(self, worker: int, shard: Shard) -> None:
+        # The worker is gone, whatever is left in its queue is stolen by the others.
+        with self.lock:
+            self.queues[worker].appendleft(shard)
+
+    def remaining(self) -> List[Shard]:
+        with self.lock:
+            return [shard for queue in self.queues for shard in queue]
+
+
+class Coordinator(object):
+    def __init__(self, program: Program, name: str, items: Sequence[str], addresses: Sequence[Tuple[str, int]],
+                 token: str, shard_size: int, spill_directory: str) -> None:
+        self.program = program
+        self.name = name
+        self.items = items
+        self.addresses = addresses
+        self.token = token
+        self.spill_directory = spill_directory
+        shards = [Shard(id, start, items[start:start + shard_size])
+                  for id, start in enumerate(range(0, len(items), shard_size))]
+        self.scheduler = Scheduler(shards, len(addresses))
+        self.results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        self.failed_workers = 0
+
+    def run(self) -> None:
+        data = dump_program(self.program)
+        threads = [threading.Thread(target=self.drive, args=(index, data), daemon=True)
+                   for index in range(len(self.addresses))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Shards no worker was left to run.
+        for shard in self.scheduler.remaining():
+            for offset, item in enumerate(shard.items):
+                self.results[shard.start + offset] = {'item': item, 'worker': None, 'status': 1, 'time': 0.0,
+                                                      'stdout': '', 'stderr': 'pysh-cluster: no worker left\n'}
+
+    def drive(self, index: int, data: bytes) -> None:
+        address = self.addresses[index]
+        worker_name = '{0}:{1}'.format(*address)
+        try:
+            with socket.create_connection(address, timeout=10) as conn:
+                conn.settimeout(None)
+                send_message(conn, {'type': 'hello', 'token': self.token})
+                if receive_message(conn)['type'] != 'ready':
+                    raise ProtocolError('unexpected reply to hello')
+                send_message(conn, {'type': 'program', 'name': self.name})
+                send_frame(conn, data)
+
+                while True:
+                    shard = self.scheduler.take(index)
+                    if shard is None:
+                        send_message(conn, {'type': 'done'})
+                        return
+                    try:
+                        send_message(conn, {'type': 'shard', 'id': shard.id, 'items': list(shard.items)})
+                        reply = receive_message(conn)
+                        if reply['type'] != 'result' or reply.get('id') != shard.id or \
+                                len(reply.get('results', ())) != len(shard.items):
+                            raise ProtocolError('unexpected reply to shard {0}'.format(shard.id))
+                        for offset, result in enumerate(reply['results']):
+                            for stream in ('stdout', 'stderr'):
+                                if result.get(stream) is None:
+                                    result[stream + '_file'] = self.receive_output(conn, shard.start + offset, stream)
+                    except BaseException:
+                        self.scheduler.give_back(index, shard)
+                        raise
+                    for offset, (item, result) in enumerate(zip(shard.items, reply['results'])):
+                        self.results[shard.start + offset] = {'item': item, 'worker': worker_name, **result}
+        except (OSError, ProtocolError) as e:
+            self.failed_workers += 1
+            sys.stderr.write('pysh-cluster: worker {0}: {1}\n'.format(worker_name, e))
+
+    def receive_output(self, conn: socket.socket, index: int, stream: str) -> str:
+        # Written as it comes in, the output is never held here as a whole.
+        os.makedirs(self.spill_directory, exist_ok=True)
+        path = os.path.join(self.spill_directory, '{0}.{1}'.format(index, stream))
+        with open(path, 'wb') as f:
+            while True:
+                chunk = receive_frame(conn)
+                if len(chunk) == 0:
+                    return path
+                f.write(chunk)
+
+
+def start_local_workers(count: int, token: str) -> Tuple[List[subprocess.Popen], List[Tuple[str, int]]]:
+    env = dict(os.environ)
+    env[TOKEN_VARIABLE] = token
+    processes: List[subprocess.Popen] = []
+    addresses: List[Tuple[str, int]] = []
+    try:
+        for _ in range(count):
+            processes.append(subprocess.Popen(
+                [sys.executable, '-m', 'pysh.cluster', 'worker', '--listen', DEFAULT_LISTEN],
+                stdout=subprocess.PIPE, env=env, universal_newlines=True))
+        for process in processes:
+            line = process.stdout.readline()
+            if not line.startswith('pysh-cluster: worker listening on '):
+                raise OSError('local worker failed to start')
+            addresses.append(parse_address(line.split()[-1]))
+    except BaseException:
+        stop_local_workers(processes)
+        raise
+    return processes, addresses
+
+
+def stop_local_workers(processes: List[subprocess.Popen]) -> None:
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+        if process.stdout is not None:
+            process.stdout.close()
+
+
+def read_items(path: str) -> List[str]:
+    if path == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path) as f:
+            lines = f.read().splitlines()
+    return [line for line in lines if len(line) > 0]
+
+
+def run_cluster(args: argparse.Namespace) -> int:
+    start = time.perf_counter()
+    with open(args.script) as f:
+        source = f.read()
+    try:
+        program = compile(source)
+    except ParseError as e:
+        sys.stderr.write('pysh-cluster: {0}: {1}\n'.format(args.script, e))
+        return 2
+    items = read_items(args.items)
+
+    processes: List[subprocess.Popen] = []
+    if args.local is not None:
+        token = secrets.token_hex(16)
+        processes, addresses = start_local_workers(max(1, args.local), token)
+    else:
+        token = os.environ.get(TOKEN_VARIABLE, '')
+        addresses = [parse_address(address) for address in args.worker]
+        if len(token) == 0:
+            sys.stderr.write('pysh-cluster: set {0} to the token the workers were started with\n'.format(
+                TOKEN_VARIABLE))
+            return 2
+
+    # A few shards per worker leave room for the ones that finish early to take over from the rest.
+    shard_size = args.shard_size or max(1, len(items) // (len(addresses) * 8))
+    coordinator = Coordinator(program, args.script, items, addresses, token, shard_size, args.output + '.d')
+    try:
+        coordinator.run()
+    finally:
+        stop_local_workers(processes)
+
+    failed = 0
+    with open(args.output, 'w') as out:
+        for result in coordinator.results:
+            if result['status'] != 0:
+                failed += 1
+            out.write(json.dumps(result) + '\n')
+
+    sys.stderr.write('pysh-cluster: {0} items, {1} workers ({2} lost), {3} steals, {4} failed, total {5:.3f}s\n'.format(
+        len(items), len(addresses), coordinator.failed_workers, coordinator.scheduler.steals, failed,
+        time.perf_counter() - start))
+    return 0 if failed == 0 else 1
+
+
+def run_worker(args: argparse.Namespace) -> int:
+    token = os.environ.get(TOKEN_VARIABLE, '')
+    if len(token) == 0:
+        sys.stderr.write('pysh-cluster: set {0} to a secret shared with the coordinator\n'.format(TOKEN_VARIABLE))
+        return 2
+    try:
+        return Worker(parse_address(args.listen), token, args.metrics).serve_forever()
+    except KeyboardInterrupt:
+        return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='pysh-cluster',
+                                     description='Run a pysh script over a list of items on a set of workers.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser('run', help='compile a script and run it for every item on the workers')
+    run_parser.add_argument('script', help='script to run, the item is passed to it as $1')
+    run_parser.add_argument('--items', required=True, help='file with one item per line, - for stdin')
+    workers = run_parser.add_mutually_exclusive_group(required=True)
+    workers.add_argument('--worker', action='append', metavar='HOST:PORT', help='address of a worker, repeatable')
+    workers.add_argument('--local', type=int, metavar='N', help='start N workers on this machine')
+    run_parser.add_argument('--shard-size', type=int, help='number of items sent to a worker at a time')
+    run_parser.add_argument('-o', '--output', default='results.jsonl', help='JSON lines file to write the results to')
+    run_parser.set_defaults(func=run_cluster)
+
+    worker_parser = subparsers.add_parser('worker', help='run shards sent by a coordinator, the token is read from '
+                                                         '$' + TOKEN_VARIABLE)
+    worker_parser.add_argument('--listen', default=DEFAULT_LISTEN, metavar='HOST:PORT',
+                               help='address to listen on (default: %(default)s)')
+    worker_parser.add_argument('--metrics', metavar='ADDRESS',
+                               help='serve OpenMetrics on [HOST:]PORT or on a unix socket given by its path')
+    worker_parser.set_defaults(func=run_worker)
+
+    args = parser.parse_args()
+    try:
+        sys.exit(args.func(args))
+    except (OSError, ValueError) as e:
+        sys.stderr.write('pysh-cluster: {0}\n'.format(e))
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,32 @@
-from typing import List, Iterable, Optional
+from typing import List, Iterable, Optional, Tuple, Union
 
 from pysh.instructions import Instruction, LoadBufferInstruction, ResetAInstruction, ConcatInstruction, \
     SubstituteInstruction, SubstituteSingleInstruction, BranchBufferEmptyInstruction, PushBufferInstruction, \
     IncrementAInstruction, CallInstruction, SetVarInstruction, PushAInstruction, PopAInstruction, AddRVToAInstruction, \
-    BranchReturnValueInstruction, JumpRelativeInstruction, BranchIfANotZeroInstruction
+    BranchReturnValueInstruction, JumpRelativeInstruction, BranchIfANotZeroInstruction, \
+    PushContextInstruction, PopContextInstruction, SubstituteEscapedInstruction, GlobInstruction, \
+    BranchReturnValueZeroInstruction, NegateReturnValueInstruction, RedirectInstruction, ArithmeticInstruction, \
+    SetReturnValueInstruction
+from pysh.arithmetic import NumberNode, compile_arithmetic
+from pysh.builtins import pure_builtins
+from pysh.globbing import escape
+from pysh.slots import SlotTable
 from pysh.syntaxnodes import SyntaxNode, CommandNode, ArgumentPartNode, ArgumentNode, ArgumentPartType, \
-    SyntaxNodeVisitor, AssignmentNode, AssignmentsNode, ConditionalNode
+    SyntaxNodeVisitor, AssignmentNode, AssignmentsNode, ConditionalNode, SubshellNode, AndOrNode, NegationNode, \
+    LogicalOperator, RedirectionNode, ArithmeticPartNode
 
 
 class CodeGenVisitor(SyntaxNodeVisitor):
-    def __init__(self) -> None:
+    def __init__(self, slot_table: Optional[SlotTable] = None, fold_builtins: bool = True) -> None:
         self.code: List[Instruction] = []
+        self.slot_table = slot_table
+        self.fold_builtins = fold_builtins
+        # Line and column of the innermost node being generated, given to every instruction as it is emitted.
+        self.position: Tuple[int, int] = (0, 0)
+
+    def slot(self, name: str) -> int:
+        # Without a slot table every variable is looked up by name.
+        return -1 if self.slot_table is None else self.slot_table.resolve(name)
 
     def visit_argument_part_node(self, node: ArgumentPartNode) -> None:
         pass
@@ -18,58 +34,152 @@ class CodeGenVisitor(SyntaxNodeVisitor):
     def visit_argument_node(self, node: ArgumentNode) -> None:
         pass
 
+    def emit(self, instruction: Instruction) -> None:
+        instruction.line, instruction.column = self.position
+        self.code.append(instruction)
+
+    def enter(self, node: SyntaxNode) -> Tuple[int, int]:
+        # Makes node the innermost one, the position to go back to when it is done is returned.
+        outer = self.position
+        self.position = (node.line, node.column)
+        return outer
+
+    def constant_status(self, node: SyntaxNode) -> Optional[int]:
+        # The status of a pure builtin called with constant arguments and without redirections, None for anything else.
+        if isinstance(node, NegationNode):
+            status = self.constant_status(node.expression)
+            return None if status is None else 1 if status == 0 else 0
+        if not self.fold_builtins or not isinstance(node, CommandNode) or len(node.args) == 0 or \
+                len(node.redirections) > 0:
+            return None
+        arguments: List[str] = []
+        for arg_node in node.args:
+            if any(part_node.type != ArgumentPartType.CONSTANT for part_node in arg_node.parts):
+                return None
+            arguments.append(''.join(part_node.value for part_node in arg_node.parts))
+        evaluate = pure_builtins.get(arguments[0])
+        return None if evaluate is None else evaluate(arguments)
+
+    def set_return_value(self, node: SyntaxNode, status: int) -> None:
+        outer = self.enter(node)
+        self.emit(SetReturnValueInstruction(status))
+        self.position = outer
+
     def visit_command_node(self, node: CommandNode) -> None:
-        self.code.append(ResetAInstruction())
+        status = self.constant_status(node)
+        if status is not None:
+            self.set_return_value(node, status)
+            return
+
+        outer = self.enter(node)
+        self.emit(ResetAInstruction())
         for arg_node in node.args:
-            self.code.append(LoadBufferInstruction(""))
+            if any(part_node.type == ArgumentPartType.PATTERN for part_node in arg_node.parts):
+                self.visit_pattern_argument(arg_node)
+                continue
+            self.emit(LoadBufferInstruction(""))
             last_part_was_replacement = False
             for part_node in arg_node.parts:
                 last_part_was_replacement = False
                 if part_node.type == ArgumentPartType.CONSTANT:
-                    self.code.append(ConcatInstruction(part_node.value))
+                    self.emit(ConcatInstruction(part_node.value))
                 elif part_node.type == ArgumentPartType.REPLACEMENT:
-                    self.code.append(SubstituteInstruction(part_node.value))
+                    self.emit(SubstituteInstruction(part_node.value, self.slot(part_node.value)))
                     last_part_was_replacement = True
                 elif part_node.type == ArgumentPartType.REPLACEMENT_SINGLE:
-                    self.code.append(SubstituteSingleInstruction(part_node.value))
+                    self.emit(SubstituteSingleInstruction(part_node.value, self.slot(part_node.value)))
+                elif part_node.type == ArgumentPartType.ARITHMETIC:
+                    self.visit_arithmetic_part(part_node)
                 else:
                     raise Exception("bug")
 
             if last_part_was_replacement:
-                self.code.append(BranchBufferEmptyInstruction(2))
-            self.code.append(PushBufferInstruction())
-            self.code.append(IncrementAInstruction())
+                self.emit(BranchBufferEmptyInstruction(2))
+            self.emit(PushBufferInstruction())
+            self.emit(IncrementAInstruction())
+
+        for redirection_node in node.redirections:
+            redirection_node.accept(self)
+
+        self.emit(CallInstruction())
+        self.position = outer
 
-        self.code.append(CallInstruction())
+    def visit_pattern_argument(self, arg_node: ArgumentNode) -> None:
+        # The pattern is built in the buffer with everything that has to match literally escaped. That includes
+        # variable values, quoted or not: like in a word without a pattern, pysh never expands what is in a variable.
+        self.emit(LoadBufferInstruction(""))
+        for part_node in arg_node.parts:
+            if part_node.type == ArgumentPartType.PATTERN:
+                self.emit(ConcatInstruction(part_node.value))
+            elif part_node.type == ArgumentPartType.CONSTANT:
+                self.emit(ConcatInstruction(escape(part_node.value)))
+            elif part_node.type == ArgumentPartType.REPLACEMENT or \
+                    part_node.type == ArgumentPartType.REPLACEMENT_SINGLE:
+                self.emit(SubstituteEscapedInstruction(part_node.value, self.slot(part_node.value)))
+            elif part_node.type == ArgumentPartType.ARITHMETIC:
+                # Digits and a minus sign, nothing that needs escaping.
+                self.visit_arithmetic_part(part_node)
+            else:
+                raise Exception("bug")
+        self.emit(GlobInstruction())
+
+    def visit_redirection_node(self, node: RedirectionNode) -> None:
+        # The target is a single word, it is neither split nor expanded against file names.
+        self.emit(LoadBufferInstruction(''))
+        for part in node.target.parts:
+            if part.type == ArgumentPartType.CONSTANT or part.type == ArgumentPartType.PATTERN:
+                self.emit(ConcatInstruction(part.value))
+            elif part.type == ArgumentPartType.ARITHMETIC:
+                self.visit_arithmetic_part(part)
+            else:
+                self.emit(SubstituteSingleInstruction(part.value, self.slot(part.value)))
+        self.emit(RedirectInstruction(node.fd, node.operator))
+
+    def visit_arithmetic_part(self, part: ArithmeticPartNode) -> None:
+        if isinstance(part.expression, NumberNode):
+            # Folded while parsing, nothing is left to do at run time.
+            self.emit(ConcatInstruction(str(part.expression.value)))
+            return
+        names, evaluate = compile_arithmetic(part.expression)
+        variables = [(name, self.slot(name)) for name in names]
+        self.emit(ArithmeticInstruction(part.value, variables, evaluate, part.expression))
 
     def visit_assignment_node(self, node: AssignmentNode) -> None:
-        self.code.append(LoadBufferInstruction(node.var_name))
-        self.code.append(PushBufferInstruction())
-        self.code.append(LoadBufferInstruction(''))
+        outer = self.enter(node)
+        self.emit(LoadBufferInstruction(''))
         for part in node.expr.parts:
-            if part.type == ArgumentPartType.CONSTANT:
-                self.code.append(ConcatInstruction(part.value))
+            if part.type == ArgumentPartType.CONSTANT or part.type == ArgumentPartType.PATTERN:
+                self.emit(ConcatInstruction(part.value))
             elif part.type == ArgumentPartType.REPLACEMENT or part.type == ArgumentPartType.REPLACEMENT_SINGLE:
-                self.code.append(SubstituteSingleInstruction(part.value))
-        self.code.append(SetVarInstruction())
+                self.emit(SubstituteSingleInstruction(part.value, self.slot(part.value)))
+            elif part.type == ArgumentPartType.ARITHMETIC:
+                self.visit_arithmetic_part(part)
+        self.emit(SetVarInstruction(node.var_name, self.slot(node.var_name)))
+        self.position = outer
 
     def visit_assignments_node(self, node: AssignmentsNode) -> None:
         for assignment_node in node.assignments:
             self.visit_assignment_node(assignment_node)
 
     def visit_conditional_node(self, node: ConditionalNode) -> None:
-        self.code.append(ResetAInstruction())
-        for expr in node.evaluation_expressions:
-            self.code.append(PushAInstruction())
+        outer = self.enter(node)
+        # Like in any shell, the last command of the condition decides which branch runs.
+        for expr in node.evaluation_expressions[:-1]:
             expr.accept(self)
-            self.code.append(PopAInstruction())
-            self.code.append(AddRVToAInstruction())
-            self.code.append(PushAInstruction())
+        condition = node.evaluation_expressions[-1]
+        status = self.constant_status(condition)
+        if status is not None:
+            # Known while compiling, only the branch that runs is generated. rv is still set, $? may be read.
+            self.set_return_value(condition, status)
+            for expr in node.conditional_expressions if status == 0 else node.else_expressions:
+                expr.accept(self)
+            self.position = outer
+            return
+        condition.accept(self)
 
-        self.code.append(PopAInstruction())
-        branch_ins = BranchIfANotZeroInstruction(0)
+        branch_ins = BranchReturnValueInstruction(0)
         start_pos = len(self.code)
-        self.code.append(branch_ins)
+        self.emit(branch_ins)
 
         for expr in node.conditional_expressions:
             expr.accept(self)
@@ -78,7 +188,7 @@ class CodeGenVisitor(SyntaxNodeVisitor):
         skip_else_jump_pos = len(self.code)
         if len(node.else_expressions) > 0:
             skip_else_jump_ins = JumpRelativeInstruction(0)
-            self.code.append(skip_else_jump_ins)
+            self.emit(skip_else_jump_ins)
 
         condition_false_pos = len(self.code)
 
@@ -91,13 +201,67 @@ class CodeGenVisitor(SyntaxNodeVisitor):
         if skip_else_jump_ins is not None:
             skip_else_jump_ins.offset = end_pos - 1 - skip_else_jump_pos
 
+        self.position = outer
+
+    def visit_and_or_node(self, node: AndOrNode) -> None:
+        outer = self.enter(node)
+        expression_starts: List[int] = []
+        branches: List[Tuple[int, Union[BranchReturnValueInstruction, BranchReturnValueZeroInstruction]]] = []
+        for i, expr in enumerate(node.expressions):
+            expression_starts.append(len(self.code))
+            expr.accept(self)
+            if i < len(node.operators):
+                if node.operators[i] is LogicalOperator.AND:
+                    branch_ins = BranchReturnValueInstruction(0)
+                else:
+                    branch_ins = BranchReturnValueZeroInstruction(0)
+                branches.append((len(self.code), branch_ins))
+                self.emit(branch_ins)
+        end_pos = len(self.code)
+
+        for i, (branch_pos, branch_ins) in enumerate(branches):
+            # A taken branch leaves rv alone, so every following operator of the same kind would branch as well.
+            # Jump straight to the first expression after an operator of the other kind.
+            operator = node.operators[i]
+            target = end_pos
+            for k in range(i + 1, len(node.operators)):
+                if node.operators[k] is not operator:
+                    target = expression_starts[k + 1]
+                    break
+            branch_ins.offset = target - 1 - branch_pos
+
+        self.position = outer
+
+    def visit_negation_node(self, node: NegationNode) -> None:
+        status = self.constant_status(node)
+        if status is not None:
+            self.set_return_value(node, status)
+            return
+
+        outer = self.enter(node)
+        node.expression.accept(self)
+        self.emit(NegateReturnValueInstruction())
+        self.position = outer
+
+    def visit_subshell_node(self, node: SubshellNode) -> None:
+        outer = self.enter(node)
+        start = len(self.code)
+        push_ins = PushContextInstruction(0)
+        self.emit(push_ins)
+        for expr in node.expressions:
+            expr.accept(self)
+        push_ins.offset = len(self.code) - start
+        self.emit(PopContextInstruction())
+        self.position = outer
+
 
 class CodeGenerator(object):
-    def __init__(self) -> None:
-        pass
+    def __init__(self, slot_table: Optional[SlotTable] = None, fold_builtins: bool = True) -> None:
+        self.slot_table = slot_table
+        self.fold_builtins = fold_builtins
 
     def generate(self, syntax_nodes: Iterable[SyntaxNode]) -> List[Instruction]:
-        visitor = CodeGenVisitor()
+        visitor = CodeGenVisitor(self.slot_table, self.fold_builtins)
         for node in syntax_nodes:
             node.accept(visitor)
         return visitor.code
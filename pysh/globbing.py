@@ -0,0 +1,217 @@
+import os
+import re
+from typing import Callable, Dict, Iterator, List, Optional, Set
+
+# Patterns use a backslash to mark characters that must match literally, for example text that was quoted in the
+# source. Everything else follows the usual shell rules: * and ? match any characters except a slash, [...] matches a
+# class of characters and a leading . of a file name is only matched explicitly.
+
+Matcher = Callable[[str], object]
+
+SPECIAL_CHARACTERS = frozenset('*?[]\\')
+
+# Compiled segments, shared by every command. Scripts tend to use the same few patterns over and over.
+compiled_segments: Dict[str, Matcher] = {}
+max_compiled_segments = 256
+
+
+def escape(value: str) -> str:
+    if not any(c in SPECIAL_CHARACTERS for c in value):
+        return value
+    return ''.join('\\' + c if c in SPECIAL_CHARACTERS else c for c in value)
+
+
+def unescape(pattern: str) -> str:
+    if '\\' not in pattern:
+        return pattern
+    return re.sub(r'\\(.)', r'\1', pattern, flags=re.DOTALL)
+
+
+def find_bracket_end(pattern: str, start: int) -> int:
+    # start is just past the [, returns the index of the closing ] or -1 when there is none.
+    end = len(pattern)
+    pos = start
+    if pos < end and (pattern[pos] == '!' or pattern[pos] == '^'):
+        pos += 1
+    if pos < end and pattern[pos] == ']':
+        pos += 1
+    while pos < end and pattern[pos] != ']':
+        if pattern[pos] == '\\':
+            pos += 1
+        pos += 1
+    return pos if pos < end else -1
+
+
+def has_magic(pattern: str) -> bool:
+    end = len(pattern)
+    pos = 0
+    while pos < end:
+        c = pattern[pos]
+        if c == '\\':
+            pos += 2
+            continue
+        if c == '*' or c == '?':
+            return True
+        if c == '[' and find_bracket_end(pattern, pos + 1) >= 0:
+            return True
+        pos += 1
+    return False
+
+
+def translate_bracket(body: str) -> str:
+    parts = ['[']
+    pos = 0
+    if len(body) > 0 and (body[0] == '!' or body[0] == '^'):
+        parts.append('^')
+        pos = 1
+    while pos < len(body):
+        c = body[pos]
+        if c == '\\' and pos + 1 < len(body):
+            pos += 1
+            parts.append(re.escape(body[pos]))
+        elif c == '-' and pos > 0 and pos + 1 < len(body):
+            parts.append('-')
+        else:
+            parts.append(re.escape(c))
+        pos += 1
+    parts.append(']')
+    return ''.join(parts)
+
+
+def translate(segment: str) -> str:
+    parts: List[str] = []
+    end = len(segment)
+    pos = 0
+    while pos < end:
+        c = segment[pos]
+        pos += 1
+        if c == '\\' and pos < end:
+            parts.append(re.escape(segment[pos]))
+            pos += 1
+        elif c == '*':
+            if len(parts) == 0 or parts[-1] != '.*':
+                parts.append('.*')
+        elif c == '?':
+            parts.append('.')
+        elif c == '[':
+            bracket_end = find_bracket_end(segment, pos)
+            if bracket_end < 0:
+                parts.append(re.escape(c))
+            else:
+                parts.append(translate_bracket(segment[pos:bracket_end]))
+                pos = bracket_end + 1
+        else:
+            parts.append(re.escape(c))
+    return ''.join(parts)
+
+
+def compile_segment(segment: str) -> Matcher:
+    matcher = compiled_segments.get(segment)
+    if matcher is not None:
+        return matcher
+
+    # The common shapes get by without a regular expression.
+    rest = segment[1:]
+    if segment == '*':
+        matcher = lambda name: True
+    elif segment.startswith('*') and not has_magic(rest) and '\\' not in rest:
+        matcher = lambda name: name.endswith(rest)
+    elif segment.endswith('*') and not has_magic(segment[:-1]) and '\\' not in segment:
+        prefix = segment[:-1]
+        matcher = lambda name: name.startswith(prefix)
+    else:
+        matcher = re.compile(translate(segment), re.DOTALL).fullmatch
+
+    if len(compiled_segments) >= max_compiled_segments:
+        compiled_segments.clear()
+    compiled_segments[segment] = matcher
+    return matcher
+
+
+class Listing(object):
+    def __init__(self, entries: List[os.DirEntry]) -> None:
+        self.entries = entries
+        names = sorted(entry.name for entry in entries)
+        # Hidden names are kept apart since most patterns never look at them.
+        self.visible = [name for name in names if not name.startswith('.')]
+        self.hidden = [name for name in names if name.startswith('.')] if len(self.visible) < len(names) else []
+        self._directories: Optional[Set[str]] = None
+
+    @property
+    def directories(self) -> Set[str]:
+        # Only patterns with more segments to go need to know, and they only need it once per directory.
+        if self._directories is None:
+            self._directories = {entry.name for entry in self.entries if is_directory(entry)}
+        return self._directories
+
+
+def is_directory(entry: os.DirEntry) -> bool:
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
+
+
+class GlobExpander(object):
+    def __init__(self) -> None:
+        # Directory listings, kept for the duration of one command so that all of its patterns share them.
+        self.listings: Dict[str, Listing] = {}
+
+    def clear(self) -> None:
+        if len(self.listings) > 0:
+            self.listings = {}
+
+    def list_directory(self, path: str) -> Listing:
+        listing = self.listings.get(path)
+        if listing is not None:
+            return listing
+
+        try:
+            with os.scandir(path) as entries:
+                listing = Listing(list(entries))
+        except OSError:
+            listing = Listing([])
+        self.listings[path] = listing
+        return listing
+
+    def expand(self, pattern: str, pwd: str) -> Iterator[str]:
+        # Yields matching paths in sorted order, spelled the way the pattern spells them.
+        segments = pattern.split('/')
+        if pattern.startswith('/'):
+            return self.expand_segments('/', segments, 1, pwd)
+        return self.expand_segments('', segments, 0, pwd)
+
+    def expand_segments(self, prefix: str, segments: List[str], index: int, pwd: str) -> Iterator[str]:
+        segment = segments[index]
+        is_last = index == len(segments) - 1
+
+        if not has_magic(segment):
+            path = prefix + unescape(segment)
+            if not is_last:
+                yield from self.expand_segments(path + '/', segments, index + 1, pwd)
+            elif os.path.lexists(os.path.join(pwd, path)):
+                yield path
+            return
+
+        listing = self.list_directory(os.path.join(pwd, prefix or '.'))
+        candidates = listing.hidden if unescape(segment[:2]).startswith('.') else listing.visible
+        names = filter(compile_segment(segment), candidates)
+        if is_last:
+            if len(prefix) == 0:
+                yield from names
+            else:
+                yield from [prefix + name for name in names]
+            return
+
+        directories = listing.directories
+        for name in names:
+            if name in directories:
+                yield from self.expand_segments(prefix + name + '/', segments, index + 1, pwd)
+
+    def expand_onto(self, pattern: str, pwd: str, stack: List[str]) -> int:
+        # Pushes the matches straight onto the argument stack. Without any match the pattern stands for itself.
+        start = len(stack)
+        stack.extend(self.expand(pattern, pwd))
+        if len(stack) == start:
+            stack.append(unescape(pattern))
+        return len(stack) - start
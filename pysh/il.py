@@ -4,7 +4,13 @@ from pysh.instructions import InstructionVisitor, ConcatInstruction, SubstituteI
     SubstituteSingleInstruction, LoadBufferInstruction, PushBufferInstruction, ResetAInstruction, \
     IncrementAInstruction, PushAInstruction, CallInstruction, SetVarInstruction, BranchReturnValueInstruction, \
     BranchBufferEmptyInstruction, JumpRelativeInstruction, AddRVToAInstruction, BranchIfANotZeroInstruction, \
-    PopAInstruction
+    PopAInstruction, PushContextInstruction, PopContextInstruction, SubstituteEscapedInstruction, \
+    GlobInstruction, BranchReturnValueZeroInstruction, NegateReturnValueInstruction, RedirectInstruction, \
+    ArithmeticInstruction, SetReturnValueInstruction
+
+
+def format_slot(slot: int) -> str:
+    return '' if slot < 0 else ', {0}'.format(slot)
 
 
 class GenerateILVisitor(InstructionVisitor):
@@ -15,10 +21,14 @@ class GenerateILVisitor(InstructionVisitor):
         self.parts.append('concat "{0}"\n'.format(instruction.value))
 
     def visit_substitute(self, instruction: SubstituteInstruction) -> None:
-        self.parts.append('sub "{0}"\n'.format(instruction.value))
+        self.parts.append('sub "{0}"{1}\n'.format(instruction.value, format_slot(instruction.slot)))
 
     def visit_substitute_single(self, instruction: SubstituteSingleInstruction) -> None:
-        self.parts.append('subs "{0}"\n'.format(instruction.value))
+        self.parts.append('subs "{0}"{1}\n'.format(instruction.value, format_slot(instruction.slot)))
+
+    def visit_arithmetic(self, instruction: ArithmeticInstruction) -> None:
+        slots = ''.join(format_slot(slot) for name, slot in instruction.variables)
+        self.parts.append('arith "{0}"{1}\n'.format(instruction.value, slots))
 
     def visit_load_buffer(self, instruction: LoadBufferInstruction) -> None:
         self.parts.append('ldbuf "{0}"\n'.format(instruction.value))
@@ -42,10 +52,10 @@ class GenerateILVisitor(InstructionVisitor):
         self.parts.append('call\n')
 
     def visit_set_var(self, instruction: SetVarInstruction) -> None:
-        self.parts.append('setvar\n')
+        self.parts.append('setvar "{0}"{1}\n'.format(instruction.value, format_slot(instruction.slot)))
 
     def visit_branch_return_value(self, instruction: BranchReturnValueInstruction) -> None:
-        self.parts.append('brv {0}\n'.format(instruction.offset))
+        self.parts.append('brv nz, {0}\n'.format(instruction.offset))
 
     def visit_branch_buffer_empty(self, instruction: BranchBufferEmptyInstruction) -> None:
         self.parts.append('bbe {0}\n'.format(instruction.offset))
@@ -59,5 +69,29 @@ class GenerateILVisitor(InstructionVisitor):
     def visit_add_rv_to_a(self, instruction: AddRVToAInstruction) -> None:
         self.parts.append('add rv\n')
 
+    def visit_push_context(self, instruction: PushContextInstruction) -> None:
+        self.parts.append('pushctx {0}\n'.format(instruction.offset))
+
+    def visit_pop_context(self, instruction: PopContextInstruction) -> None:
+        self.parts.append('popctx\n')
+
+    def visit_substitute_escaped(self, instruction: SubstituteEscapedInstruction) -> None:
+        self.parts.append('subesc "{0}"{1}\n'.format(instruction.value, format_slot(instruction.slot)))
+
+    def visit_glob(self, instruction: GlobInstruction) -> None:
+        self.parts.append('glob\n')
+
+    def visit_branch_return_value_zero(self, instruction: BranchReturnValueZeroInstruction) -> None:
+        self.parts.append('brv z, {0}\n'.format(instruction.offset))
+
+    def visit_negate_return_value(self, instruction: NegateReturnValueInstruction) -> None:
+        self.parts.append('not\n')
+
+    def visit_set_return_value(self, instruction: SetReturnValueInstruction) -> None:
+        self.parts.append('setrv {0}\n'.format(instruction.value))
+
+    def visit_redirect(self, instruction: RedirectInstruction) -> None:
+        self.parts.append('redir {0}, "{1}"\n'.format(instruction.fd, instruction.operator))
+
     def make_il(self) -> str:
         return ''.join(self.parts)
@@ -1,6 +1,13 @@
+from typing import Any, Callable, Dict, List, Tuple
+
+from pysh.arithmetic import ArithmeticNode, compile_arithmetic
 
 
 class Instruction(object):
+    # Source position of the syntax node the instruction was generated from, 0 when unknown.
+    line = 0
+    column = 0
+
     def accept(self, visitor: 'InstructionVisitor') -> None:
         pass
 
@@ -14,21 +21,57 @@ class ConcatInstruction(Instruction):
 
 
 class SubstituteInstruction(Instruction):
-    def __init__(self, value: str) -> None:
+    def __init__(self, value: str, slot: int = -1) -> None:
         self.value = value
+        self.slot = slot
 
     def accept(self, visitor: 'InstructionVisitor') -> None:
         visitor.visit_substitute(self)
 
 
 class SubstituteSingleInstruction(Instruction):
-    def __init__(self, value: str) -> None:
+    def __init__(self, value: str, slot: int = -1) -> None:
         self.value = value
+        self.slot = slot
 
     def accept(self, visitor: 'InstructionVisitor') -> None:
         visitor.visit_substitute_single(self)
 
 
+class SubstituteEscapedInstruction(Instruction):
+    # Like SubstituteSingleInstruction, but the value is escaped so it matches literally in a pattern.
+    def __init__(self, value: str, slot: int = -1) -> None:
+        self.value = value
+        self.slot = slot
+
+    def accept(self, visitor: 'InstructionVisitor') -> None:
+        visitor.visit_substitute_escaped(self)
+
+
+class ArithmeticInstruction(Instruction):
+    # Appends the value of an arithmetic expression to the buffer. evaluate is called with the values of the variables
+    # as integers, in order.
+    def __init__(self, value: str, variables: List[Tuple[str, int]], evaluate: Callable[[List[int]], int],
+                 expression: ArithmeticNode) -> None:
+        self.value = value
+        self.variables = variables
+        self.evaluate = evaluate
+        self.expression = expression
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # evaluate is made of closures, which can't be pickled. It is compiled again from the expression.
+        state = dict(self.__dict__)
+        del state['evaluate']
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        names, self.evaluate = compile_arithmetic(self.expression)
+
+    def accept(self, visitor: 'InstructionVisitor') -> None:
+        visitor.visit_arithmetic(self)
+
+
 class LoadBufferInstruction(Instruction):
     def __init__(self, value: str) -> None:
         self.value = value
@@ -62,17 +105,39 @@ class PopAInstruction(Instruction):
         visitor.visit_pop_a(self)
 
 
+class GlobInstruction(Instruction):
+    # Pushes every file name matching the pattern in the buffer and adds their count to register a.
+    def accept(self, visitor: 'InstructionVisitor') -> None:
+        visitor.visit_glob(self)
+
+
+class RedirectInstruction(Instruction):
+    # Redirects fd of the next call to the file named in the buffer, or to the fd it names for <& and >&.
+    def __init__(self, fd: int, operator: str) -> None:
+        self.fd = fd
+        self.operator = operator
+
+    def accept(self, visitor: 'InstructionVisitor') -> None:
+        visitor.visit_redirect(self)
+
+
 class CallInstruction(Instruction):
     def accept(self, visitor: 'InstructionVisitor') -> None:
         visitor.visit_call(self)
 
 
 class SetVarInstruction(Instruction):
+    # Sets the variable to the buffer. A slot of -1 means the variable has none and is looked up by name.
+    def __init__(self, value: str, slot: int = -1) -> None:
+        self.value = value
+        self.slot = slot
+
     def accept(self, visitor: 'InstructionVisitor') -> None:
         visitor.visit_set_var(self)
 
 
 class BranchReturnValueInstruction(Instruction):
+    # Branches when rv is not zero, that is when the last command failed.
     def __init__(self, offset: int) -> None:
         self.offset = offset
 
@@ -80,6 +145,28 @@ class BranchReturnValueInstruction(Instruction):
         visitor.visit_branch_return_value(self)
 
 
+class BranchReturnValueZeroInstruction(Instruction):
+    def __init__(self, offset: int) -> None:
+        self.offset = offset
+
+    def accept(self, visitor: 'InstructionVisitor') -> None:
+        visitor.visit_branch_return_value_zero(self)
+
+
+class NegateReturnValueInstruction(Instruction):
+    def accept(self, visitor: 'InstructionVisitor') -> None:
+        visitor.visit_negate_return_value(self)
+
+
+class SetReturnValueInstruction(Instruction):
+    # Stands in for a call whose status was known while compiling.
+    def __init__(self, value: int) -> None:
+        self.value = value
+
+    def accept(self, visitor: 'InstructionVisitor') -> None:
+        visitor.visit_set_return_value(self)
+
+
 class BranchIfANotZeroInstruction(Instruction):
     def __init__(self, offset: int) -> None:
         self.offset = offset
@@ -109,6 +196,20 @@ class JumpRelativeInstruction(Instruction):
         visitor.visit_jump_relative(self)
 
 
+class PushContextInstruction(Instruction):
+    def __init__(self, offset: int) -> None:
+        # Distance to the matching PopContextInstruction, an exit inside the subshell continues there.
+        self.offset = offset
+
+    def accept(self, visitor: 'InstructionVisitor') -> None:
+        visitor.visit_push_context(self)
+
+
+class PopContextInstruction(Instruction):
+    def accept(self, visitor: 'InstructionVisitor') -> None:
+        visitor.visit_pop_context(self)
+
+
 class InstructionVisitor(object):
     def visit_concat(self, instruction: ConcatInstruction) -> None:
         raise NotImplementedError()
@@ -157,3 +258,30 @@ class InstructionVisitor(object):
 
     def visit_add_rv_to_a(self, instruction: AddRVToAInstruction) -> None:
         raise NotImplementedError()
+
+    def visit_push_context(self, instruction: PushContextInstruction) -> None:
+        raise NotImplementedError()
+
+    def visit_pop_context(self, instruction: PopContextInstruction) -> None:
+        raise NotImplementedError()
+
+    def visit_substitute_escaped(self, instruction: SubstituteEscapedInstruction) -> None:
+        raise NotImplementedError()
+
+    def visit_glob(self, instruction: GlobInstruction) -> None:
+        raise NotImplementedError()
+
+    def visit_branch_return_value_zero(self, instruction: BranchReturnValueZeroInstruction) -> None:
+        raise NotImplementedError()
+
+    def visit_negate_return_value(self, instruction: NegateReturnValueInstruction) -> None:
+        raise NotImplementedError()
+
+    def visit_redirect(self, instruction: RedirectInstruction) -> None:
+        raise NotImplementedError()
+
+    def visit_set_return_value(self, instruction: SetReturnValueInstruction) -> None:
+        raise NotImplementedError()
+
+    def visit_arithmetic(self, instruction: ArithmeticInstruction) -> None:
+        raise NotImplementedError()
@@ -1,15 +1,24 @@
-import argparse
 import enum
+import os
 import sys
-from typing import Optional, List, Iterable
+import types
+from typing import Optional, List, Iterable, Any, TYPE_CHECKING
 
 from pysh.codegen import CodeGenerator, Instruction
-from pysh.il import GenerateILVisitor
 from pysh.interpreter import Interpreter, install_builtins
 from pysh.lexer import Lexer
 from pysh.parser import Parser, ParseError
-from pysh.syntaxnoderepr import SyntaxNodeReprVisitor
+from pysh.slots import SlotTable
 from pysh.syntaxnodes import SyntaxNode
+from pysh.verifier import VerificationError, verify
+
+# Debug modes, profiling and timings import their modules on demand, so that plain execution (pysh runs as a hook
+# and CI step many times over) only loads what it needs.
+if TYPE_CHECKING:
+    import argparse
+    from pysh.profiler import Profiler
+    from pysh.rusage import UsageReport
+    from pysh.timings import PhaseTimer
 
 
 class InteractiveMode(enum.Enum):
@@ -19,21 +28,79 @@ class InteractiveMode(enum.Enum):
     Lex = 3
 
 
-def make_argparser() -> argparse.ArgumentParser:
+def make_argparser() -> 'argparse.ArgumentParser':
+    import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('--mode', choices=('execute', 'codegen', 'parse', 'lex'), default='execute')
     parser.add_argument('-c', '--command', dest='command')
     parser.add_argument('--stdinline', action='append')
+    parser.add_argument('--profile', action='store_true',
+                        help='print per-opcode, per-line and per-command execution times to stderr on exit')
+    parser.add_argument('--timings', action='store_true',
+                        help='print time and memory spent lexing, parsing, generating code and executing on exit')
+    parser.add_argument('--timings-format', choices=('text', 'json'), default='text',
+                        help='format of the --timings report (default: %(default)s)')
+    parser.add_argument('--rusage', action='store_true',
+                        help='print CPU time, memory and wall time of every command to stderr on exit')
+    parser.add_argument('--rusage-format', choices=('text', 'json'), default='text',
+                        help='format of the --rusage report (default: %(default)s)')
+    parser.add_argument('--server', nargs='?', const='', metavar='SOCKET',
+                        help='keep running and execute scripts sent by pysh-client over a unix socket')
+    parser.add_argument('--metrics', metavar='ADDRESS',
+                        help='with --server, serve OpenMetrics on [HOST:]PORT or on a unix socket given by its path')
+    parser.add_argument('script', nargs='?', help='script to run, available to it as $0')
+    parser.add_argument('arguments', nargs=argparse.REMAINDER, help='arguments for the script, $1 and on')
     return parser
 
 
+def parse_args(argv: List[str]) -> Any:
+    # The common invocations are recognized without loading argparse, anything else goes through the full parser.
+    command: Optional[str] = None
+    script: Optional[str] = None
+    if len(argv) == 2 and argv[0] in ('-c', '--command'):
+        command = argv[1]
+    elif len(argv) != 0 and not argv[0].startswith('-'):
+        script = argv[0]
+    elif len(argv) != 0:
+        return make_argparser().parse_args(argv)
+    return types.SimpleNamespace(mode='execute', command=command, stdinline=None, profile=False, timings=False,
+                                 timings_format='text', rusage=False, rusage_format='text', server=None, metrics=None,
+                                 script=script, arguments=argv[1:] if script else [])
+
+
+def read_source(fd: int) -> str:
+    # A regular file is mapped and decoded in one go, anything else (a pipe, a terminal) is read to the end.
+    import mmap
+    import stat
+    st = os.fstat(fd)
+    if stat.S_ISREG(st.st_mode) and st.st_size > 0:
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as data:
+            return str(data, 'utf-8')
+    with open(fd, closefd=False) as f:
+        return f.read()
+
+
+def read_script(path: str) -> str:
+    fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        return read_source(fd)
+    finally:
+        os.close(fd)
+
+
 class Interactive(object):
-    def __init__(self) -> None:
+    def __init__(self, start_time: Optional[float] = None) -> None:
+        self.start_time = start_time
         self.is_command = False
         self.lexer = Lexer()
         self.parser = Parser()
-        self.generator = CodeGenerator()
+        # Lines are compiled one at a time onto the same interpreter, they all share one table.
+        self.slot_table = SlotTable()
+        self.generator = CodeGenerator(self.slot_table)
         self.interpreter = Interpreter()
+        self.profiler: Optional['Profiler'] = None
+        self.timer: Optional['PhaseTimer'] = None
+        self.usage: Optional['UsageReport'] = None
 
     def print_prompt(self) -> None:
         if self.is_command:
@@ -45,14 +112,31 @@ class Interactive(object):
         sys.stdout.flush()
 
     def print_code(self, code: Iterable[Instruction]) -> None:
+        from pysh.il import GenerateILVisitor
         visitor = GenerateILVisitor()
         for instruction in code:
             instruction.accept(visitor)
         print(visitor.make_il())
 
+    def enable_timings(self) -> None:
+        from pysh.timings import PhaseTimer
+        timer = PhaseTimer()
+        if self.start_time is not None:
+            timer.record_startup(self.start_time)
+        # Shadow the bound methods, so nothing is measured (or slowed down) unless timings were asked for.
+        self.lexer.lex_all = timer.wrap('lex', self.lexer.lex_all)
+        self.parser.parse = timer.wrap('parse', self.parser.parse)
+        self.generator.generate = timer.wrap('codegen', self.generator.generate)
+        self.interpreter.execute = timer.wrap('execute', self.interpreter.execute)
+        self.timer = timer
+
     def main(self) -> int:
-        parser = make_argparser()
-        args = parser.parse_args()
+        args = parse_args(sys.argv[1:])
+        if args.server is not None:
+            from pysh.client import default_socket_path
+            from pysh.server import Server
+            return Server(args.server or default_socket_path(), args.metrics, not args.server).serve_forever()
+
         mode = InteractiveMode.Execute
         if args.mode == 'execute':
             mode = InteractiveMode.Execute
@@ -72,50 +156,110 @@ class Interactive(object):
             input_source = [args.command]
             self.is_command = True
 
+        # Scripts, -c commands and anything else that doesn't come from a terminal are compiled as a whole. Only
+        # interactive input is run line by line.
+        source: Optional[str] = None
+        if self.is_command:
+            source = args.command
+        elif args.script is not None:
+            try:
+                source = read_script(args.script)
+            except OSError as e:
+                sys.stderr.write('pysh: {0}: {1}\n'.format(args.script, e.strerror))
+                return 127
+            except UnicodeDecodeError:
+                sys.stderr.write('pysh: {0}: not a UTF-8 text file\n'.format(args.script))
+                return 126
+        elif input_source is sys.stdin and not sys.stdin.isatty():
+            source = read_source(sys.stdin.fileno())
+
+        if args.profile:
+            from pysh.profiler import Profiler, ProfilingInterpreter
+            self.profiler = Profiler()
+            self.interpreter = ProfilingInterpreter(self.profiler)
+
         install_builtins(self.interpreter)
+        self.interpreter.slot_table = self.slot_table
+        if args.script is not None:
+            self.interpreter.positional_parameters = [args.script] + args.arguments
+
+        if args.timings:
+            self.enable_timings()
+
+        if args.rusage:
+            from pysh.rusage import UsageReport
+            self.usage = UsageReport()
+            self.interpreter.usage = self.usage
 
-        def tick(source: str) -> None:
+        def tick(source: str) -> bool:
             ast: Optional[List[SyntaxNode]] = None
 
+            if self.profiler is not None:
+                self.profiler.add_source(self.lexer.line, source)
+
             tokens = self.lexer.lex_all(source)
             if mode is InteractiveMode.Lex:
                 print(repr(tokens))
-                return
+                return True
 
             try:
                 ast = self.parser.parse(tokens)
             except ParseError as e:
                 sys.stderr.write(str(e))
                 sys.stderr.write('\n')
+                return False
 
             if mode is InteractiveMode.Parse:
                 if ast is not None:
+                    from pysh.syntaxnoderepr import SyntaxNodeReprVisitor
                     visitor = SyntaxNodeReprVisitor()
                     for node in ast:
                         node.accept(visitor)
                     print(str(visitor))
-                return
-
-            if ast is None:
-                return
+                return True
 
             code = self.generator.generate(ast)
             if mode is InteractiveMode.GenerateCode:
                 if code is not None:
                     self.print_code(code)
-                return
+                return True
 
             if code is not None:
-                self.interpreter.execute(code)
+                try:
+                    verify(code)
+                    verified = True
+                except VerificationError:
+                    verified = False
+                return self.interpreter.execute(code, verified)
+            return True
 
-        # Interactive
-        if not self.is_command:
+        try:
+            # Whole program
+            if source is not None:
+                if not tick(source if source.endswith('\n') else source + '\n'):
+                    return 2
+                if not self.parser.is_done:
+                    sys.stderr.write('Unexpected end of input\n')
+                    return 2
+                return self.interpreter.rv
+
+            # Interactive
             self.print_prompt()
             for line in input_source:
                 tick(line)
                 self.print_prompt()
             return 0
-
-        # Single command
-        tick(args.command + '\n')
-        return 0
+        finally:
+            sys.stdout.flush()
+            if self.profiler is not None:
+                sys.stderr.write(self.profiler.make_report())
+            if self.timer is not None:
+                if args.timings_format == 'json':
+                    sys.stderr.write(self.timer.make_json())
+                else:
+                    sys.stderr.write(self.timer.make_report())
+            if self.usage is not None:
+                if args.rusage_format == 'json':
+                    sys.stderr.write(self.usage.make_json())
+                else:
+                    sys.stderr.write(self.usage.make_report())
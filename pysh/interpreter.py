@@ -1,44 +1,260 @@
+import importlib
 import os
 import sys
+import time
+from _thread import allocate_lock
 
-import subprocess
-from typing import List, Iterable, Dict, Callable, Tuple
+from typing import List, Iterable, Dict, Callable, Tuple, Sequence, Optional, Set, TextIO, Any, TYPE_CHECKING
 
 from pysh import builtins
-from pysh.builtins import InvokeInfo, test
+from pysh.arithmetic import to_integer
+from pysh.builtins import InvokeInfo
 from pysh.instructions import InstructionVisitor, Instruction, ConcatInstruction, SubstituteInstruction, \
     SubstituteSingleInstruction, LoadBufferInstruction, PushBufferInstruction, ResetAInstruction, \
     IncrementAInstruction, PushAInstruction, CallInstruction, BranchReturnValueInstruction, \
     BranchBufferEmptyInstruction, JumpRelativeInstruction, SetVarInstruction, AddRVToAInstruction, \
-    BranchIfANotZeroInstruction, PopAInstruction
+    BranchIfANotZeroInstruction, PopAInstruction, PushContextInstruction, PopContextInstruction, \
+    SubstituteEscapedInstruction, GlobInstruction, BranchReturnValueZeroInstruction, NegateReturnValueInstruction, \
+    RedirectInstruction, ArithmeticInstruction, SetReturnValueInstruction
+from pysh.globbing import GlobExpander, escape
+from pysh.output import OutputBuffer, relay_output
+from pysh.slots import SlotTable
+from pysh.statcache import StatCache
+
+if TYPE_CHECKING:
+    import subprocess
+    from pysh.metrics import Metrics
+    from pysh.rusage import UsageReport
+
+# fork() swaps the layers of the context it is called on, and one context may be forked by several threads at once.
+# The threading module isn't loaded for this, it costs startup time.
+fork_lock = allocate_lock()
 
 
 class Context(object):
-    def __init__(self) -> None:
-        self.variables: Dict[str, str] = {}
-        self.exported_variables: List[str] = []
-        self.pwd = os.getcwd()
+    # Variables live in a chain of layers. Only the top layer of a context is ever written to, the layers below it are
+    # frozen and may be shared with any number of forked contexts, which makes fork() O(1). Forking rearranges the
+    # layers of the forked context as well, under fork_lock, so threads may fork one shared context concurrently.
+    # Writing to a context while another thread forks it or reads from it is not safe.
+    max_depth = 32
+
+    def __init__(self, parent: Optional['Context'] = None) -> None:
+        self.parent = parent
+        self.depth = 0 if parent is None else parent.depth + 1
+        self.local_variables: Dict[str, str] = {}
+        self.local_exports: Dict[str, None] = {}
+        self.pwd = os.getcwd() if parent is None else parent.pwd
+        self.child_env: Optional[List[Tuple[str, str]]] = None
+
+    def get(self, name: str, default: str = '') -> str:
+        context: Optional[Context] = self
+        while context is not None:
+            value = context.local_variables.get(name)
+            if value is not None:
+                return value
+            context = context.parent
+        return default
+
+    def set(self, name: str, value: str) -> None:
+        self.local_variables[name] = value
+        self.child_env = None
+
+    def export(self, name: str) -> None:
+        self.local_exports[name] = None
+        self.child_env = None
+
+    def exported_names(self) -> List[str]:
+        names: Dict[str, None] = {}
+        context: Optional[Context] = self
+        while context is not None:
+            names.update(context.local_exports)
+            context = context.parent
+        return list(names)
+
+    def get_child_env(self) -> List[Tuple[str, str]]:
+        if self.child_env is None:
+            self.child_env = [(name, self.get(name)) for name in self.exported_names()]
+        return self.child_env
+
+    def variables(self) -> Dict[str, str]:
+        layers: List[Dict[str, str]] = []
+        context: Optional[Context] = self
+        while context is not None:
+            layers.append(context.local_variables)
+            context = context.parent
+        variables: Dict[str, str] = {}
+        for layer in reversed(layers):
+            variables.update(layer)
+        return variables
+
+    def fork(self) -> 'Context':
+        with fork_lock:
+            if len(self.local_variables) > 0 or len(self.local_exports) > 0:
+                # Freeze our own layer by moving it underneath us, then both of us write to fresh layers on top of it.
+                frozen = Context(self.parent)
+                frozen.local_variables = self.local_variables
+                frozen.local_exports = self.local_exports
+                self.parent = frozen
+                self.depth = frozen.depth + 1
+                self.local_variables = {}
+                self.local_exports = {}
+            if self.depth >= self.max_depth:
+                self.flatten()
+            child = Context(self.parent)
+            child.pwd = self.pwd
+            child.child_env = self.child_env
+            return child
+
+    def flatten(self) -> None:
+        # Collapse the frozen layers into one, so lookups stay short however often contexts get forked.
+        if self.parent is None:
+            return
+        base = Context()
+        base.local_variables = self.parent.variables()
+        base.local_exports = dict.fromkeys(self.parent.exported_names())
+        self.parent = base
+        self.depth = 1
 
 
 class ExecutionError(Exception):
     pass
 
 
+redirect_flags = {
+    '<': os.O_RDONLY,
+    '>': os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+    '>>': os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+}
+
+
 class Interpreter(InstructionVisitor):
     def __init__(self) -> None:
         self.error_label = 'pysh'
         self.context = Context()
+        # Contexts of the enclosing shells while inside ( ... ), with the pc of the matching popctx and their slots.
+        self.context_stack: List[Tuple[Context, int, List[Optional[str]]]] = []
+        # Must be the table the code was generated with. Variables with a slot are cached in slots, assignments to
+        # them only reach the context when the slots are flushed.
+        self.slot_table = SlotTable()
+        self.slots: List[Optional[str]] = []
+        # Slots assigned since the last flush, each once however often it was assigned.
+        self.dirty_slots: Set[int] = set()
         self.stack: List[str] = []
-        self.code: List[Instruction] = []
+        self.code: Sequence[Instruction] = []
         self.builtins: Dict[str, Callable[[InvokeInfo], int]] = {}
+        self.stat_cache = StatCache()
+        self.glob_expander = GlobExpander()
+        # Variable values and result of the last evaluation of every arithmetic instruction, kept here since the
+        # instructions are shared between runs. Instructions hash by identity, holding them keeps a key from being
+        # reused by another one.
+        self.arithmetic_results: Dict[ArithmeticInstruction, Tuple[Tuple[str, ...], str]] = {}
+        # Redirections of the next call, by the fd they replace, and the files opened for them.
+        self.redirections: Dict[int, int] = {}
+        self.redirected_files: List[int] = []
+        self.redirected_streams: List[TextIO] = []
+        self.redirection_failed = False
+        # Set to a UsageReport to have the cost of every command recorded.
+        self.usage: Optional['UsageReport'] = None
+        # Set to a Metrics to have instructions, commands and spawn times counted.
+        self.metrics: Optional['Metrics'] = None
+        # Sum of the offsets of the jumps taken, which tells how many instructions ran without counting each one.
+        self.jumped = 0
+        # None writes to whatever sys.stdout is at the time, like print does. While that is the real stdout, builtins
+        # write to output instead, which goes to fd 1 directly.
+        self.stdout: Optional[TextIO] = None
+        self.output: Optional[OutputBuffer] = None
+        # None writes to whatever sys.stderr is at the time. Otherwise errors go here, and so does the stderr of
+        # external commands when it has an fd.
+        self.stderr: Optional[TextIO] = None
+        # $0, $1 and on.
+        self.positional_parameters: List[str] = ['pysh']
+        # Set while running code that passed the verifier, which can't underflow the stack or jump out of the code.
+        self.verified = False
         self.pc = 0
         self.buffer = ''
         self.reg_a = 0
         self.reg_b = 0
         self.rv = 0
 
-    def execute(self, code: Iterable[Instruction]) -> None:
+    def execute(self, code: Iterable[Instruction], verified: bool = False) -> bool:
+        if not isinstance(self.code, list):
+            self.code = list(self.code)
         self.code.extend(code)
+        self.verified = verified
+        self.load_slots()
+        start = self.pc
+        try:
+            return self.resume()
+        finally:
+            self.count_instructions(start)
+            self.flush_slots()
+            self.flush_output()
+
+    def run(self, code: Sequence[Instruction], verified: bool = False) -> int:
+        # Executes a complete program without copying it, so one compiled program can be shared between runs.
+        self.code = code
+        self.pc = 0
+        self.verified = verified
+        self.load_slots()
+        try:
+            self.resume()
+        finally:
+            self.count_instructions(0)
+            self.flush_slots()
+            self.flush_output()
+            self.code = []
+            self.pc = 0
+        return self.rv
+
+    def count_instructions(self, start: int) -> None:
+        # Every instruction moves pc on by one, jumps move it by their offset on top.
+        if self.metrics is not None:
+            self.metrics.instructions += self.pc - start - self.jumped
+        self.jumped = 0
+
+    def record_spawn(self, start: float) -> None:
+        if self.metrics is not None:
+            self.metrics.spawn_seconds.observe(time.perf_counter() - start)
+
+    def load_slots(self) -> None:
+        # Values are read from the context on first use, the context may have changed since the last run.
+        self.slots = [None] * len(self.slot_table.names)
+        self.dirty_slots = set()
+
+    def flush_slots(self) -> None:
+        names = self.slot_table.names
+        for slot in self.dirty_slots:
+            value = self.slots[slot]
+            if value is not None:
+                self.context.set(names[slot], value)
+        self.dirty_slots = set()
+
+    def get_stdout(self) -> Optional[TextIO]:
+        if self.stdout is not None:
+            return self.stdout
+        if sys.stdout is not sys.__stdout__:
+            # Replaced, by redirect_stdout for example. Builtins follow it, like print does.
+            return None
+        if self.output is None:
+            sys.stdout.flush()
+            self.output = OutputBuffer(1, line_buffered=os.isatty(1))
+        return self.output
+
+    def flush_output(self) -> None:
+        if self.output is not None:
+            self.output.flush()
+
+    def get_slot(self, slot: int, name: str) -> str:
+        if slot < 0:
+            return self.get_var(name)
+        value = self.slots[slot]
+        if value is None:
+            value = self.context.get(name)
+            self.slots[slot] = value
+        return value
+
+    def resume(self) -> bool:
+        # False when the code was stopped by an error.
         code_len = len(self.code)
         try:
             while self.pc < code_len:
@@ -46,13 +262,20 @@ class Interpreter(InstructionVisitor):
                 instruction.accept(self)
                 self.pc += 1
         except ExecutionError as e:
-            self.print_error(str(e))
+            self.abort(e)
+            return False
+        return True
+
+    def abort(self, e: ExecutionError) -> None:
+        # Like sh leaving a script on a fatal error, with the status of a syntax error.
+        self.print_error(str(e))
+        self.rv = 2
 
     def visit_concat(self, instruction: ConcatInstruction) -> None:
         self.buffer += instruction.value
 
     def visit_substitute(self, instruction: SubstituteInstruction) -> None:
-        value = self.get_var(instruction.value)
+        value = self.get_slot(instruction.slot, instruction.value)
         parts = value.split(' ')
 
         # remove empty parts
@@ -69,7 +292,24 @@ class Interpreter(InstructionVisitor):
             self.reg_a += arglen - 1
 
     def visit_substitute_single(self, instruction: SubstituteSingleInstruction) -> None:
-        self.buffer += self.context.variables.get(instruction.value, '')
+        self.buffer += self.get_slot(instruction.slot, instruction.value)
+
+    def visit_substitute_escaped(self, instruction: SubstituteEscapedInstruction) -> None:
+        self.buffer += escape(self.get_slot(instruction.slot, instruction.value))
+
+    def visit_arithmetic(self, instruction: ArithmeticInstruction) -> None:
+        operands = tuple([self.get_slot(slot, name) for name, slot in instruction.variables])
+        # Evaluated again only when one of the variables has changed since the last time.
+        last = self.arithmetic_results.get(instruction)
+        if last is not None and last[0] == operands:
+            self.buffer += last[1]
+            return
+        try:
+            result = str(instruction.evaluate([to_integer(operand) for operand in operands]))
+        except (ValueError, ZeroDivisionError) as e:
+            raise ExecutionError('{0}: {1}'.format(instruction.value, e))
+        self.arithmetic_results[instruction] = (operands, result)
+        self.buffer += result
 
     def visit_load_buffer(self, instruction: LoadBufferInstruction) -> None:
         self.buffer = instruction.value
@@ -94,75 +334,311 @@ class Interpreter(InstructionVisitor):
             raise ExecutionError('Cannot pop top of stack to register a, top of stack is not an integer value.') from e
         self.reg_a = int_val
 
+    def visit_glob(self, instruction: GlobInstruction) -> None:
+        self.reg_a += self.glob_expander.expand_onto(self.buffer, self.context.pwd, self.stack)
+
     def visit_call(self, instruction: CallInstruction) -> None:
+        try:
+            call = self.prepare_call()
+            if call is None:
+                return
+            target, invoke_info = call
+            if target is None:
+                target = self.invoke_subprocess
+            elif self.usage is not None:
+                target = self.usage.timed(target, self.code[self.pc].line)
+
+            if len(self.context_stack) == 0:
+                self.rv = target(invoke_info)
+                return
+
+            try:
+                self.rv = target(invoke_info)
+            except SystemExit as e:
+                self.exit_subshell(e)
+        finally:
+            if len(self.redirections) > 0:
+                self.finish_redirections()
+
+    def prepare_call(self) -> Optional[Tuple[Optional[Callable[[InvokeInfo], int]], InvokeInfo]]:
+        # Pops the arguments of a call, the target is None for an external command.
         stack_len = len(self.stack)
-        if stack_len < self.reg_a:
+        if not self.verified and stack_len < self.reg_a:
             raise ExecutionError('Cannot call, stack underflow.')
         stack_start = stack_len - self.reg_a
         args = self.stack[stack_start:]
         del self.stack[stack_start:]
 
+        # The command may change the directories we have listed.
+        self.glob_expander.clear()
+
+        if self.redirection_failed:
+            self.redirection_failed = False
+            self.rv = 1
+            return None
+
         if len(args) is 0:
+            return None
+
+        if len(self.dirty_slots) > 0:
+            self.flush_slots()
+        target = self.builtins.get(args[0])
+        if self.metrics is not None:
+            self.metrics.record_command(args[0], target is not None)
+        invoke_info = InvokeInfo(args, self.get_child_env(), '', self.context.pwd, self.stat_cache, self.get_stdout(),
+                                  self.stderr)
+        if len(self.redirections) > 0:
+            # The redirected fds may well lead to the same place as our own output.
+            self.flush_output()
+            invoke_info.fds = self.redirections
+            if target is not None:
+                # Builtins write to streams on top of the redirected fds, the data still goes straight to the file.
+                if 1 in self.redirections:
+                    invoke_info.stdout = self.open_redirected_stream(self.redirections[1])
+                if 2 in self.redirections:
+                    invoke_info.stderr = self.open_redirected_stream(self.redirections[2])
+        return target, invoke_info
+
+    def visit_redirect(self, instruction: RedirectInstruction) -> None:
+        if self.redirection_failed:
+            return
+        if instruction.fd > 2:
+            self.print_error('{0}: only fds 0, 1 and 2 can be redirected'.format(instruction.fd))
+            self.redirection_failed = True
             return
 
-        command_name = args[0]
-        target = self.builtins.get(command_name)
+        if instruction.operator == '<&' or instruction.operator == '>&':
+            if self.buffer == '-':
+                # Closing a stream is approximated with /dev/null, the child always gets some fd.
+                self.open_redirection(instruction.fd, os.devnull, os.O_RDWR)
+            elif self.buffer.isdigit() and int(self.buffer) <= 2:
+                source = int(self.buffer)
+                self.redirections[instruction.fd] = self.redirections.get(source, source)
+            else:
+                self.print_error('{0}: bad file descriptor'.format(self.buffer))
+                self.redirection_failed = True
+            return
 
-        if target is None:
-            target = self.invoke_subprocess
+        path = os.path.join(self.context.pwd, self.buffer)
+        self.open_redirection(instruction.fd, path, redirect_flags[instruction.operator])
 
-        invoke_info = InvokeInfo(args, self.get_child_env(), '', self.context.pwd)
-        self.rv = target(invoke_info)
+    def open_redirection(self, fd: int, path: str, flags: int) -> None:
+        try:
+            opened = os.open(path, flags | os.O_CLOEXEC, 0o666)
+        except OSError as e:
+            self.print_error('{0}: {1}'.format(self.buffer, e.strerror))
+            self.redirection_failed = True
+            return
+        self.redirected_files.append(opened)
+        self.redirections[fd] = opened
+        # The file may have just been created or truncated.
+        self.stat_cache.invalidate()
+
+    def open_redirected_stream(self, fd: int) -> TextIO:
+        if fd == 1 and self.stdout is None and self.output is None:
+            sys.stdout.flush()
+        stream = open(fd, 'w', closefd=False)
+        self.redirected_streams.append(stream)
+        return stream
+
+    def finish_redirections(self) -> None:
+        for stream in self.redirected_streams:
+            stream.close()
+        self.redirected_streams = []
+        for fd in self.redirected_files:
+            os.close(fd)
+        self.redirected_files = []
+        self.redirections = {}
+        self.redirection_failed = False
+
+    def exit_subshell(self, e: SystemExit) -> None:
+        # exit inside a subshell only leaves the subshell.
+        self.rv = exit_status(e)
+        target = self.context_stack[-1][1] - 1
+        self.jumped += target - self.pc
+        self.pc = target
 
     def visit_set_var(self, instruction: SetVarInstruction) -> None:
-        var_name = self.stack.pop()
-        self.context.variables[var_name] = self.buffer
+        if instruction.slot < 0:
+            self.context.set(instruction.value, self.buffer)
+            return
+        self.slots[instruction.slot] = self.buffer
+        self.dirty_slots.add(instruction.slot)
+
+    def check_jump(self, offset: int) -> None:
+        target = self.pc + 1 + offset
+        if not 0 <= target <= len(self.code):
+            raise ExecutionError('Cannot jump to {0}, out of range.'.format(target))
 
     def visit_branch_return_value(self, instruction: BranchReturnValueInstruction) -> None:
-        raise NotImplementedError()
+        if self.rv != 0:
+            if not self.verified:
+                self.check_jump(instruction.offset)
+            self.jumped += instruction.offset
+            self.pc += instruction.offset
+
+    def visit_branch_return_value_zero(self, instruction: BranchReturnValueZeroInstruction) -> None:
+        if self.rv == 0:
+            if not self.verified:
+                self.check_jump(instruction.offset)
+            self.jumped += instruction.offset
+            self.pc += instruction.offset
+
+    def visit_negate_return_value(self, instruction: NegateReturnValueInstruction) -> None:
+        self.rv = 1 if self.rv == 0 else 0
+
+    def visit_set_return_value(self, instruction: SetReturnValueInstruction) -> None:
+        self.rv = instruction.value
 
     def visit_branch_buffer_empty(self, instruction: BranchBufferEmptyInstruction) -> None:
         if len(self.buffer) is 0:
+            if not self.verified:
+                self.check_jump(instruction.offset)
+            self.jumped += instruction.offset
             self.pc += instruction.offset
 
     def visit_branch_if_a_not_zero(self, instruction: BranchIfANotZeroInstruction) -> None:
         if self.reg_a is not 0:
+            if not self.verified:
+                self.check_jump(instruction.offset)
+            self.jumped += instruction.offset
             self.pc += instruction.offset
 
     def visit_jump_relative(self, instruction: JumpRelativeInstruction) -> None:
+        if not self.verified:
+            self.check_jump(instruction.offset)
+        self.jumped += instruction.offset
         self.pc += instruction.offset
 
     def visit_add_rv_to_a(self, instruction: AddRVToAInstruction) -> None:
         self.reg_a += self.rv
 
+    def visit_push_context(self, instruction: PushContextInstruction) -> None:
+        if not self.verified:
+            # The target is the matching popctx, where an exit continues.
+            self.check_jump(instruction.offset - 1)
+        self.flush_slots()
+        self.context_stack.append((self.context, self.pc + instruction.offset, list(self.slots)))
+        self.context = self.context.fork()
+
+    def visit_pop_context(self, instruction: PopContextInstruction) -> None:
+        self.context, _, self.slots = self.context_stack.pop()
+        self.dirty_slots = set()
+
     def get_child_env(self) -> List[Tuple[str, str]]:
-        env: List[Tuple[str, str]] = []
-        for var_name in self.context.exported_variables:
-            env.append((var_name, self.context.variables.get(var_name, '')))
-        return env
+        return self.context.get_child_env()
 
     def get_var(self, name: str) -> str:
         if name == '?':
             return str(self.rv)
-        return self.context.variables.get(name, '')
+        if name.isdigit():
+            index = int(name)
+            return self.positional_parameters[index] if index < len(self.positional_parameters) else ''
+        if name == '#':
+            return str(len(self.positional_parameters) - 1)
+        if name == '@' or name == '*':
+            return ' '.join(self.positional_parameters[1:])
+        return self.context.get(name)
+
+    def child_stdio(self, info: InvokeInfo) -> Tuple[Optional[int], Optional[int], Optional[int], Optional[TextIO]]:
+        # Works out the fds to hand to a child for stdin, stdout and stderr, None meaning our own. When stdout is a
+        # stream without an fd it is returned last, the child's output then has to be relayed through it.
+        fds = info.fds if info.fds is not None else {}
+        stdout = info.stdout
+        stdout_fd = fds.get(1)
+        if stdout is not None:
+            if stdout_fd is None:
+                try:
+                    stdout_fd = stdout.fileno()
+                except (AttributeError, OSError):
+                    stdout_fd = None
+            stdout.flush()
+        relay = stdout if stdout is not None and stdout_fd is None else None
+        stderr_fd = fds.get(2)
+        if stderr_fd is None and info.stderr is not None:
+            try:
+                stderr_fd = info.stderr.fileno()
+            except (AttributeError, OSError):
+                # Without an fd the child writes to our own stderr, only errors of builtins are captured.
+                stderr_fd = None
+            info.stderr.flush()
+        return fds.get(0), stdout_fd, stderr_fd, relay
 
     def invoke_subprocess(self, info: InvokeInfo) -> int:
+        import subprocess
+
+        # An external command may change any file we have looked at.
+        self.stat_cache.invalidate()
+        stdin_fd, stdout_fd, stderr_fd, relay = self.child_stdio(info)
+
+        start = time.perf_counter()
         try:
-            result = subprocess.run(info.arguments, cwd=info.pwd, env={})
+            process = subprocess.Popen(info.arguments, cwd=info.pwd, env=dict(info.env), stdin=stdin_fd,
+                                       stdout=stdout_fd if relay is None else subprocess.PIPE, stderr=stderr_fd)
         except OSError:
             self.print_error('failed to execute ' + info.arguments[0])
             return 127
-        return result.returncode
+        self.record_spawn(start)
+
+        try:
+            if relay is not None:
+                # Not backed by a file descriptor, the child's output has to be relayed. It is passed on in chunks,
+                # so however much the child prints, only a chunk of it is held here.
+                with process.stdout:
+                    relay_output(process.stdout, relay)
+            status, rusage = self.wait_child(process)
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+
+        if self.usage is not None:
+            self.usage.record_external(info, self.code[self.pc].line, status, time.perf_counter() - start, rusage)
+        return status
+
+    def wait_child(self, process: 'subprocess.Popen') -> Tuple[int, Any]:
+        # Reaping the child ourselves gets us its resource usage at no extra cost.
+        if not hasattr(os, 'wait4'):
+            return process.wait(), None
+        pid, wait_status, rusage = os.wait4(process.pid, 0)
+        if os.WIFSIGNALED(wait_status):
+            process.returncode = -os.WTERMSIG(wait_status)
+        else:
+            process.returncode = os.WEXITSTATUS(wait_status)
+        return process.returncode, rusage
 
     def print_error(self, message: str) -> None:
-        sys.stderr.write('{0}: {1}\n'.format(self.error_label, message))
+        self.flush_output()
+        (self.stderr or sys.stderr).write('{0}: {1}\n'.format(self.error_label, message))
+
+
+def exit_status(e: SystemExit) -> int:
+    if e.code is None:
+        return 0
+    return e.code if isinstance(e.code, int) else 1
+
+
+class LazyBuiltin(object):
+    # Imports the module implementing a builtin on first use, then replaces itself in the registry.
+    def __init__(self, registry: Dict[str, Callable[[InvokeInfo], int]], name: str, module: str,
+                 function: str) -> None:
+        self.registry = registry
+        self.name = name
+        self.module = module
+        self.function = function
+
+    def __call__(self, info: InvokeInfo) -> int:
+        target = getattr(importlib.import_module(self.module), self.function)
+        self.registry[self.name] = target
+        return target(info)
 
 
 def install_builtins(interpreter: Interpreter) -> None:
     registry = interpreter.builtins
     registry['ls'] = builtins.ls
     registry['exit'] = builtins.exit
-    registry['test'] = builtins.test.test
+    registry['test'] = LazyBuiltin(registry, 'test', 'pysh.builtins.test', 'test')
+    registry['['] = LazyBuiltin(registry, '[', 'pysh.builtins.test', 'left_bracket')
     registry['echo'] = builtins.echo
     registry['true'] = builtins.true
     registry['false'] = builtins.false
@@ -1,5 +1,5 @@
 import enum
-from typing import List, Tuple, Callable, Optional
+from typing import List, Callable, Optional
 
 
 class TokenType(enum.Enum):
@@ -16,19 +16,29 @@ class TokenType(enum.Enum):
     FI = 10
     QUOTES = 11
     ASSIGNMENT = 12
+    LEFT_PAREN = 13
+    RIGHT_PAREN = 14
+    AND_AND = 15
+    OR_OR = 16
+    REDIRECT = 17
+
+
+SYMBOL_PUNCTUATION = frozenset('_?-.,/:+%@~^![]*')
 
 
 class Token(object):
-    def __init__(self, type: TokenType, value: str) -> None:
+    def __init__(self, type: TokenType, value: str, line: int = 0, column: int = 0) -> None:
         self.type = type
         self.value = value
+        self.line = line
+        self.column = column
 
     def __repr__(self) -> str:
         return '<Token type: {0}, value: {1}>'.format(self.type, self.value)
 
 
 class TokenLexDefinition(object):
-    def __init__(self, *, pattern: Optional[str] = None, matcher: Optional[Callable[[str], int]] = None,
+    def __init__(self, *, pattern: Optional[str] = None, matcher: Optional[Callable[[str, int, str], int]] = None,
                  token_func: Optional[Callable[[str], Token]] = None,
                  token_type: Optional[TokenType] = None) -> None:
         self.pattern = pattern
@@ -36,10 +46,10 @@ class TokenLexDefinition(object):
         self.token_func = token_func
         self.token_type = token_type
 
-    def match(self, source: str) -> int:
+    def match(self, source: str, pos: int) -> int:
         if self.matcher is not None:
-            return self.matcher(source, self.pattern)
-        if source.startswith(self.pattern):
+            return self.matcher(source, pos, self.pattern)
+        if source.startswith(self.pattern, pos):
             return len(self.pattern)
         return 0
 
@@ -47,48 +57,64 @@ class TokenLexDefinition(object):
 class Lexer(object):
     def __init__(self) -> None:
         self.definitions = self.make_definitions()
+        # Position of the next character, carried across calls so line-by-line input keeps counting.
+        self.line = 1
+        self.column = 1
 
     def lex_all(self, source: str) -> List[Token]:
+        # Works on offsets into the source, a whole script is lexed without copying what is left of it for every token.
         tokens = []
-        while len(source) > 0:
-            token, source = self.lex(source)
+        pos = 0
+        end = len(source)
+        while pos < end:
+            token = self.lex(source, pos)
+            token.line = self.line
+            token.column = self.column
+            self.advance(token.value)
             tokens.append(token)
+            pos += len(token.value)
         return tokens
 
-    def lex(self, source: str) -> Tuple[Token, str]:
+    def advance(self, value: str) -> None:
+        newlines = value.count('\n')
+        if newlines > 0:
+            self.line += newlines
+            self.column = len(value) - value.rfind('\n')
+        else:
+            self.column += len(value)
+
+    def lex(self, source: str, pos: int = 0) -> Token:
         for definition in self.definitions:
-            match_length = definition.match(source)
+            match_length = definition.match(source, pos)
             if match_length <= 0:
                 continue
-            value = source[:match_length]
+            value = source[pos:pos + match_length]
             if definition.token_func is not None:
-                token = definition.token_func(value)
-            else:
-                token = Token(definition.token_type, value)
-            return token, source[match_length:]
-        return Token(TokenType.UNKNOWN, source[0]), source[1:]
-
-    def match_whitespace(self, source: str, pattern: str) -> int:
-        idx = 0
+                return definition.token_func(value)
+            return Token(definition.token_type, value)
+        return Token(TokenType.UNKNOWN, source[pos])
+
+    def match_whitespace(self, source: str, pos: int, pattern: str) -> int:
+        idx = pos
         while idx < len(source):
             val = source[idx]
             if not val.isspace() or val == '\n':
                 break
             idx += 1
-        return idx
+        return idx - pos
 
-    def match_symbol(self, source: str, pattern: str) -> int:
-        idx = 0
+    def match_symbol(self, source: str, pos: int, pattern: str) -> int:
+        idx = pos
         while idx < len(source):
             val = source[idx]
-            if not (val.isalnum() or val == '_' or val == '?'):
+            if not (val.isalnum() or val in SYMBOL_PUNCTUATION):
                 break
             idx += 1
-        return idx
+        return idx - pos
 
-    def match_keyword(self, source: str, pattern: str) -> int:
-        symbol_length = self.match_symbol(source, pattern)
-        if source[:symbol_length] == pattern:
+    def match_keyword(self, source: str, pos: int, pattern: str) -> int:
+        symbol_length = self.match_symbol(source, pos, pattern)
+        if symbol_length == len(pattern) and source.startswith(pattern, pos):
             return symbol_length
         return 0
 
@@ -102,6 +128,15 @@ class Lexer(object):
             TokenLexDefinition(pattern="$", token_type=TokenType.DOLLAR_SIGN),
             TokenLexDefinition(pattern="{", token_type=TokenType.LEFT_CURLY_BRACKET),
             TokenLexDefinition(pattern='}', token_type=TokenType.RIGHT_CURLY_BRACKET),
+            TokenLexDefinition(pattern='&&', token_type=TokenType.AND_AND),
+            TokenLexDefinition(pattern='||', token_type=TokenType.OR_OR),
+            TokenLexDefinition(pattern='>>', token_type=TokenType.REDIRECT),
+            TokenLexDefinition(pattern='>&', token_type=TokenType.REDIRECT),
+            TokenLexDefinition(pattern='<&', token_type=TokenType.REDIRECT),
+            TokenLexDefinition(pattern='>', token_type=TokenType.REDIRECT),
+            TokenLexDefinition(pattern='<', token_type=TokenType.REDIRECT),
+            TokenLexDefinition(pattern='(', token_type=TokenType.LEFT_PAREN),
+            TokenLexDefinition(pattern=')', token_type=TokenType.RIGHT_PAREN),
             TokenLexDefinition(pattern='if', matcher=self.match_keyword, token_type=TokenType.IF),
             TokenLexDefinition(pattern='then', matcher=self.match_keyword, token_type=TokenType.THEN),
             TokenLexDefinition(pattern='else', matcher=self.match_keyword, token_type=TokenType.ELSE),
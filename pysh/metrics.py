@@ -0,0 +1,229 @@
+import bisect
+import socket
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from pysh.unixsockets import bind_private, remove_socket
+
+# Counters for long-running processes (pysh --server, pysh-cluster worker), served in the OpenMetrics text format.
+# Recording is a few additions at every call and every run, the interpreter loop itself counts nothing.
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+
+class Histogram(object):
+    # Seconds, from a fork and exec to a build step.
+    buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self) -> None:
+        # counts[i] is the number of values up to buckets[i], the last one counts everything larger.
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def merge(self, counts: Sequence[int], sum: float) -> None:
+        for index, count in enumerate(counts[:len(self.counts)]):
+            self.counts[index] += count
+        self.sum += sum
+
+    def format(self, name: str, labels: str = '') -> List[str]:
+        lines = []
+        separator = ',' if len(labels) > 0 else ''
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append('{0}_bucket{{{1}{2}le="{3}"}} {4}'.format(name, labels, separator, le, cumulative))
+        braces = '{' + labels + '}' if len(labels) > 0 else ''
+        lines.append('{0}_count{1} {2}'.format(name, braces, cumulative))
+        lines.append('{0}_sum{1} {2!r}'.format(name, braces, self.sum))
+        return lines
+
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics(object):
+    # Every distinct command name is a series of its own. Past this many, commands are counted under "other".
+    max_command_names = 256
+
+    def __init__(self) -> None:
+        self.instructions = 0
+        self.runs = 0
+        self.failed_runs = 0
+        self.parse_errors = 0
+        # By (name, builtin).
+        self.commands: Dict[Tuple[str, bool], int] = {}
+        self.spawn_seconds = Histogram()
+        self.run_seconds = Histogram()
+        # Anything with hits and misses attributes, a CompileCache.
+        self.compile_cache: Optional[Any] = None
+
+    def record_command(self, name: str, builtin: bool, count: int = 1) -> None:
+        key = (name, builtin)
+        if key not in self.commands and len(self.commands) >= self.max_command_names:
+            key = ('other', builtin)
+        self.commands[key] = self.commands.get(key, 0) + count
+
+    def record_run(self, status: int, elapsed: float) -> None:
+        self.runs += 1
+        if status != 0:
+            self.failed_runs += 1
+        self.run_seconds.observe(elapsed)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'instructions': self.instructions,
+            'runs': self.runs,
+            'failed_runs': self.failed_runs,
+            'parse_errors': self.parse_errors,
+            'commands': [[name, builtin, count] for (name, builtin), count in self.commands.items()],
+            'spawn_seconds': [self.spawn_seconds.counts, self.spawn_seconds.sum],
+            'run_seconds': [self.run_seconds.counts, self.run_seconds.sum],
+        }
+
+    def merge(self, data: Dict[str, Any]) -> None:
+        # Adds up the counters of another process, a server's children send theirs when they are done.
+        self.instructions += int(data.get('instructions', 0))
+        self.runs += int(data.get('runs', 0))
+        self.failed_runs += int(data.get('failed_runs', 0))
+        self.parse_errors += int(data.get('parse_errors', 0))
+        for name, builtin, count in data.get('commands', ()):
+            self.record_command(str(name), bool(builtin), int(count))
+        self.spawn_seconds.merge(*data.get('spawn_seconds', ((), 0.0)))
+        self.run_seconds.merge(*data.get('run_seconds', ((), 0.0)))
+
+    def format(self) -> str:
+        lines = [
+            '# TYPE pysh_instructions counter',
+            '# HELP pysh_instructions Instructions executed.',
+            'pysh_instructions_total {0}'.format(self.instructions),
+            '# TYPE pysh_runs counter',
+            '# HELP pysh_runs Programs run, by whether they exited with a status other than 0.',
+            'pysh_runs_total{{failed="false"}} {0}'.format(self.runs - self.failed_runs),
+            'pysh_runs_total{{failed="true"}} {0}'.format(self.failed_runs),
+            '# TYPE pysh_run_seconds histogram',
+            '# UNIT pysh_run_seconds seconds',
+            '# HELP pysh_run_seconds Time taken by a program run.',
+        ]
+        lines += self.run_seconds.format('pysh_run_seconds')
+        lines += [
+            '# TYPE pysh_commands counter',
+            '# HELP pysh_commands Commands run, by name and by whether they are builtins.',
+        ]
+        # Copied in one go, a worker may be adding to it from another thread.
+        for (name, builtin), count in sorted(dict(self.commands).items()):
+            lines.append('pysh_commands_total{{name="{0}",kind="{1}"}} {2}'.format(
+                escape_label(name), 'builtin' if builtin else 'external', count))
+        lines += [
+            '# TYPE pysh_spawn_seconds histogram',
+            '# UNIT pysh_spawn_seconds seconds',
+            '# HELP pysh_spawn_seconds Time taken to start an external command.',
+        ]
+        lines += self.spawn_seconds.format('pysh_spawn_seconds')
+        lines += [
+            '# TYPE pysh_parse_errors counter',
+            '# HELP pysh_parse_errors Scripts that failed to parse.',
+            'pysh_parse_errors_total {0}'.format(self.parse_errors),
+        ]
+        if self.compile_cache is not None:
+            lines += [
+                '# TYPE pysh_compile_cache_lookups counter',
+                '# HELP pysh_compile_cache_lookups Lookups of compiled programs by source, by whether they hit.',
+                'pysh_compile_cache_lookups_total{{result="hit"}} {0}'.format(self.compile_cache.hits),
+                'pysh_compile_cache_lookups_total{{result="miss"}} {0}'.format(self.compile_cache.misses),
+            ]
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsRequest(object):
+    # The HTTP request of one connection, collected as it arrives.
+    max_size = 8192
+
+    def __init__(self, conn: socket.socket, deadline: float) -> None:
+        self.conn = conn
+        self.deadline = deadline
+        self.data = b''
+
+    def read(self) -> bool:
+        # True once the request is complete, or as complete as it is going to get.
+        try:
+            chunk = self.conn.recv(4096)
+        except BlockingIOError:
+            return False
+        self.data += chunk
+        return len(chunk) == 0 or b'\r\n\r\n' in self.data or b'\n\n' in self.data or len(self.data) >= self.max_size
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class MetricsEndpoint(object):
+    # Answers HTTP GET requests for /metrics. An address with a / in it is a unix socket, anything else is
+    # [HOST:]PORT, on loopback unless a host is given.
+    request_timeout = 1.0
+
+    def __init__(self, address: str, metrics: Metrics) -> None:
+        self.metrics = metrics
+        self.path: Optional[str] = None
+        self.socket_id: Optional[Tuple[int, int]] = None
+        if '/' in address:
+            self.path = address
+            self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket_id = bind_private(self.listener, address)
+        else:
+            host, _, port = address.rpartition(':')
+            host = host.strip('[]') or '127.0.0.1'
+            self.listener = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.listener.bind((host, int(port)))
+        self.listener.listen(16)
+
+    def fileno(self) -> int:
+        return self.listener.fileno()
+
+    def serve_forever(self) -> None:
+        # For a thread of its own, every request is served in line.
+        while True:
+            conn, address = self.listener.accept()
+            conn.settimeout(self.request_timeout)
+            request = MetricsRequest(conn, 0.0)
+            try:
+                while not request.read():
+                    pass
+                self.answer(request)
+            except OSError:
+                pass
+            request.close()
+
+    def accept(self) -> MetricsRequest:
+        # For an event loop, which reads the request as it becomes readable and answers it once read returns True.
+        conn, address = self.listener.accept()
+        conn.setblocking(False)
+        return MetricsRequest(conn, time.monotonic() + self.request_timeout)
+
+    def answer(self, request: MetricsRequest) -> None:
+        # The response fits in the socket buffer, sending it doesn't wait for the client.
+        parts = request.data.split(b'\n', 1)[0].split()
+        if len(parts) < 2 or parts[0] != b'GET':
+            request.conn.sendall(response('405 Method Not Allowed', 'text/plain', b'only GET is supported\n'))
+        elif parts[1].split(b'?')[0] not in (b'/', b'/metrics'):
+            request.conn.sendall(response('404 Not Found', 'text/plain', b'not found\n'))
+        else:
+            request.conn.sendall(response('200 OK', CONTENT_TYPE, self.metrics.format().encode('utf-8')))
+
+    def close(self) -> None:
+        self.listener.close()
+        if self.socket_id is not None:
+            remove_socket(self.path, self.socket_id)
+
+
+def response(status: str, content_type: str, body: bytes) -> bytes:
+    header = 'HTTP/1.0 {0}\r\nContent-Type: {1}\r\nContent-Length: {2}\r\nConnection: close\r\n\r\n'.format(
+        status, content_type, len(body))
+    return header.encode('ascii') + body
@@ -0,0 +1,143 @@
+import codecs
+import io
+import os
+from typing import BinaryIO, Iterator, List, Optional, TextIO
+
+# Captured output past this many characters is moved to a temporary file.
+DEFAULT_SPILL_THRESHOLD = 1 << 20
+
+
+class OutputBuffer(io.TextIOBase):
+    # Output of the builtins, written to a file descriptor in large chunks instead of going through sys.stdout, which
+    # may write every line (or every print) on its own. The interpreter flushes it before running an external command
+    # and at the end of every run, so output still comes out in order.
+    def __init__(self, fd: int, capacity: int = 65536, line_buffered: bool = False) -> None:
+        super().__init__()
+        self.fd = fd
+        self.capacity = capacity
+        # Set for terminals, where output is expected to show up as soon as a line is complete.
+        self.line_buffered = line_buffered
+        self.parts: List[str] = []
+        self.size = 0
+
+    def write(self, text: str) -> int:
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.capacity or (self.line_buffered and '\n' in text):
+            self.flush()
+        return len(text)
+
+    def flush(self) -> None:
+        if self.size == 0:
+            return
+        # surrogateescape gives file names that are not valid UTF-8 back their original bytes.
+        data = memoryview(''.join(self.parts).encode('utf-8', 'surrogateescape'))
+        self.parts = []
+        self.size = 0
+        while len(data) > 0:
+            data = data[os.write(self.fd, data):]
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def writable(self) -> bool:
+        return True
+
+
+class CaptureBuffer(io.TextIOBase):
+    # Collects the output of a run, a drop-in for io.StringIO. Small outputs stay in memory, once the threshold is
+    # passed everything is moved to an anonymous temporary file, so a build step printing hundreds of megabytes doesn't
+    # have to fit in memory until the output is actually asked for.
+    def __init__(self, threshold: int = DEFAULT_SPILL_THRESHOLD) -> None:
+        super().__init__()
+        self.threshold = threshold
+        self.parts: List[str] = []
+        self.size = 0
+        self.file: Optional[BinaryIO] = None
+
+    @property
+    def large(self) -> bool:
+        # Past the threshold. Only then is it worth keeping the output out of memory, a capture handed to a child
+        # through fileno is in a file however little was written.
+        return self.file is not None and os.fstat(self.file.fileno()).st_size > self.threshold
+
+    def write(self, text: str) -> int:
+        if self.file is not None:
+            self.write_bytes(text.encode('utf-8', 'surrogateescape'))
+            return len(text)
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size > self.threshold:
+            self.spill()
+        return len(text)
+
+    def spill(self) -> None:
+        import tempfile
+        # Unbuffered, what we write and what children write to the same file come out in the order it was written.
+        self.file = tempfile.TemporaryFile(buffering=0)
+        self.write_bytes(''.join(self.parts).encode('utf-8', 'surrogateescape'))
+        self.parts = []
+
+    def write_bytes(self, data: bytes) -> None:
+        view = memoryview(data)
+        while len(view) > 0:
+            view = view[self.file.write(view):]
+
+    def fileno(self) -> int:
+        # Handed to external commands, which then write into the file themselves instead of having their output
+        # relayed through us.
+        if self.file is None:
+            self.spill()
+        return self.file.fileno()
+
+    def getvalue(self) -> str:
+        if self.file is None:
+            return ''.join(self.parts)
+        self.file.seek(0)
+        data = self.file.read()
+        self.file.seek(0, io.SEEK_END)
+        return data.decode('utf-8', 'surrogateescape')
+
+    def chunks(self, chunk_size: int = 1 << 20) -> Iterator[bytes]:
+        # Streams the output without ever holding all of it.
+        if self.file is None:
+            yield ''.join(self.parts).encode('utf-8', 'surrogateescape')
+            return
+        self.file.seek(0)
+        try:
+            while True:
+                chunk = self.file.read(chunk_size)
+                if len(chunk) == 0:
+                    break
+                yield chunk
+        finally:
+            self.file.seek(0, io.SEEK_END)
+
+    def copy_to(self, destination: BinaryIO) -> None:
+        for chunk in self.chunks():
+            destination.write(chunk)
+
+    def writable(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.parts = []
+        super().close()
+
+
+def make_output_decoder() -> codecs.IncrementalDecoder:
+    # Output of a child is relayed a chunk at a time, a character split between two chunks must come out whole.
+    return codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+
+def relay_output(source: BinaryIO, destination: TextIO, chunk_size: int = 65536) -> None:
+    decoder = make_output_decoder()
+    while True:
+        chunk = source.read(chunk_size)
+        if len(chunk) == 0:
+            break
+        destination.write(decoder.decode(chunk))
+    destination.write(decoder.decode(b'', True))
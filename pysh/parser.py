@@ -1,7 +1,12 @@
+import string
 from typing import List, Optional
+from pysh.arithmetic import ArithmeticNode, ArithmeticSyntaxError, parse_arithmetic
+from pysh.globbing import has_magic
 from pysh.lexer import Token, TokenType
+from pysh.slots import special_names
 from pysh.syntaxnodes import SyntaxNode, ArgumentNode, ArgumentPartNode, ArgumentPartType, CommandNode, \
-    AssignmentNode, AssignmentsNode, ConditionalNode
+    AssignmentNode, AssignmentsNode, ConditionalNode, SubshellNode, AndOrNode, NegationNode, LogicalOperator, \
+    RedirectionNode, ArithmeticPartNode
 
 
 class ParseError(Exception):
@@ -19,6 +24,11 @@ class StateTickResult(object):
 
 
 class ParserState(object):
+    line = 0
+    column = 0
+    # Set by states that consumed the end of statement after them, nothing can be chained on to them anymore.
+    ended_at_eos = False
+
     def tick(self, tokens: List[Token]) -> StateTickResult:
         return StateTickResult(is_done=True, tokens_to_eat=0)
 
@@ -43,10 +53,9 @@ class TopLevelExpressionState(ParserState):
 
         if type is TokenType.WHITESPACE or type is TokenType.EOS:
             return StateTickResult(is_done=True, tokens_to_eat=1)
-        elif type is TokenType.SYMBOL or type is TokenType.DOLLAR_SIGN or type is TokenType.QUOTES:
-            return self.enter_child(ExpressionState())
-        elif type is TokenType.IF:
-            return self.enter_child(ConditionalState())
+        elif type is TokenType.SYMBOL or type is TokenType.DOLLAR_SIGN or type is TokenType.QUOTES \
+                or type is TokenType.IF or type is TokenType.LEFT_PAREN or type is TokenType.REDIRECT:
+            return self.enter_child(AndOrState())
 
         raise ParseError('Unexpected token {0} in top level expression'.format(type))
 
@@ -61,12 +70,24 @@ class TopLevelExpressionState(ParserState):
         return self.child_state.node
 
 
+NAME_CHARACTERS = frozenset(string.ascii_letters + string.digits + '_')
+
+
+def name_length(value: str) -> int:
+    length = 0
+    while length < len(value) and value[length] in NAME_CHARACTERS:
+        length += 1
+    return length
+
+
 class ReplacementState(ParserState):
     def __init__(self) -> None:
         self.has_parsed_prefix = False
         self.has_parsed_key = False
         self.is_block_syntax = False
         self.key_parts: List[str] = []
+        # What followed the name in the same token, $HOME/bin is $HOME and then /bin.
+        self.rest = ''
 
     def tick(self, tokens: List[Token]) -> StateTickResult:
         if not self.has_parsed_prefix:
@@ -91,7 +112,21 @@ class ReplacementState(ParserState):
                 raise ParseError('Unexpected {0}'.format(token.value))
 
             if token.type is TokenType.SYMBOL:
+                if self.is_block_syntax:
+                    self.key_parts.append(token.value)
+                    return StateTickResult(tokens_to_eat=1)
+                length = name_length(token.value)
+                if length == 0 and token.value[0] in special_names:
+                    length = 1
+                self.key_parts.append(token.value[:length])
+                self.rest = token.value[length:]
+                self.has_parsed_key = True
+                return StateTickResult(tokens_to_eat=1)
+
+            if token.type is TokenType.UNKNOWN and token.value == '#' and len(self.key_parts) == 0:
+                # $#, the number of positional parameters.
                 self.key_parts.append(token.value)
+                self.has_parsed_key = True
                 return StateTickResult(tokens_to_eat=1)
 
             self.has_parsed_key = True
@@ -110,26 +145,79 @@ class ReplacementState(ParserState):
         return ''.join(self.key_parts)
 
 
+class ArithmeticState(ParserState):
+    # $(( ... )). The lexer knows nothing about arithmetic, so the tokens up to the closing )) are put back together and
+    # handed to the arithmetic parser as a whole.
+    def __init__(self) -> None:
+        self.has_parsed_prefix = False
+        self.depth = 0
+        self.source_parts: List[str] = []
+        self.expression: Optional[ArithmeticNode] = None
+
+    def tick(self, tokens: List[Token]) -> StateTickResult:
+        if not self.has_parsed_prefix:
+            self.has_parsed_prefix = True
+            return StateTickResult(tokens_to_eat=3)
+
+        if len(tokens) is 0:
+            return StateTickResult(is_incomplete=True)
+        token = tokens[0]
+
+        if token.type is TokenType.RIGHT_PAREN:
+            if self.depth == 0:
+                if len(tokens) < 2:
+                    return StateTickResult(is_incomplete=True)
+                if tokens[1].type is not TokenType.RIGHT_PAREN:
+                    raise ParseError('Expected )) to end arithmetic expansion')
+                try:
+                    self.expression = parse_arithmetic(''.join(self.source_parts))
+                except ArithmeticSyntaxError as e:
+                    raise ParseError(str(e)) from e
+                return StateTickResult(is_done=True, tokens_to_eat=2)
+            self.depth -= 1
+        elif token.type is TokenType.LEFT_PAREN:
+            self.depth += 1
+        elif token.type is TokenType.EOS and token.value == ';':
+            raise ParseError('Unexpected ; in arithmetic expansion')
+
+        self.source_parts.append(token.value)
+        return StateTickResult(tokens_to_eat=1)
+
+
 class ArgumentState(ParserState):
     def __init__(self) -> None:
         self.arg_parts: List[ArgumentPartNode] = []
         self.is_inside_quotes = False
         self.replacement_state: Optional[ReplacementState] = None
+        self.arithmetic_state: Optional[ArithmeticState] = None
         self.parsed_nodes: List[SyntaxNode] = []
         self._node = ArgumentNode()
 
     def tick(self, tokens: List[Token]) -> StateTickResult:
         if self.replacement_state is not None:
             type = ArgumentPartType.REPLACEMENT_SINGLE if self.is_inside_quotes else ArgumentPartType.REPLACEMENT
-            self.arg_parts.append(ArgumentPartNode(type, self.replacement_state.get_replacement_key()))
+            key = self.replacement_state.get_replacement_key()
+            if len(key) > 1 and key[0].isdigit() and not self.replacement_state.is_block_syntax:
+                # Only ${10} goes past $9, $10 is $1 followed by a 0.
+                self.arg_parts.append(ArgumentPartNode(type, key[0]))
+                self.arg_parts.append(ArgumentPartNode(ArgumentPartType.CONSTANT, key[1:]))
+            else:
+                self.arg_parts.append(ArgumentPartNode(type, key))
+            rest = self.replacement_state.rest
+            if len(rest) > 0:
+                self.arg_parts.append(ArgumentPartNode(self.constant_part_type(rest), rest))
             self.replacement_state = None
 
+        if self.arithmetic_state is not None:
+            self.arg_parts.append(ArithmeticPartNode(self.arithmetic_state.expression))
+            self.arithmetic_state = None
+
         if len(tokens) is 0:
             return StateTickResult(is_incomplete=True)
 
         token = tokens[0]
 
-        if token.type is TokenType.WHITESPACE or token.type is TokenType.EOS:
+        if token.type is TokenType.WHITESPACE or token.type is TokenType.EOS or token.type is TokenType.RIGHT_PAREN:
             if self.is_inside_quotes:
                 part_node = ArgumentPartNode(ArgumentPartType.CONSTANT, token.value)
                 self.arg_parts.append(part_node)
@@ -137,21 +225,45 @@ class ArgumentState(ParserState):
             else:
                 return self._finish_node()
 
+        if (token.type is TokenType.AND_AND or token.type is TokenType.OR_OR or token.type is TokenType.REDIRECT) \
+                and not self.is_inside_quotes:
+            return self._finish_node()
+
         if token.type is TokenType.QUOTES:
             self.is_inside_quotes = not self.is_inside_quotes
             return StateTickResult(tokens_to_eat=1)
 
-        if token.type is TokenType.SYMBOL:
-            part_node = ArgumentPartNode(ArgumentPartType.CONSTANT, token.value)
+        if token.type is TokenType.SYMBOL or token.type is TokenType.ASSIGNMENT:
+            part_type = ArgumentPartType.CONSTANT
+            if token.type is TokenType.SYMBOL:
+                part_type = self.constant_part_type(token.value)
+            part_node = ArgumentPartNode(part_type, token.value)
             self.arg_parts.append(part_node)
             return StateTickResult(tokens_to_eat=1)
 
         if token.type is TokenType.DOLLAR_SIGN:
+            if len(tokens) >= 2 and tokens[1].type is TokenType.LEFT_PAREN:
+                if len(tokens) < 3:
+                    return StateTickResult(is_incomplete=True)
+                if tokens[2].type is TokenType.LEFT_PAREN:
+                    self.arithmetic_state = ArithmeticState()
+                    return StateTickResult(child_state=self.arithmetic_state)
             self.replacement_state = ReplacementState()
             return StateTickResult(child_state=self.replacement_state)
 
+        if self.is_inside_quotes:
+            # Everything but a substitution is taken literally inside quotes.
+            part_node = ArgumentPartNode(ArgumentPartType.CONSTANT, token.value)
+            self.arg_parts.append(part_node)
+            return StateTickResult(tokens_to_eat=1)
+
         raise ParseError('Unexpected token while parsing expression: ' + str(token.type))
 
+    def constant_part_type(self, value: str) -> ArgumentPartType:
+        if not self.is_inside_quotes and has_magic(value):
+            return ArgumentPartType.PATTERN
+        return ArgumentPartType.CONSTANT
+
     @property
     def node(self) -> SyntaxNode:
         return self._node
@@ -192,18 +304,23 @@ class ExpressionState(ParserState):
         if token.type == TokenType.WHITESPACE:
             return StateTickResult(tokens_to_eat=1)
 
-        if token.type == TokenType.EOS:
+        if token.type == TokenType.EOS or token.type == TokenType.RIGHT_PAREN or token.type == TokenType.AND_AND \
+                or token.type == TokenType.OR_OR:
             # Finish parsing expression
-            if self.command_state is not None and len(self.command_state.args) > 0:
+            if self.command_state is not None and \
+                    (len(self.command_state.args) > 0 or len(self.command_state.redirections) > 0):
                 # We are invoking a command, not assigning variables.
                 self.command_node = CommandNode()
                 self.command_node.args = self.command_state.args
                 self.command_node.env_assignments = self.assignments
+                self.command_node.redirections = self.command_state.redirections
             else:
                 # We are making variable assignments.
                 self.assignments_node = AssignmentsNode()
                 self.assignments_node.assignments.extend(self.assignments)
-            return StateTickResult(is_done=True, tokens_to_eat=1)
+            # A closing parenthesis or a && and || belong to the enclosing state.
+            self.ended_at_eos = token.type == TokenType.EOS
+            return StateTickResult(is_done=True, tokens_to_eat=1 if self.ended_at_eos else 0)
 
         if not self.has_parsed_assignments:
             next_token = None if len(tokens) < 2 else tokens[1]
@@ -228,13 +345,19 @@ class ExpressionState(ParserState):
 class CommandState(ParserState):
     def __init__(self) -> None:
         self.args: List[ArgumentNode] = []
+        self.redirections: List[RedirectionNode] = []
         self.arg_state: Optional[ArgumentState] = None
+        self.redirection_state: Optional[RedirectionState] = None
 
     def tick(self, tokens: List[Token]) -> StateTickResult:
         if self.arg_state is not None:
             self.args.append(self.arg_state.argument_node)
             self.arg_state = None
 
+        if self.redirection_state is not None:
+            self.redirections.append(self.redirection_state.redirection_node)
+            self.redirection_state = None
+
         if len(tokens) is 0:
             return StateTickResult(is_incomplete=True)
         token = tokens[0]
@@ -242,13 +365,70 @@ class CommandState(ParserState):
         if token.type == TokenType.WHITESPACE:
             return StateTickResult(tokens_to_eat=1)
 
-        if token.type == TokenType.EOS:
+        if token.type == TokenType.EOS or token.type == TokenType.RIGHT_PAREN or token.type == TokenType.AND_AND \
+                or token.type == TokenType.OR_OR:
             return StateTickResult(is_done=True, tokens_to_eat=0)
 
+        if token.type == TokenType.SYMBOL and token.value.isdigit():
+            # A number directly in front of a redirection names the fd, as in 2>&1.
+            if len(tokens) < 2:
+                return StateTickResult(is_incomplete=True)
+            if tokens[1].type == TokenType.REDIRECT:
+                self.redirection_state = RedirectionState()
+                return StateTickResult(child_state=self.redirection_state)
+
+        if token.type == TokenType.REDIRECT:
+            self.redirection_state = RedirectionState()
+            return StateTickResult(child_state=self.redirection_state)
+
         self.arg_state = ArgumentState()
         return StateTickResult(child_state=self.arg_state)
 
 
+class RedirectionState(ParserState):
+    def __init__(self) -> None:
+        self.fd: Optional[int] = None
+        self.operator: Optional[str] = None
+        self.target_state: Optional[ArgumentState] = None
+        self._node: Optional[RedirectionNode] = None
+
+    def tick(self, tokens: List[Token]) -> StateTickResult:
+        if self.target_state is not None:
+            self._node = RedirectionNode(self.fd, self.operator, self.target_state.argument_node)
+            return StateTickResult(is_done=True, tokens_to_eat=0)
+
+        if len(tokens) is 0:
+            return StateTickResult(is_incomplete=True)
+        token = tokens[0]
+
+        if self.operator is None:
+            if token.type is TokenType.SYMBOL:
+                self.fd = int(token.value)
+                return StateTickResult(tokens_to_eat=1)
+            self.operator = token.value
+            if self.fd is None:
+                self.fd = 0 if self.operator.startswith('<') else 1
+            return StateTickResult(tokens_to_eat=1)
+
+        if token.type is TokenType.WHITESPACE:
+            return StateTickResult(tokens_to_eat=1)
+
+        if token.type is not TokenType.SYMBOL and token.type is not TokenType.DOLLAR_SIGN \
+                and token.type is not TokenType.QUOTES:
+            raise ParseError('Expected a file name after ' + self.operator)
+
+        self.target_state = ArgumentState()
+        return StateTickResult(child_state=self.target_state)
+
+    @property
+    def node(self) -> SyntaxNode:
+        return self._node
+
+    @property
+    def redirection_node(self) -> RedirectionNode:
+        return self._node
+
+
 class AssignmentState(ParserState):
     def __init__(self) -> None:
         self.lhs_var_name: Optional[str] = None
@@ -292,7 +472,7 @@ class ConditionalState(ParserState):
         self.has_parsed_expressions = False
         self.has_parsed_else = False
         self.has_parsed_else_expressions = False
-        self.expression_state: Optional[ExpressionState] = None
+        self.expression_state: Optional[ParserState] = None
         self._node = ConditionalNode()
 
     def tick(self, tokens: List[Token]) -> StateTickResult:
@@ -310,7 +490,7 @@ class ConditionalState(ParserState):
 
         if not self.has_parsed_conditions:
             if self.expression_state is None:
-                self.expression_state = ExpressionState()
+                self.expression_state = AndOrState()
                 return StateTickResult(child_state=self.expression_state)
             else:
                 self._node.evaluation_expressions.append(self.expression_state.node)
@@ -327,7 +507,7 @@ class ConditionalState(ParserState):
 
         if not self.has_parsed_expressions:
             if self.expression_state is None:
-                self.expression_state = ExpressionState()
+                self.expression_state = self.make_body_state(token)
                 return StateTickResult(child_state=self.expression_state)
             else:
                 self._node.conditional_expressions.append(self.expression_state.node)
@@ -347,7 +527,7 @@ class ConditionalState(ParserState):
 
         if not self.has_parsed_else_expressions:
             if self.expression_state is None:
-                self.expression_state = ExpressionState()
+                self.expression_state = self.make_body_state(token)
                 return StateTickResult(child_state=self.expression_state)
             else:
                 self._node.else_expressions.append(self.expression_state.node)
@@ -359,12 +539,141 @@ class ConditionalState(ParserState):
             return StateTickResult()
         return StateTickResult(is_done=True, tokens_to_eat=1)
 
+    def make_body_state(self, token: Token) -> ParserState:
+        return AndOrState()
+
+    @property
+    def node(self) -> SyntaxNode:
+        return self._node
+
+
+class SubshellState(ParserState):
+    def __init__(self) -> None:
+        self.has_parsed_paren = False
+        self.has_parsed_close_paren = False
+        self.expression_state: Optional[ParserState] = None
+        self._node = SubshellNode()
+
+    def tick(self, tokens: List[Token]) -> StateTickResult:
+        if self.expression_state is not None:
+            self._node.expressions.append(self.expression_state.node)
+            self.expression_state = None
+
+        if len(tokens) == 0:
+            return StateTickResult(is_incomplete=True)
+
+        token = tokens[0]
+
+        if not self.has_parsed_paren:
+            self.has_parsed_paren = True
+            return StateTickResult(tokens_to_eat=1)
+
+        if self.has_parsed_close_paren:
+            # Like an expression, a subshell consumes the end of statement that follows it.
+            if token.type is TokenType.WHITESPACE:
+                return StateTickResult(tokens_to_eat=1)
+            self.ended_at_eos = token.type is TokenType.EOS
+            return StateTickResult(is_done=True, tokens_to_eat=1 if self.ended_at_eos else 0)
+
+        if token.type is TokenType.WHITESPACE or token.type is TokenType.EOS:
+            return StateTickResult(tokens_to_eat=1)
+
+        if token.type is TokenType.RIGHT_PAREN:
+            self.has_parsed_close_paren = True
+            return StateTickResult(tokens_to_eat=1)
+
+        self.expression_state = AndOrState()
+        return StateTickResult(child_state=self.expression_state)
+
+    @property
+    def node(self) -> SyntaxNode:
+        return self._node
+
+
+class AndOrState(ParserState):
+    # A list of commands joined by && and ||, each of which may be negated with !.
+    def __init__(self) -> None:
+        self.child_state: Optional[ParserState] = None
+        self.is_expecting_expression = True
+        self.is_negated = False
+        self.expressions: List[SyntaxNode] = []
+        self.operators: List[LogicalOperator] = []
+        self._node: Optional[SyntaxNode] = None
+
+    def tick(self, tokens: List[Token]) -> StateTickResult:
+        if self.child_state is not None:
+            node = self.child_state.node
+            if self.is_negated:
+                negation = NegationNode(node)
+                negation.line = node.line
+                negation.column = node.column
+                node = negation
+            self.expressions.append(node)
+            self.is_expecting_expression = False
+            self.is_negated = False
+            ended_at_eos = self.child_state.ended_at_eos
+            self.child_state = None
+            if ended_at_eos:
+                return self._finish_node(ended_at_eos=True, tokens_to_eat=0)
+
+        if len(tokens) == 0:
+            return StateTickResult(is_incomplete=True)
+
+        token = tokens[0]
+
+        if self.is_expecting_expression:
+            # Line breaks are allowed after && and ||.
+            if token.type is TokenType.WHITESPACE or (token.type is TokenType.EOS and len(self.operators) > 0):
+                return StateTickResult(tokens_to_eat=1)
+            if token.type is TokenType.SYMBOL and token.value == '!':
+                if len(tokens) < 2:
+                    return StateTickResult(is_incomplete=True)
+                if tokens[1].type is TokenType.WHITESPACE:
+                    self.is_negated = not self.is_negated
+                    return StateTickResult(tokens_to_eat=1)
+            self.child_state = make_pipeline_state(token)
+            return StateTickResult(child_state=self.child_state)
+
+        if token.type is TokenType.WHITESPACE:
+            return StateTickResult(tokens_to_eat=1)
+        if token.type is TokenType.AND_AND or token.type is TokenType.OR_OR:
+            self.operators.append(LogicalOperator.AND if token.type is TokenType.AND_AND else LogicalOperator.OR)
+            self.is_expecting_expression = True
+            return StateTickResult(tokens_to_eat=1)
+        if token.type is TokenType.EOS:
+            return self._finish_node(ended_at_eos=True, tokens_to_eat=1)
+        return self._finish_node(ended_at_eos=False, tokens_to_eat=0)
+
+    def _finish_node(self, *, ended_at_eos: bool, tokens_to_eat: int) -> StateTickResult:
+        self.ended_at_eos = ended_at_eos
+        if len(self.operators) == 0:
+            # A lone command needs no wrapping.
+            self._node = self.expressions[0]
+        else:
+            node = AndOrNode()
+            node.expressions = self.expressions
+            node.operators = self.operators
+            self._node = node
+        return StateTickResult(is_done=True, tokens_to_eat=tokens_to_eat)
+
     @property
     def node(self) -> SyntaxNode:
         return self._node
 
 
+def make_pipeline_state(token: Token) -> ParserState:
+    if token.type is TokenType.IF:
+        return ConditionalState()
+    if token.type is TokenType.LEFT_PAREN:
+        return SubshellState()
+    return ExpressionState()
+
+
 class Parser(object):
+    # States eat tokens off the front of the list, which gets expensive when the list holds a whole script. Longer
+    # input is handed to them a few statements at a time instead.
+    chunk_size = 256
+
     def __init__(self) -> None:
         self.syntax: List[SyntaxNode] = []
         self.tokens: List[Token] = []
@@ -373,9 +682,17 @@ class Parser(object):
         self.nodes: List[SyntaxNode] = []
 
     def parse(self, tokens: List[Token]) -> List[SyntaxNode]:
-        self.tokens.extend(tokens)
+        start = 0
+        end = len(tokens)
         try:
-            self._process_tokens()
+            while start < end:
+                stop = min(start + self.chunk_size, end)
+                # Chunks end with a statement, so states never see one cut in half.
+                while stop < end and tokens[stop - 1].type is not TokenType.EOS:
+                    stop += 1
+                self.tokens.extend(tokens[start:stop])
+                start = stop
+                self._process_tokens()
         except ParseError as e:
             self.reset()
             raise e
@@ -388,15 +705,16 @@ class Parser(object):
 
     def _process_tokens(self) -> None:
         if self.state is None:
-            self.state = TopLevelExpressionState()
+            self.state = self._enter_state(TopLevelExpressionState())
         while self.state is not None:
             result = self.state.tick(self.tokens)
             del self.tokens[:result.tokens_to_eat]
             if result.child_state is not None:
                 if not result.is_done:
                     self.state_stack.append(self.state)
-                    self.state = result.child_state
+                    self.state = self._enter_state(result.child_state)
             if result.is_done:
+                self._mark_position(self.state)
                 if len(self.state_stack) > 0:
                     self.state = self.state_stack.pop()
                 else:
@@ -404,12 +722,25 @@ class Parser(object):
                     if new_node is not None:
                         self.nodes.append(new_node)
                     if len(self.tokens) > 0:
-                        self.state = TopLevelExpressionState()
+                        self.state = self._enter_state(TopLevelExpressionState())
                     else:
                         self.state = None
             if result.is_incomplete:
                 break
 
+    def _enter_state(self, state: ParserState) -> ParserState:
+        if len(self.tokens) > 0:
+            token = self.tokens[0]
+            state.line = token.line
+            state.column = token.column
+        return state
+
+    def _mark_position(self, state: ParserState) -> None:
+        node = state.node
+        if node is not None and node.line == 0:
+            node.line = state.line
+            node.column = state.column
+
     def reset(self) -> None:
         self.syntax.clear()
         self.tokens.clear()
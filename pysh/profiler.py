@@ -0,0 +1,100 @@
+import time
+from typing import Dict, List, Tuple
+
+from pysh.instructions import Instruction, CallInstruction
+from pysh.interpreter import Interpreter, ExecutionError
+
+
+class CommandProfile(object):
+    def __init__(self, name: str, is_builtin: bool) -> None:
+        self.name = name
+        self.is_builtin = is_builtin
+        self.calls = 0
+        self.time = 0.0
+
+
+class Profiler(object):
+    def __init__(self) -> None:
+        self.opcode_counts: Dict[str, int] = {}
+        self.opcode_times: Dict[str, float] = {}
+        self.line_counts: Dict[int, int] = {}
+        self.line_times: Dict[int, float] = {}
+        self.commands: Dict[Tuple[str, bool], CommandProfile] = {}
+        self.source_lines: Dict[int, str] = {}
+
+    def add_source(self, first_line: int, source: str) -> None:
+        for offset, text in enumerate(source.splitlines()):
+            self.source_lines[first_line + offset] = text
+
+    def record_instruction(self, instruction: Instruction, elapsed: float) -> None:
+        opcode = type(instruction).__name__
+        self.opcode_counts[opcode] = self.opcode_counts.get(opcode, 0) + 1
+        self.opcode_times[opcode] = self.opcode_times.get(opcode, 0.0) + elapsed
+        line = instruction.line
+        self.line_counts[line] = self.line_counts.get(line, 0) + 1
+        self.line_times[line] = self.line_times.get(line, 0.0) + elapsed
+
+    def record_command(self, name: str, is_builtin: bool, elapsed: float) -> None:
+        key = (name, is_builtin)
+        profile = self.commands.get(key)
+        if profile is None:
+            profile = CommandProfile(name, is_builtin)
+            self.commands[key] = profile
+        profile.calls += 1
+        profile.time += elapsed
+
+    def make_report(self, limit: int = 20) -> str:
+        parts: List[str] = []
+
+        parts.append('Opcodes:\n')
+        parts.append('  {0:>10} {1:>12}  {2}\n'.format('count', 'time (ms)', 'opcode'))
+        for opcode in sorted(self.opcode_times, key=self.opcode_times.get, reverse=True):
+            parts.append('  {0:>10} {1:>12.3f}  {2}\n'.format(
+                self.opcode_counts[opcode], self.opcode_times[opcode] * 1000, opcode))
+
+        parts.append('Hot lines:\n')
+        parts.append('  {0:>6} {1:>10} {2:>12}  {3}\n'.format('line', 'count', 'time (ms)', 'source'))
+        for line in sorted(self.line_times, key=self.line_times.get, reverse=True)[:limit]:
+            parts.append('  {0:>6} {1:>10} {2:>12.3f}  {3}\n'.format(
+                line if line > 0 else '?', self.line_counts[line], self.line_times[line] * 1000,
+                self.source_lines.get(line, '').strip()))
+
+        parts.append('Hot commands:\n')
+        parts.append('  {0:>10} {1:>12}  {2:<8}  {3}\n'.format('calls', 'time (ms)', 'kind', 'command'))
+        commands = sorted(self.commands.values(), key=lambda profile: profile.time, reverse=True)
+        for profile in commands[:limit]:
+            parts.append('  {0:>10} {1:>12.3f}  {2:<8}  {3}\n'.format(
+                profile.calls, profile.time * 1000, 'builtin' if profile.is_builtin else 'external', profile.name))
+
+        return ''.join(parts)
+
+
+class ProfilingInterpreter(Interpreter):
+    # Only this subclass pays for timing, a plain Interpreter runs the untouched loop.
+    def __init__(self, profiler: Profiler) -> None:
+        super().__init__()
+        self.profiler = profiler
+
+    def resume(self) -> bool:
+        code_len = len(self.code)
+        profiler = self.profiler
+        clock = time.perf_counter
+        try:
+            while self.pc < code_len:
+                instruction = self.code[self.pc]
+                command_name = None
+                if type(instruction) is CallInstruction and 0 < self.reg_a <= len(self.stack):
+                    command_name = self.stack[len(self.stack) - self.reg_a]
+                start = clock()
+                try:
+                    instruction.accept(self)
+                finally:
+                    elapsed = clock() - start
+                    profiler.record_instruction(instruction, elapsed)
+                    if command_name is not None:
+                        profiler.record_command(command_name, command_name in self.builtins, elapsed)
+                self.pc += 1
+        except ExecutionError as e:
+            self.abort(e)
+            return False
+        return True
@@ -0,0 +1,163 @@
+import collections
+import os
+import sys
+import time
+from typing import Any, Dict, Mapping, Optional, Sequence, TextIO, Tuple, TYPE_CHECKING
+
+from pysh.codegen import CodeGenerator
+from pysh.instructions import Instruction
+from pysh.interpreter import Context, Interpreter, install_builtins, exit_status
+from pysh.lexer import Lexer
+from pysh.parser import Parser, ParseError
+from pysh.slots import SlotTable
+from pysh.verifier import VerificationError, verify
+
+if TYPE_CHECKING:
+    from pysh.metrics import Metrics
+
+
+class Program(object):
+    def __init__(self, code: Sequence[Instruction], slot_table: Optional[SlotTable] = None) -> None:
+        self.code: Tuple[Instruction, ...] = tuple(code)
+        # Only read while running, shared by every run like the code.
+        self.slot_table = slot_table if slot_table is not None else SlotTable()
+        self.stack_depth = self.verify()
+
+    def verify(self) -> Optional[int]:
+        # The most values the program keeps on the stack, None when it didn't pass the verifier. Such a program still
+        # runs, with the checks verified code goes without.
+        try:
+            return verify(self.code)
+        except VerificationError:
+            return None
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        # The verifier only decides whether the run-time checks can be skipped, as it does for compiled code. It doesn't
+        # make a pickle from an untrusted source safe, unpickling runs before it and the fields of instructions aren't
+        # checked. Load such data with a restricted unpickler, as pysh-cluster does, or not at all.
+        self.__dict__.update(state)
+        self.stack_depth = self.verify()
+
+    def run(self, env: Optional[Mapping[str, str]] = None, cwd: Optional[str] = None,
+            stdout: Optional[TextIO] = None, context: Optional[Context] = None,
+            arguments: Optional[Sequence[str]] = None, metrics: Optional['Metrics'] = None,
+            stderr: Optional[TextIO] = None) -> int:
+        # Every run gets its own interpreter and context, the instructions are only ever read. This makes it safe to
+        # run one program many times, also from several threads at once.
+        interpreter = Interpreter()
+        self.prepare(interpreter, env, cwd, stdout, stderr, context, arguments)
+        interpreter.metrics = metrics
+        start = time.perf_counter()
+        try:
+            status = interpreter.run(self.code, self.stack_depth is not None)
+        except SystemExit as e:
+            status = exit_status(e)
+        finally:
+            flush(stdout)
+            if stderr is not None:
+                stderr.flush()
+        if metrics is not None:
+            metrics.record_run(status, time.perf_counter() - start)
+        return status
+
+    async def run_async(self, env: Optional[Mapping[str, str]] = None, cwd: Optional[str] = None,
+                        stdout: Optional[TextIO] = None, context: Optional[Context] = None,
+                        arguments: Optional[Sequence[str]] = None, metrics: Optional['Metrics'] = None,
+                        stderr: Optional[TextIO] = None) -> int:
+        # Like run, but external commands are awaited, so many programs can run concurrently on one event loop.
+        from pysh.asyncinterpreter import AsyncInterpreter
+
+        interpreter = AsyncInterpreter()
+        self.prepare(interpreter, env, cwd, stdout, stderr, context, arguments)
+        interpreter.metrics = metrics
+        start = time.perf_counter()
+        try:
+            status = await interpreter.run(self.code, self.stack_depth is not None)
+        except SystemExit as e:
+            status = exit_status(e)
+        finally:
+            flush(stdout)
+            if stderr is not None:
+                stderr.flush()
+        if metrics is not None:
+            metrics.record_run(status, time.perf_counter() - start)
+        return status
+
+    def prepare(self, interpreter: Interpreter, env: Optional[Mapping[str, str]], cwd: Optional[str],
+                stdout: Optional[TextIO], stderr: Optional[TextIO], context: Optional[Context],
+                arguments: Optional[Sequence[str]]) -> None:
+        install_builtins(interpreter)
+        interpreter.stdout = stdout
+        interpreter.stderr = stderr
+        interpreter.slot_table = self.slot_table
+        if arguments is not None:
+            # $0 and on.
+            interpreter.positional_parameters = list(arguments)
+
+        if context is not None:
+            # Runs on a copy-on-write fork, the caller's context never sees our changes. Forking takes a lock, so one
+            # context can be shared by runs on several threads, as long as nobody writes to it meanwhile.
+            interpreter.context = context.fork()
+        context = interpreter.context
+        if cwd is not None or context.parent is None:
+            context.pwd = cwd if cwd is not None else os.getcwd()
+        if env is not None or context.parent is None:
+            for name, value in (env if env is not None else os.environ).items():
+                context.set(name, value)
+                context.export(name)
+
+
+def flush(stdout: Optional[TextIO]) -> None:
+    if stdout is not None:
+        stdout.flush()
+    else:
+        sys.stdout.flush()
+
+
+class Compiler(object):
+    def __init__(self) -> None:
+        self.lexer = Lexer()
+        self.parser = Parser()
+        self.generator = CodeGenerator()
+
+    def compile(self, source: str) -> Program:
+        self.lexer.line = 1
+        self.lexer.column = 1
+        self.parser.reset()
+        if not source.endswith('\n'):
+            source += '\n'
+        nodes = self.parser.parse(self.lexer.lex_all(source))
+        if not self.parser.is_done:
+            self.parser.reset()
+            raise ParseError('Unexpected end of input')
+        # Every program numbers its own variables.
+        slot_table = SlotTable()
+        self.generator.slot_table = slot_table
+        return Program(self.generator.generate(nodes), slot_table)
+
+
+class CompileCache(object):
+    def __init__(self, capacity: int = 256) -> None:
+        self.capacity = capacity
+        self.compiler = Compiler()
+        self.programs: 'collections.OrderedDict[str, Program]' = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def compile(self, source: str) -> Program:
+        program = self.programs.get(source)
+        if program is not None:
+            self.hits += 1
+            self.programs.move_to_end(source)
+            return program
+
+        self.misses += 1
+        program = self.compiler.compile(source)
+        self.programs[source] = program
+        if len(self.programs) > self.capacity:
+            self.programs.popitem(last=False)
+        return program
+
+
+def compile(source: str) -> Program:
+    return Compiler().compile(source)
@@ -0,0 +1,118 @@
+import json
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pysh.builtins import InvokeInfo
+
+
+class CommandUsage(object):
+    def __init__(self, arguments: List[str], is_builtin: bool, line: int) -> None:
+        self.arguments = arguments
+        self.is_builtin = is_builtin
+        self.line = line
+        self.status = 0
+        self.wall_time = 0.0
+        self.user_time = 0.0
+        self.system_time = 0.0
+        # KiB, only known for external commands.
+        self.max_rss: Optional[int] = None
+
+    @property
+    def name(self) -> str:
+        return self.arguments[0]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'command': self.arguments,
+            'builtin': self.is_builtin,
+            'line': self.line,
+            'status': self.status,
+            'wall_time': self.wall_time,
+            'user_time': self.user_time,
+            'system_time': self.system_time,
+            'max_rss': self.max_rss,
+        }
+
+
+def max_rss_kib(ru_maxrss: int) -> int:
+    # Linux reports KiB, macOS reports bytes.
+    return ru_maxrss // 1024 if sys.platform == 'darwin' else ru_maxrss
+
+
+class UsageReport(object):
+    def __init__(self) -> None:
+        self.commands: List[CommandUsage] = []
+
+    def record_external(self, info: InvokeInfo, line: int, status: int, wall_time: float,
+                        rusage: Optional[Any]) -> None:
+        usage = CommandUsage(info.arguments, False, line)
+        usage.status = status
+        usage.wall_time = wall_time
+        if rusage is not None:
+            usage.user_time = rusage.ru_utime
+            usage.system_time = rusage.ru_stime
+            usage.max_rss = max_rss_kib(rusage.ru_maxrss)
+        self.commands.append(usage)
+
+    def timed(self, target: Callable[[InvokeInfo], int], line: int) -> Callable[[InvokeInfo], int]:
+        # Builtins run inside our own process, what they cost shows up in our own process times.
+        def measured(info: InvokeInfo) -> int:
+            usage = CommandUsage(info.arguments, True, line)
+            times_before = os.times()
+            start = time.perf_counter()
+            try:
+                usage.status = target(info)
+                return usage.status
+            finally:
+                usage.wall_time = time.perf_counter() - start
+                times_after = os.times()
+                usage.user_time = times_after.user - times_before.user
+                usage.system_time = times_after.system - times_before.system
+                self.commands.append(usage)
+
+        return measured
+
+    def totals(self) -> List[Tuple[str, bool, int, float, float, float, Optional[int]]]:
+        totals: Dict[Tuple[str, bool], List[Any]] = {}
+        for usage in self.commands:
+            total = totals.get((usage.name, usage.is_builtin))
+            if total is None:
+                total = [0, 0.0, 0.0, 0.0, None]
+                totals[(usage.name, usage.is_builtin)] = total
+            total[0] += 1
+            total[1] += usage.wall_time
+            total[2] += usage.user_time
+            total[3] += usage.system_time
+            if usage.max_rss is not None:
+                total[4] = max(total[4] or 0, usage.max_rss)
+        rows = [(name, is_builtin, total[0], total[1], total[2], total[3], total[4])
+                for (name, is_builtin), total in totals.items()]
+        rows.sort(key=lambda row: row[4] + row[5], reverse=True)
+        return rows
+
+    def make_report(self, limit: int = 20) -> str:
+        parts: List[str] = []
+
+        parts.append('Commands:\n')
+        parts.append('  {0:>6} {1:>6} {2:>10} {3:>10} {4:>10} {5:>12}  {6}\n'.format(
+            'line', 'status', 'wall (ms)', 'user (ms)', 'sys (ms)', 'max rss KiB', 'command'))
+        for usage in self.commands:
+            parts.append('  {0:>6} {1:>6} {2:>10.3f} {3:>10.3f} {4:>10.3f} {5:>12}  {6}\n'.format(
+                usage.line if usage.line > 0 else '?', usage.status, usage.wall_time * 1000, usage.user_time * 1000,
+                usage.system_time * 1000, usage.max_rss if usage.max_rss is not None else '-',
+                ' '.join(usage.arguments)))
+
+        parts.append('Most expensive:\n')
+        parts.append('  {0:>6} {1:>10} {2:>10} {3:>10} {4:>12}  {5:<8}  {6}\n'.format(
+            'calls', 'wall (ms)', 'user (ms)', 'sys (ms)', 'max rss KiB', 'kind', 'command'))
+        for name, is_builtin, calls, wall_time, user_time, system_time, max_rss in self.totals()[:limit]:
+            parts.append('  {0:>6} {1:>10.3f} {2:>10.3f} {3:>10.3f} {4:>12}  {5:<8}  {6}\n'.format(
+                calls, wall_time * 1000, user_time * 1000, system_time * 1000, max_rss if max_rss is not None else '-',
+                'builtin' if is_builtin else 'external', name))
+
+        return ''.join(parts)
+
+    def make_json(self) -> str:
+        return json.dumps({'commands': [usage.to_dict() for usage in self.commands]}, indent=2) + '\n'
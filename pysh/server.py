@@ -0,0 +1,337 @@
+import array
+import json
+import os
+import selectors
+import signal
+import socket
+import stat
+import struct
+import sys
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+from pysh.client import LENGTH_FORMAT, STATUS_FORMAT, decode_request
+from pysh.metrics import Metrics, MetricsEndpoint, MetricsRequest
+from pysh.parser import ParseError
+from pysh.program import CompileCache, Program
+from pysh.unixsockets import bind_private, remove_socket
+
+
+class Request(object):
+    def __init__(self, cwd: str, source: str, env: List[Tuple[str, str]], fds: List[int]) -> None:
+        self.cwd = cwd
+        self.source = source
+        self.env = env
+        self.fds = fds
+
+
+class ServerError(Exception):
+    pass
+
+
+class RequestReader(object):
+    # Collects a request as the client sends it. Reads happen as data arrives, a slow client never holds up the others.
+    header_size = struct.calcsize(LENGTH_FORMAT)
+
+    def __init__(self, conn: socket.socket, deadline: float) -> None:
+        self.conn = conn
+        self.deadline = deadline
+        self.data = b''
+        self.fds: List[int] = []
+
+    def read(self) -> Optional[Request]:
+        # None until the whole request is in.
+        fds = array.array('i')
+        try:
+            data, ancdata, flags, address = self.conn.recvmsg(65536, socket.CMSG_SPACE(3 * fds.itemsize))
+        except BlockingIOError:
+            return None
+        for level, type, payload in ancdata:
+            if level == socket.SOL_SOCKET and type == socket.SCM_RIGHTS:
+                fds.frombytes(payload[:len(payload) - (len(payload) % fds.itemsize)])
+        self.fds.extend(fds)
+        if len(data) == 0:
+            raise ConnectionError('Truncated request')
+        self.data += data
+
+        if len(self.data) < self.header_size:
+            return None
+        length = struct.unpack(LENGTH_FORMAT, self.data[:self.header_size])[0]
+        if len(self.data) < self.header_size + length:
+            return None
+        if len(self.fds) != 3:
+            raise ConnectionError('Expected stdin, stdout and stderr to be passed')
+
+        cwd, source, env = decode_request(self.data[self.header_size:self.header_size + length])
+        fds, self.fds = self.fds, []
+        return Request(cwd, source, env, fds)
+
+    def close(self) -> None:
+        for fd in self.fds:
+            os.close(fd)
+        self.fds = []
+        self.conn.close()
+
+
+def peer_uid(conn: socket.socket) -> Optional[int]:
+    # None where the system can't tell, the permissions of the socket and its directory still apply.
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    credentials = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    return struct.unpack('3i', credentials)[1]
+
+
+def make_private_directory(directory: str) -> None:
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077 != 0:
+        raise ServerError('{0} is not a directory that only we can use'.format(directory))
+
+
+def run_child(request: Request, program: Program, metrics: Optional[Metrics]) -> int:
+    for target, fd in enumerate(request.fds):
+        os.dup2(fd, target)
+        if fd > 2:
+            os.close(fd)
+
+    try:
+        os.chdir(request.cwd)
+        status = program.run(env=dict(request.env), cwd=request.cwd, metrics=metrics)
+    except OSError as e:
+        sys.stderr.write('pysh: {0}\n'.format(e))
+        status = 1
+    sys.stderr.flush()
+    return status
+
+
+class Server(object):
+    # Seconds a client has to send its request in.
+    request_timeout = 5.0
+
+    def __init__(self, path: str, metrics_address: Optional[str] = None, private_directory: bool = False) -> None:
+        self.path = path
+        # Set for the default path, the directory is created for the server and must not be usable by anyone else.
+        self.private_directory = private_directory
+        # Device and inode of the socket we bound, only that is removed on the way out.
+        self.socket_id: Optional[Tuple[int, int]] = None
+        self.cache = CompileCache()
+        self.children: Dict[int, socket.socket] = {}
+        # Connections whose request is still coming in, script requests and metrics requests alike.
+        self.readers: Dict[socket.socket, Union[RequestReader, MetricsRequest]] = {}
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        self.metrics_address = metrics_address
+        self.metrics: Optional[Metrics] = None
+        self.endpoint: Optional[MetricsEndpoint] = None
+        # Children count their own commands and send the counts back over this pair when they are done, one
+        # datagram each.
+        self.metrics_receiver: Optional[socket.socket] = None
+        self.metrics_sender: Optional[socket.socket] = None
+
+    def serve_forever(self) -> int:
+        # Everything a child could need is imported once here instead of in every child.
+        import subprocess
+        import pysh.builtins.test
+
+        try:
+            self.bind()
+            if self.metrics_address is not None:
+                self.start_metrics(self.metrics_address)
+        except (ServerError, OSError) as e:
+            sys.stderr.write('pysh: {0}\n'.format(e))
+            self.listener.close()
+            self.remove_socket()
+            return 1
+
+        os.set_blocking(self.wakeup_read, False)
+        os.set_blocking(self.wakeup_write, False)
+        signal.set_wakeup_fd(self.wakeup_write)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        self.selector.register(self.listener, selectors.EVENT_READ, self.accept)
+        self.selector.register(self.wakeup_read, selectors.EVENT_READ, self.wakeup)
+        try:
+            while True:
+                for key, events in self.selector.select(self.next_timeout()):
+                    key.data()
+                self.expire_requests()
+        except KeyboardInterrupt:
+            return 0
+        finally:
+            self.listener.close()
+            self.remove_socket()
+            if self.endpoint is not None:
+                self.endpoint.close()
+
+    def bind(self) -> None:
+        if self.private_directory:
+            make_private_directory(os.path.dirname(self.path))
+        self.socket_id = bind_private(self.listener, self.path)
+        self.listener.listen(128)
+
+    def remove_socket(self) -> None:
+        if self.socket_id is not None:
+            remove_socket(self.path, self.socket_id)
+
+    def start_metrics(self, address: str) -> None:
+        self.metrics = Metrics()
+        self.metrics.compile_cache = self.cache
+        self.endpoint = MetricsEndpoint(address, self.metrics)
+        self.metrics_receiver, self.metrics_sender = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.metrics_receiver.setblocking(False)
+        self.selector.register(self.endpoint, selectors.EVENT_READ, self.accept_metrics)
+        self.selector.register(self.metrics_receiver, selectors.EVENT_READ, self.receive_metrics)
+
+    def receive_metrics(self) -> None:
+        try:
+            data = self.metrics_receiver.recv(1 << 20)
+            self.metrics.merge(json.loads(data.decode('utf-8')))
+        except (OSError, ValueError, TypeError):
+            pass
+
+    def send_metrics(self, metrics: Metrics) -> None:
+        try:
+            self.metrics_sender.send(json.dumps(metrics.to_dict()).encode('utf-8'))
+        except OSError:
+            pass
+
+    def accept_metrics(self) -> None:
+        try:
+            request = self.endpoint.accept()
+        except OSError:
+            return
+        self.readers[request.conn] = request
+        self.selector.register(request.conn, selectors.EVENT_READ, lambda: self.read_metrics_request(request))
+
+    def read_metrics_request(self, request: MetricsRequest) -> None:
+        try:
+            if not request.read():
+                return
+            self.endpoint.answer(request)
+        except OSError:
+            pass
+        self.drop_reader(request)
+
+    def wakeup(self) -> None:
+        self.drain_wakeup()
+        self.reap()
+
+    def accept(self) -> None:
+        try:
+            conn, address = self.listener.accept()
+        except OSError:
+            return
+        uid = peer_uid(conn)
+        if uid is not None and uid != os.getuid():
+            sys.stderr.write('pysh: refused a connection from uid {0}\n'.format(uid))
+            conn.close()
+            return
+        conn.setblocking(False)
+        reader = RequestReader(conn, time.monotonic() + self.request_timeout)
+        self.readers[conn] = reader
+        self.selector.register(conn, selectors.EVENT_READ, lambda: self.read_request(reader))
+
+    def read_request(self, reader: RequestReader) -> None:
+        try:
+            request = reader.read()
+        except (OSError, ConnectionError, ValueError, IndexError) as e:
+            sys.stderr.write('pysh: bad request: {0}\n'.format(e))
+            self.drop_reader(reader)
+            return
+        if request is None:
+            return
+        self.selector.unregister(reader.conn)
+        del self.readers[reader.conn]
+        reader.conn.setblocking(True)
+        self.run(reader.conn, request)
+
+    def drop_reader(self, reader: Union[RequestReader, MetricsRequest]) -> None:
+        self.selector.unregister(reader.conn)
+        del self.readers[reader.conn]
+        reader.close()
+
+    def next_timeout(self) -> Optional[float]:
+        if len(self.readers) == 0:
+            return None
+        return max(0.0, min(reader.deadline for reader in self.readers.values()) - time.monotonic())
+
+    def expire_requests(self) -> None:
+        now = time.monotonic()
+        for reader in [reader for reader in self.readers.values() if reader.deadline <= now]:
+            sys.stderr.write('pysh: bad request: timed out\n')
+            self.drop_reader(reader)
+
+    def run(self, conn: socket.socket, request: Request) -> None:
+        try:
+            program = self.cache.compile(request.source)
+        except ParseError as e:
+            if self.metrics is not None:
+                self.metrics.parse_errors += 1
+            os.write(request.fds[2], 'pysh: {0}\n'.format(e).encode())
+            self.finish(conn, request, 2)
+            return
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                signal.set_wakeup_fd(-1)
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                self.listener.close()
+                conn.close()
+                for reader in self.readers.values():
+                    reader.close()
+                metrics = Metrics() if self.metrics is not None else None
+                status = run_child(request, program, metrics)
+                if metrics is not None:
+                    self.send_metrics(metrics)
+            finally:
+                os._exit(status & 0xff)
+
+        for fd in request.fds:
+            os.close(fd)
+        self.children[pid] = conn
+
+    def finish(self, conn: socket.socket, request: Request, status: int) -> None:
+        for fd in request.fds:
+            os.close(fd)
+        self.send_status(conn, status)
+
+    def send_status(self, conn: socket.socket, status: int) -> None:
+        try:
+            conn.sendall(struct.pack(STATUS_FORMAT, status))
+        except OSError:
+            pass
+        conn.close()
+
+    def drain_wakeup(self) -> None:
+        try:
+            while os.read(self.wakeup_read, 512):
+                pass
+        except BlockingIOError:
+            pass
+
+    def reap(self) -> None:
+        while len(self.children) > 0:
+            try:
+                pid, wait_status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            conn = self.children.pop(pid, None)
+            if conn is None:
+                continue
+            if os.WIFSIGNALED(wait_status):
+                status = 128 + os.WTERMSIG(wait_status)
+            else:
+                status = os.WEXITSTATUS(wait_status)
+            self.send_status(conn, status)
@@ -0,0 +1,22 @@
+from typing import Dict, List
+
+# Computed by the interpreter on every access, these never get a slot. Neither do the positional parameters.
+special_names = frozenset(['?', '#', '@', '*'])
+
+
+class SlotTable(object):
+    # Numbers the variables of a program, so the interpreter can keep their values in a list instead of looking them up
+    # by name. The code generator fills it in, the interpreter that runs the code needs the same table.
+    def __init__(self) -> None:
+        self.names: List[str] = []
+        self.indices: Dict[str, int] = {}
+
+    def resolve(self, name: str) -> int:
+        if name in special_names or name.isdigit():
+            return -1
+        index = self.indices.get(name)
+        if index is None:
+            index = len(self.names)
+            self.names.append(name)
+            self.indices[name] = index
+        return index
@@ -0,0 +1,61 @@
+import os
+from typing import Dict, Optional, Tuple
+
+
+class StatCache(object):
+    def __init__(self) -> None:
+        self.pwd: Optional[str] = None
+        self.stats: Dict[str, Optional[os.stat_result]] = {}
+        self.lstats: Dict[str, Optional[os.stat_result]] = {}
+        self.accesses: Dict[Tuple[str, int], bool] = {}
+
+    def invalidate(self) -> None:
+        self.stats.clear()
+        self.lstats.clear()
+        self.accesses.clear()
+
+    def check_pwd(self, pwd: str) -> None:
+        # Entries are keyed by the path as written, so they are only valid for the directory they were looked up in.
+        if pwd != self.pwd:
+            self.invalidate()
+            self.pwd = pwd
+
+    def stat(self, path: str, pwd: str) -> Optional[os.stat_result]:
+        self.check_pwd(pwd)
+        try:
+            return self.stats[path]
+        except KeyError:
+            pass
+        try:
+            result: Optional[os.stat_result] = os.stat(os.path.join(pwd, path))
+        except (OSError, ValueError):
+            result = None
+        self.stats[path] = result
+        return result
+
+    def lstat(self, path: str, pwd: str) -> Optional[os.stat_result]:
+        self.check_pwd(pwd)
+        try:
+            return self.lstats[path]
+        except KeyError:
+            pass
+        try:
+            result: Optional[os.stat_result] = os.lstat(os.path.join(pwd, path))
+        except (OSError, ValueError):
+            result = None
+        self.lstats[path] = result
+        return result
+
+    def access(self, path: str, pwd: str, mode: int) -> bool:
+        self.check_pwd(pwd)
+        key = (path, mode)
+        try:
+            return self.accesses[key]
+        except KeyError:
+            pass
+        try:
+            result = os.access(os.path.join(pwd, path), mode)
+        except ValueError:
+            result = False
+        self.accesses[key] = result
+        return result
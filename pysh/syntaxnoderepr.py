@@ -1,7 +1,7 @@
 from typing import List, Iterable
 
 from pysh.syntaxnodes import SyntaxNodeVisitor, ArgumentPartNode, ArgumentNode, CommandNode, AssignmentNode, SyntaxNode, \
-    ConditionalNode, AssignmentsNode
+    ConditionalNode, AssignmentsNode, SubshellNode, AndOrNode, NegationNode, RedirectionNode
 
 
 class SyntaxNodeReprVisitor(SyntaxNodeVisitor):
@@ -23,6 +23,13 @@ class SyntaxNodeReprVisitor(SyntaxNodeVisitor):
         self.indent_level += 1
         self.add_list('env_assignments', node.env_assignments)
         self.add_list('args', node.args)
+        self.add_list('redirections', node.redirections)
+        self.indent_level -= 1
+
+    def visit_redirection_node(self, node: RedirectionNode) -> None:
+        self.add_line('Redirection: fd: {0} operator: {1}\n'.format(node.fd, node.operator))
+        self.indent_level += 1
+        node.target.accept(self)
         self.indent_level -= 1
 
     def visit_assignment_node(self, node: AssignmentNode) -> None:
@@ -48,6 +55,25 @@ class SyntaxNodeReprVisitor(SyntaxNodeVisitor):
         self.add_list('else_nodes', node.else_expressions)
         self.indent_level -= 1
 
+    def visit_subshell_node(self, node: SubshellNode) -> None:
+        self.add_line('Subshell:\n')
+        self.indent_level += 1
+        self.add_list('expressions', node.expressions)
+        self.indent_level -= 1
+
+    def visit_and_or_node(self, node: AndOrNode) -> None:
+        self.add_line('AndOr:\n')
+        self.indent_level += 1
+        self.add_line('operators: {0}\n'.format(', '.join(operator.name for operator in node.operators)))
+        self.add_list('expressions', node.expressions)
+        self.indent_level -= 1
+
+    def visit_negation_node(self, node: NegationNode) -> None:
+        self.add_line('Negation:\n')
+        self.indent_level += 1
+        node.expression.accept(self)
+        self.indent_level -= 1
+
     def add_line(self, val: str) -> None:
         for i in range(self.indent_level):
             self.parts.append('  ')
@@ -1,8 +1,14 @@
 import enum
 from typing import List
 
+from pysh.arithmetic import ArithmeticNode, format_arithmetic
+
 
 class SyntaxNode(object):
+    # Source position of the first token of the node, 0 when unknown.
+    line = 0
+    column = 0
+
     def accept(self, visitor: 'SyntaxNodeVisitor') -> None:
         pass
 
@@ -11,6 +17,10 @@ class ArgumentPartType(enum.Enum):
     CONSTANT = 0
     REPLACEMENT = 1
     REPLACEMENT_SINGLE = 2
+    # Unquoted text containing * ? or [...], expanded against file names.
+    PATTERN = 3
+    # $(( ... )), see ArithmeticPartNode.
+    ARITHMETIC = 4
 
 
 class ArgumentPartNode(SyntaxNode):
@@ -22,6 +32,12 @@ class ArgumentPartNode(SyntaxNode):
         visitor.visit_argument_part_node(self)
 
 
+class ArithmeticPartNode(ArgumentPartNode):
+    def __init__(self, expression: ArithmeticNode) -> None:
+        super().__init__(ArgumentPartType.ARITHMETIC, format_arithmetic(expression))
+        self.expression = expression
+
+
 class ArgumentNode(SyntaxNode):
     def __init__(self) -> None:
         self.parts: List[ArgumentPartNode] = []
@@ -47,10 +63,22 @@ class AssignmentsNode(SyntaxNode):
         visitor.visit_assignments_node(self)
 
 
+class RedirectionNode(SyntaxNode):
+    def __init__(self, fd: int, operator: str, target: ArgumentNode) -> None:
+        self.fd = fd
+        # One of <, >, >>, <& and >&.
+        self.operator = operator
+        self.target = target
+
+    def accept(self, visitor: 'SyntaxNodeVisitor') -> None:
+        visitor.visit_redirection_node(self)
+
+
 class CommandNode(SyntaxNode):
     def __init__(self) -> None:
         self.args: List[ArgumentNode] = []
         self.env_assignments: List[AssignmentNode] = []
+        self.redirections: List[RedirectionNode] = []
 
     def accept(self, visitor: 'SyntaxNodeVisitor') -> None:
         visitor.visit_command_node(self)
@@ -66,6 +94,37 @@ class ConditionalNode(SyntaxNode):
         visitor.visit_conditional_node(self)
 
 
+class SubshellNode(SyntaxNode):
+    def __init__(self) -> None:
+        self.expressions: List[SyntaxNode] = []
+
+    def accept(self, visitor: 'SyntaxNodeVisitor') -> None:
+        visitor.visit_subshell_node(self)
+
+
+class LogicalOperator(enum.Enum):
+    AND = 0
+    OR = 1
+
+
+class AndOrNode(SyntaxNode):
+    def __init__(self) -> None:
+        self.expressions: List[SyntaxNode] = []
+        # operators[i] sits between expressions[i] and expressions[i + 1].
+        self.operators: List[LogicalOperator] = []
+
+    def accept(self, visitor: 'SyntaxNodeVisitor') -> None:
+        visitor.visit_and_or_node(self)
+
+
+class NegationNode(SyntaxNode):
+    def __init__(self, expression: SyntaxNode) -> None:
+        self.expression = expression
+
+    def accept(self, visitor: 'SyntaxNodeVisitor') -> None:
+        visitor.visit_negation_node(self)
+
+
 class SyntaxNodeVisitor(object):
     def visit_argument_part_node(self, node: ArgumentPartNode) -> None:
         raise NotImplementedError()
@@ -84,3 +143,15 @@ class SyntaxNodeVisitor(object):
 
     def visit_conditional_node(self, node: ConditionalNode) -> None:
         raise NotImplementedError()
+
+    def visit_subshell_node(self, node: SubshellNode) -> None:
+        raise NotImplementedError()
+
+    def visit_and_or_node(self, node: AndOrNode) -> None:
+        raise NotImplementedError()
+
+    def visit_negation_node(self, node: NegationNode) -> None:
+        raise NotImplementedError()
+
+    def visit_redirection_node(self, node: RedirectionNode) -> None:
+        raise NotImplementedError()
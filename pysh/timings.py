@@ -0,0 +1,85 @@
+import json
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Any
+
+
+class PhaseTiming(object):
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.calls = 0
+        self.time = 0.0
+        self.peak_memory = 0
+        self.allocated_memory = 0
+        self.allocated_blocks = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'calls': self.calls,
+            'time': self.time,
+            'peak_memory': self.peak_memory,
+            'allocated_memory': self.allocated_memory,
+            'allocated_blocks': self.allocated_blocks,
+            # Whether time was measured with tracemalloc on.
+            'traced': self.name != 'startup',
+        }
+
+
+class PhaseTimer(object):
+    def __init__(self) -> None:
+        self.phases: Dict[str, PhaseTiming] = {}
+        for name in ('startup', 'lex', 'parse', 'codegen', 'execute'):
+            self.phases[name] = PhaseTiming(name)
+
+    def record_startup(self, start: float) -> None:
+        phase = self.phases['startup']
+        phase.calls = 1
+        phase.time = time.perf_counter() - start
+        # Nothing was traced yet. This is what the imports left alive in the whole process, not a difference.
+        phase.allocated_blocks = sys.getallocatedblocks()
+
+    def wrap(self, name: str, func: Callable[..., Any]) -> Callable[..., Any]:
+        phase = self.phases[name]
+        clock = time.perf_counter
+
+        def measured(*args: Any, **kwargs: Any) -> Any:
+            # Traced only while a phase runs, the rest of the process runs at full speed. The phase itself doesn't, its
+            # time includes what tracing costs.
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            elif hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+            blocks_before = sys.getallocatedblocks()
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                phase.time += clock() - start
+                phase.calls += 1
+                memory_after, peak = tracemalloc.get_traced_memory()
+                if started:
+                    tracemalloc.stop()
+                phase.peak_memory = max(phase.peak_memory, peak - memory_before)
+                phase.allocated_memory += memory_after - memory_before
+                phase.allocated_blocks += sys.getallocatedblocks() - blocks_before
+
+        return measured
+
+    def make_report(self) -> str:
+        parts: List[str] = []
+        total = sum(phase.time for phase in self.phases.values())
+        parts.append('{0:<10} {1:>8} {2:>12} {3:>7} {4:>12} {5:>12} {6:>10}\n'.format(
+            'phase', 'calls', 'time (ms)', '%', 'peak (KiB)', 'net (KiB)', 'net blocks'))
+        for phase in self.phases.values():
+            parts.append('{0:<10} {1:>8} {2:>12.3f} {3:>7.1f} {4:>12.1f} {5:>12.1f} {6:>10}\n'.format(
+                phase.name, phase.calls, phase.time * 1000, phase.time * 100 / total if total > 0 else 0,
+                phase.peak_memory / 1024, phase.allocated_memory / 1024, phase.allocated_blocks))
+        parts.append('Times of the other phases are measured with tracemalloc on, they are slower than untraced runs.\n'
+                     'The net blocks of startup count every block alive in the process after the imports.\n')
+        return ''.join(parts)
+
+    def make_json(self) -> str:
+        return json.dumps({name: phase.to_dict() for name, phase in self.phases.items()}, indent=2) + '\n'
@@ -0,0 +1,50 @@
+import os
+import socket
+import stat
+from typing import Tuple
+
+# Unix sockets bound at a path, shared by the server and the metrics endpoint.
+
+
+class SocketPathError(OSError):
+    pass
+
+
+def remove_stale_socket(path: str) -> None:
+    # Left behind by a process that didn't get to clean up. Anything else at the path is left alone.
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+        raise SocketPathError('{0} exists and is not a socket of ours'.format(path))
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(path)
+            return
+    raise SocketPathError('something is already listening on {0}'.format(path))
+
+
+def bind_private(sock: socket.socket, path: str) -> Tuple[int, int]:
+    # Created without any permissions for others, there is no moment in which they could connect. Returns the device
+    # and inode of the socket, for remove_socket.
+    remove_stale_socket(path)
+    umask = os.umask(0o177)
+    try:
+        sock.bind(path)
+    finally:
+        os.umask(umask)
+    st = os.lstat(path)
+    return st.st_dev, st.st_ino
+
+
+def remove_socket(path: str, socket_id: Tuple[int, int]) -> None:
+    # Only the socket we bound, another process may have taken over the path since.
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return
+    if (st.st_dev, st.st_ino) == socket_id:
+        os.unlink(path)
@@ -0,0 +1,202 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pysh.instructions import InstructionVisitor, Instruction, ConcatInstruction, SubstituteInstruction, \
+    SubstituteSingleInstruction, SubstituteEscapedInstruction, ArithmeticInstruction, LoadBufferInstruction, \
+    PushBufferInstruction, ResetAInstruction, IncrementAInstruction, PushAInstruction, PopAInstruction, \
+    GlobInstruction, RedirectInstruction, CallInstruction, SetVarInstruction, BranchReturnValueInstruction, \
+    BranchReturnValueZeroInstruction, NegateReturnValueInstruction, BranchIfANotZeroInstruction, \
+    BranchBufferEmptyInstruction, AddRVToAInstruction, JumpRelativeInstruction, PushContextInstruction, \
+    PopContextInstruction, SetReturnValueInstruction
+
+
+class VerificationError(Exception):
+    pass
+
+
+class StackState(object):
+    # What is known about the stack and register a before an instruction. The stack holds depth values plus however
+    # many word splitting and globbing pushed, a holds a plus the same number. That number is 0 unless expanded is set.
+    # a is None when it can't be known, after a call for example.
+    def __init__(self, depth: int, a: Optional[int], expanded: bool, contexts: int) -> None:
+        self.depth = depth
+        self.a = a
+        self.expanded = expanded
+        self.contexts = contexts
+
+    def key(self) -> Tuple[int, Optional[int], bool, int]:
+        return self.depth, self.a, self.expanded, self.contexts
+
+    def merge(self, other: 'StackState') -> 'StackState':
+        if self.contexts != other.contexts:
+            raise VerificationError('subshells differ between paths')
+        if self.depth == other.depth:
+            return StackState(self.depth, self.a if self.a == other.a else None, self.expanded or other.expanded,
+                              self.contexts)
+        # A path that skipped pushing an empty word. When both went on to count what they pushed, the extra value
+        # counts as an expansion.
+        if self.a is None or other.a is None or self.depth - self.a != other.depth - other.a:
+            raise VerificationError('stack depth differs between paths, {0} and {1}'.format(self.depth, other.depth))
+        lower = self if self.depth < other.depth else other
+        return StackState(lower.depth, lower.a, True, self.contexts)
+
+
+class StackVerifier(InstructionVisitor):
+    # Follows every path through the code, working out the state of the stack before each instruction. Verified code
+    # only jumps within itself, never pops more than it pushed and leaves the stack and the subshells as it found them.
+    def __init__(self, code: Sequence[Instruction]) -> None:
+        self.code = code
+        self.states: Dict[int, StackState] = {}
+        self.pending: List[int] = []
+        self.pc = 0
+        self.state = StackState(0, None, False, 0)
+        self.max_depth = 0
+
+    def verify(self) -> int:
+        self.enter(0, self.state)
+        while len(self.pending) > 0:
+            self.pc = self.pending.pop()
+            self.state = self.states[self.pc]
+            if self.pc == len(self.code):
+                self.check_end()
+                continue
+            try:
+                self.code[self.pc].accept(self)
+            except VerificationError as e:
+                raise VerificationError('instruction {0}: {1}'.format(self.pc, e)) from e
+        return self.max_depth
+
+    def enter(self, pc: int, state: StackState) -> None:
+        if not 0 <= pc <= len(self.code):
+            raise VerificationError('jump target {0} out of range'.format(pc))
+        self.max_depth = max(self.max_depth, state.depth)
+        existing = self.states.get(pc)
+        if existing is not None:
+            state = existing.merge(state)
+            if state.key() == existing.key():
+                return
+        self.states[pc] = state
+        self.pending.append(pc)
+
+    def next(self, state: StackState) -> None:
+        self.enter(self.pc + 1, state)
+
+    def branch(self, offset: int) -> None:
+        self.enter(self.pc + 1 + offset, self.state)
+
+    def check_end(self) -> None:
+        state = self.state
+        if state.contexts != 0:
+            raise VerificationError('{0} subshells left open at the end'.format(state.contexts))
+        if state.depth != 0 or state.expanded:
+            raise VerificationError('stack not empty at the end')
+
+    def visit_concat(self, instruction: ConcatInstruction) -> None:
+        self.next(self.state)
+
+    def visit_substitute(self, instruction: SubstituteInstruction) -> None:
+        state = self.state
+        self.next(StackState(state.depth, state.a, True, state.contexts))
+
+    def visit_substitute_single(self, instruction: SubstituteSingleInstruction) -> None:
+        self.next(self.state)
+
+    def visit_substitute_escaped(self, instruction: SubstituteEscapedInstruction) -> None:
+        self.next(self.state)
+
+    def visit_arithmetic(self, instruction: ArithmeticInstruction) -> None:
+        self.next(self.state)
+
+    def visit_load_buffer(self, instruction: LoadBufferInstruction) -> None:
+        self.next(self.state)
+
+    def visit_push_buffer(self, instruction: PushBufferInstruction) -> None:
+        state = self.state
+        self.next(StackState(state.depth + 1, state.a, state.expanded, state.contexts))
+
+    def visit_reset_a(self, instruction: ResetAInstruction) -> None:
+        state = self.state
+        if state.expanded:
+            raise VerificationError('reseta with an expansion on the stack')
+        self.next(StackState(state.depth, 0, False, state.contexts))
+
+    def visit_increment_a(self, instruction: IncrementAInstruction) -> None:
+        state = self.state
+        self.next(StackState(state.depth, None if state.a is None else state.a + 1, state.expanded, state.contexts))
+
+    def visit_push_a(self, instruction: PushAInstruction) -> None:
+        state = self.state
+        self.next(StackState(state.depth + 1, state.a, state.expanded, state.contexts))
+
+    def visit_pop_a(self, instruction: PopAInstruction) -> None:
+        state = self.state
+        if state.depth == 0:
+            raise VerificationError('popa may underflow the stack')
+        self.next(StackState(state.depth - 1, None, state.expanded, state.contexts))
+
+    def visit_glob(self, instruction: GlobInstruction) -> None:
+        state = self.state
+        self.next(StackState(state.depth, state.a, True, state.contexts))
+
+    def visit_redirect(self, instruction: RedirectInstruction) -> None:
+        self.next(self.state)
+
+    def visit_call(self, instruction: CallInstruction) -> None:
+        state = self.state
+        if state.a is None:
+            raise VerificationError('call with an unknown number of arguments')
+        if state.depth != state.a:
+            raise VerificationError('call with {0} values on the stack for {1} arguments'.format(state.depth, state.a))
+        self.next(StackState(0, None, False, state.contexts))
+
+    def visit_set_var(self, instruction: SetVarInstruction) -> None:
+        self.next(self.state)
+
+    def visit_branch_return_value(self, instruction: BranchReturnValueInstruction) -> None:
+        self.next(self.state)
+        self.branch(instruction.offset)
+
+    def visit_branch_return_value_zero(self, instruction: BranchReturnValueZeroInstruction) -> None:
+        self.next(self.state)
+        self.branch(instruction.offset)
+
+    def visit_negate_return_value(self, instruction: NegateReturnValueInstruction) -> None:
+        self.next(self.state)
+
+    def visit_set_return_value(self, instruction: SetReturnValueInstruction) -> None:
+        self.next(self.state)
+
+    def visit_branch_if_a_not_zero(self, instruction: BranchIfANotZeroInstruction) -> None:
+        self.next(self.state)
+        self.branch(instruction.offset)
+
+    def visit_branch_buffer_empty(self, instruction: BranchBufferEmptyInstruction) -> None:
+        self.next(self.state)
+        self.branch(instruction.offset)
+
+    def visit_add_rv_to_a(self, instruction: AddRVToAInstruction) -> None:
+        state = self.state
+        self.next(StackState(state.depth, None, state.expanded, state.contexts))
+
+    def visit_jump_relative(self, instruction: JumpRelativeInstruction) -> None:
+        self.branch(instruction.offset)
+
+    def visit_push_context(self, instruction: PushContextInstruction) -> None:
+        state = self.state
+        target = self.pc + instruction.offset
+        if not 0 <= target < len(self.code) or type(self.code[target]) is not PopContextInstruction:
+            raise VerificationError('pushctx does not lead to a popctx')
+        inner = StackState(state.depth, state.a, state.expanded, state.contexts + 1)
+        self.next(inner)
+        # exit inside the subshell continues at its popctx, right after a call has taken its arguments.
+        self.enter(target, StackState(0, None, False, inner.contexts))
+
+    def visit_pop_context(self, instruction: PopContextInstruction) -> None:
+        state = self.state
+        if state.contexts == 0:
+            raise VerificationError('popctx outside of a subshell')
+        self.next(StackState(state.depth, state.a, state.expanded, state.contexts - 1))
+
+
+def verify(code: Sequence[Instruction]) -> int:
+    # Returns the most values the code itself keeps on the stack, on top of what word splitting and globbing push.
+    return StackVerifier(code).verify()
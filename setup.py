@@ -106,6 +106,9 @@ setup(
     entry_points={
        'console_scripts': [
            'pysh=pysh:main',
+           'pysh-client=pysh.client:main',
+           'pysh-batch=pysh.batch:main',
+           'pysh-cluster=pysh.cluster:main',
        ],
     },
 )